@@ -1,23 +1,69 @@
 #!/usr/bin/env python3
+import hashlib
+import os
 import uuid
-from collections import defaultdict
-from typing import Dict, List, Optional
+from pathlib import Path
+from typing import Dict, Optional, Set
 
 import dash
+import flask
 import networkx as nx
 from dash import State, no_update, clientside_callback, ClientsideFunction
 import dash_cytoscape as cyto
-from dash import Output, Input
+from dash import Output, Input, html
 
-from backends.clang import build_ast_graph
+from backends.clang.projects import Project, ProjectLoad, SharedProjects, get_project_key
 from ui import TEMPLATE_STRING
-from ui.layout import get_layout
-from utils.networkx import get_parents_recursive
+from ui.layout import get_cyto_layout, get_layout
+from utils.cytoscape import CytoscapeElements, ViewState
+from utils.cytoscape.aggregation import GraphAggregation
+from utils.cytoscape.layout import ElementPositions
+from utils.networkx import ReachabilityIndex, add_truncation_markers, get_neighborhood, get_reachability_index, \
+    get_reachable
+from utils.metrics import METRICS, instrument_server
+from utils.search import SearchIndex
+from utils.snippets import SnippetCache
+from utils.store import get_store
 
 # Load extra layouts
 cyto.load_extra_layouts()
 
-SERVER_STORE = defaultdict(dict)  # semi-persistent store of user projects
+# parsed translation units are kept here across project loads and server restarts
+CACHE_DIR = os.environ.get('CALLGRAPH_CACHE_DIR', str(Path.home() / '.cache' / 'callgraph-explorer'))
+
+
+# graphs of the loaded projects, shared by all sessions that loaded the same path with the same flags.
+# CALLGRAPH_COMPACT=1 keeps them in numpy arrays (see CompactGraph), for projects with millions of calls
+PROJECTS = SharedProjects(compact=os.environ.get('CALLGRAPH_COMPACT', '0') == '1')
+
+
+def adopt_project(entry: Dict):
+    # an entry stored by another worker brings its own copy of the graph, the sessions of this process share one
+    if entry.get('project_key') is None or entry.get('graph_backup') is None:
+        return
+    project = PROJECTS.adopt(entry['project_key'], entry['graph_backup'])
+    if entry.get('graph') is entry['graph_backup']:
+        entry['graph'] = project.graph
+    entry['graph_backup'] = project.graph
+    entry['project'] = project
+
+
+def release_entry(entry: Dict):
+    # an evicted session stops waiting for its load, the project (and its watcher, see Project) goes away with the last
+    # entry referring to it
+    if entry.get('loading') is not None:
+        PROJECTS.release(entry['loading'])
+
+
+# line offsets of recently shown source files, a tap only reads and sends the lines around the function
+SNIPPETS = SnippetCache(max_files=int(os.environ.get('CALLGRAPH_SNIPPET_FILES', 64)))
+
+# semi-persistent store of user projects, per session and path. `sqlite:<filename>` shares it between worker processes
+SERVER_STORE = get_store(os.environ.get('CALLGRAPH_STORE', 'memory'),
+                         max_entries=int(os.environ.get('CALLGRAPH_STORE_MAX_ENTRIES', 64)),
+                         max_bytes=int(float(os.environ.get('CALLGRAPH_STORE_MAX_MB', 2048)) * 2 ** 20),
+                         ttl=float(os.environ.get('CALLGRAPH_STORE_TTL', 24 * 3600)),
+                         on_load=adopt_project, on_evict=release_entry)
 
 external_scripts = [
     {'src': 'static/highlight.min.js', 'type': 'module'},
@@ -32,6 +78,22 @@ app = dash.Dash(__name__,
                 external_stylesheets=external_stylesheets,
                 index_string=TEMPLATE_STRING)
 app.layout = get_layout()
+# /metrics in the Prometheus text format, CALLGRAPH_PROFILE_DIR enables profiling requests (see instrument_server)
+instrument_server(app.server, profile_dir=os.environ.get('CALLGRAPH_PROFILE_DIR'))
+
+
+@METRICS.collector
+def collect_store_metrics():
+    yield 'callgraph_projects', {}, len(PROJECTS)
+    yield 'callgraph_store_entries', {}, len(SERVER_STORE)
+    yield 'callgraph_store_bytes', {}, SERVER_STORE.size
+    sessions = dict()
+    for (session, _), size in SERVER_STORE.sizes().items():
+        # session ids give access to the session, only a hash of them is shown
+        key = hashlib.sha1(str(session).encode()).hexdigest()[:8]
+        sessions[key] = sessions.get(key, 0) + size
+    for key, size in sessions.items():
+        yield 'callgraph_store_session_bytes', {'session': key}, size
 
 #
 # @app.callback(
@@ -91,38 +153,279 @@ clientside_callback(
 @app.callback(
     Output('code-store', 'data'),
     Input('callgraph', 'tapNodeData'),
+    State('path-string', 'value'),
     State('session-store', 'data')
 )
-def store_code(node_data: Optional[Dict], session: Optional[str]):
-    # Code will be stored in local memory
-    # this local memory store then calls the clientside callback (see static/callbacks.js:hl_code)
-    if not node_data:
+def store_code(node_data: Optional[Dict], path, session: Optional[str]):
+    # Only the lines around the function are stored in local memory, the store then calls the clientside callback
+    # (see static/callbacks.js:hl_code) which pages in more lines from /snippet when scrolled to an end
+    if not node_data or not node_data.get('file'):  # groups and truncation markers have no code
+        return no_update
+    if not os.path.isfile(node_data['file']):  # e.g. a graph extracted on another machine, see backends/clang/export.py
         return no_update
     if not session:
         return no_update
+    # the node data comes from the browser, like /snippet only the files of the session's project are read
+    entry = SERVER_STORE.get(session, path)
+    if not entry or node_data['file'] not in get_source_files(entry):
+        return no_update
+
+    snippet = SNIPPETS.window(node_data['file'], node_data['start'], node_data['end'])
+    snippet.update(session=session, path=path)
+    return snippet
+
+
+@app.server.route('/snippet')
+def get_snippet():
+    # lines `first` to `last` of a source file of the project a session loaded, for static/callbacks.js:hl_code
+    args = flask.request.args
+    entry = SERVER_STORE.get(args.get('session'), args.get('path'))
+    filename = args.get('file')
+    if not entry or not filename or filename not in get_source_files(entry):
+        flask.abort(404)
+    try:
+        first = int(args.get('first', 1))
+        last = min(int(args.get('last', first)), first + SNIPPETS.max_lines - 1)
+    except ValueError:
+        flask.abort(400)
+    try:
+        lines, first, last, total = SNIPPETS.lines(filename, first, last)
+    except OSError:
+        flask.abort(404)
+    return flask.jsonify(code='\n'.join(lines), first=first, last=last, total=total)
+
+
+@app.callback(
+    Output('highlight-store', 'data'),
+    Input('callgraph', 'tapNodeData'),
+    State('path-string', 'value'),
+    State('session-store', 'data')
+)
+def highlight_callgraph(node_data: Optional[Dict], path, session: Optional[str]):
+    # a tap only sends the nodes whose highlight changed, they are patched into cytoscape by
+    # the clientside callback (see static/callbacks.js:apply_highlight)
+    if not node_data or not session:
+        return no_update
+    entry = SERVER_STORE.get(session, path)
+    if not entry or entry.get('graph') is None or node_data.get('id') not in entry['graph']:
+        return no_update
+    graph = entry['graph']
+    node = node_data['id']
+
+    view = entry.get('view') or ViewState()
+    with METRICS.span('highlight'):
+        reachability = get_reachability(entry.get('project'), graph, entry.get('reachability'))
+        entry['reachability'] = reachability if graph is not getattr(entry.get('project'), 'graph', None) else None
+        highlighted = ViewState(reachability.ancestors(node) | {node}, node, view.filtered)
+    changed = {n: highlighted.flags(n) for n in highlighted.changed(view) if n in graph}
+    entry['view'] = highlighted
+    SERVER_STORE.put(session, path, entry)
+    return {'nodes': changed}
+
+
+clientside_callback(
+    ClientsideFunction(
+        namespace='clientside',
+        function_name='apply_highlight'
+    ),
+    Output('highlight-applied', 'data'),
+    Input('highlight-store', 'data'),
+)
+
+
+@app.callback(
+    Output('callgraph', 'elements', allow_duplicate=True),
+    Input('callgraph', 'tapNodeData'),
+    State('path-string', 'value'),
+    State('session-store', 'data'),
+    prevent_initial_call=True
+)
+def toggle_group(node_data: Optional[Dict], path, session: Optional[str]):
+    # a tap on a collapsed group shows its members, a tap on an expanded one collapses it again
+    if not node_data or node_data.get('group') != 'true' or not session:
+        return no_update
+    entry = SERVER_STORE.get(session, path)
+    if not entry or not entry.get('aggregation_view'):
+        return no_update
+    if entry.get('aggregation') is None:  # stored by another worker
+        entry['aggregation'] = get_aggregation(entry.get('project'), entry['graph'], entry['aggregation_view'][-1])
+    aggregation = entry['aggregation']  # type: GraphAggregation
+    group = aggregation.group_path(node_data['id'])
+    if group is None:
+        return no_update
+    expanded = set(entry.get('expanded', ()))
+    if group in expanded:
+        expanded = {p for p in expanded if p[:len(group)] != group}  # its subgroups collapse with it
+    else:
+        expanded.add(group)
+    entry['expanded'] = expanded
+    elements = aggregation.elements(expanded, entry.get('view'))
+    if entry.get('positions') is not None:
+        elements = entry['positions'](elements, (*entry['aggregation_view'], frozenset(expanded)))
+    SERVER_STORE.put(session, path, entry)
+    return elements
+
+
+@app.callback(
+    Output('callgraph', 'layout'),
+    Input('server-layout', 'value'),
+)
+def set_layout(server_layout):
+    return get_cyto_layout(server_side=bool(server_layout))
+
+
+@app.callback(
+    Output('filter-suggestions', 'children'),
+    Input('filter', 'value'),
+    State('path-string', 'value'),
+    State('session-store', 'data')
+)
+def suggest_filter(search_value, path, session):
+    # completes the name while typing, the graph is only filtered on enter
+    if not search_value or not session:
+        return []
+    entry = SERVER_STORE.get(session, path)
+    if not entry or entry.get('project') is None:
+        return []
+    index = get_search_index(entry['project'])
+    return [html.Option(value=str(n)) for n in sorted(index.prefix(search_value, limit=20), key=str)]
+
+
+def get_base_graph(project: Project) -> nx.DiGraph:
+    # a watched graph changes under the hands of the renderer, the sessions share a snapshot of each version instead
+    if project.watcher is None:
+        return project.graph
+    return project.cached('snapshot', project.graph.copy)
+
+
+def get_search_index(project: Project) -> SearchIndex:
+    return project.cached('search_index', lambda: SearchIndex(get_base_graph(project).nodes))
+
+
+def get_source_files(entry: Dict) -> Set[str]:
+    # the files a session may read through /snippet, those of the functions in its project
+    def build():
+        return {d['file'] for _, d in graph.nodes(data='data') if d and d.get('file')}
+
+    project = entry.get('project')
+    if project is not None:
+        graph = get_base_graph(project)
+        return project.cached('source_files', build)
+    graph = entry.get('graph_backup', entry.get('graph'))
+    return build() if graph is not None else set()
+
+
+def get_reachability(project: Optional[Project], graph: nx.DiGraph,
+                     reachability: Optional[ReachabilityIndex] = None) -> ReachabilityIndex:
+    # the index of the unfiltered graph is shared by the sessions of the project, filtered views have their own
+    if project is not None and graph is get_base_graph(project):
+        return project.cached('reachability', lambda: get_reachability_index(graph))
+    if reachability is None or reachability.graph is not graph:
+        reachability = get_reachability_index(graph)
+    return reachability
+
+
+def get_aggregation(project: Optional[Project], graph: nx.DiGraph, group_by: str) -> GraphAggregation:
+    # the groups of the unfiltered graph are shared by the sessions of the project, filtered views have their own
+    if project is not None and graph is get_base_graph(project):
+        return project.cached(f'aggregation:{group_by}', lambda: GraphAggregation(graph, group_by))
+    return GraphAggregation(graph, group_by)
+
+
+@app.callback(
+    Output('watch-interval', 'disabled'),
+    Input('load-project-button', 'n_clicks'),
+    State('watch-project', 'value'),
+)
+def enable_watch_interval(n, watch):
+    if n is None:
+        return no_update
+    return not watch
 
-    with open(node_data['file'], 'r') as f:
-        contents = f.read()
-    start = node_data['start']
-    end = node_data['end']
 
-    return {'code': contents, 'start': start, 'end': end, 'filename': node_data['file']}
+@app.callback(
+    Output('load-progress-text', 'children'),
+    Output('load-progress', 'style'),
+    Input('load-interval', 'n_intervals'),
+    Input('load-interval', 'disabled'),
+    Input('cancel-load-button', 'n_clicks'),
+    State('path-string', 'value'),
+    State('session-store', 'data'),
+    prevent_initial_call=True
+)
+def show_load_progress(_n, _disabled, _n_cancel, path, session):
+    # files parsed by the background load of render_callgraph, the button cancels it (or hides how it ended)
+    entry = SERVER_STORE.get(session, path) if session else None
+    if not entry:
+        return no_update, no_update
+    load = entry.get('loading')  # type: Optional[ProjectLoad]
+    context = dash.callback_context
+    cancel = len(context.triggered) and context.triggered[0]['prop_id'] == 'cancel-load-button.n_clicks'
+    if load is not None:
+        if not cancel:
+            return get_load_progress_text(load.progress()), {'display': 'flex'}
+        # only this session stops waiting, the load goes on while another session waits for it
+        PROJECTS.release(load)
+        entry.update(loading=None, loading_key=None, load_progress=dict(load.progress(), state='cancelled'))
+        SERVER_STORE.put(session, path, entry)
+        return get_load_progress_text(entry['load_progress']), {'display': 'flex'}
+    progress = entry.get('load_progress')
+    if cancel or not progress or progress['state'] == 'done' and not progress['failed'] + progress['diagnostics']:
+        return '', {'display': 'none'}
+    return get_load_progress_text(progress), {'display': 'flex'}
+
+
+def get_load_progress_text(progress: Dict) -> str:
+    if progress['state'] == 'failed':
+        return f'Loading failed: {progress["error"]}'
+    total = progress['total'] if progress['total'] is not None else '?'
+    if progress['state'] == 'cancelled':
+        text = f'Loading cancelled after {progress["done"]} of {total} files'
+    elif progress['state'] == 'done':
+        text = f'Loaded {progress["done"]} files'
+    else:
+        text = f'Parsing {progress["done"]} of {total} files'
+        if progress['current']:
+            text += f', {os.path.basename(progress["current"])}'
+    if progress['failed']:
+        text += f', {progress["failed"]} could not be parsed'
+    if progress['diagnostics']:
+        text += f', {progress["diagnostics"]} errors'
+    return text
 
 
 @app.callback(
     Output('callgraph', 'elements'),
     Output('session-store', 'data'),
-    Input('callgraph', 'tapNodeData'),
+    Output('load-interval', 'disabled'),
     Input('filter', 'n_submit'),
     Input('load-project-button', 'n_clicks'),
+    Input('load-interval', 'n_intervals'),
+    Input('watch-interval', 'n_intervals'),
+    Input('group-by', 'value'),
+    Input('server-layout', 'value'),
+    State('callgraph', 'tapNodeData'),  # taps are handled by highlight_callgraph, kept here for full renders
     State('path-string', 'value'),
     State('include-path-string', 'value'),
+    State('pch-header-string', 'value'),
+    State('workers', 'value'),
+    State('watch-project', 'value'),
+    State('project-paths-string', 'value'),
+    State('skip-preamble-bodies', 'value'),
     State('filter', 'value'),
+    State('filter-depth', 'value'),
+    State('filter-max-nodes', 'value'),
     State('session-store', 'data')
 
 )
-def render_callgraph(node_data, _n_sub, _n_load, path, include_path, search_value, session):
-    graph = graph_backup = None  # type: Optional[nx.DiGraph]
+def render_callgraph(_n_sub, _n_load, _n_load_interval, _n_watch, group_by, server_layout, node_data, path,
+                     include_path, pch_header, workers, watch, project_paths, skip_preamble_bodies, search_value, depth,
+                     max_nodes, session):
+    graph = None  # type: Optional[nx.DiGraph]
+    project = None  # type: Optional[Project]
+    reachability = None  # type: Optional[ReachabilityIndex]
+    aggregation = None  # type: Optional[GraphAggregation]
+    expanded = set()
     elements = []
     if session is None:
         # Generate a unique session identifier (e.g., using UUID)
@@ -131,101 +434,163 @@ def render_callgraph(node_data, _n_sub, _n_load, path, include_path, search_valu
         session = session_id
 
     # prepare persistent storage
-    if session not in SERVER_STORE:
-        SERVER_STORE[session] = dict()
-        SERVER_STORE[session][path] = dict()
-    if path in SERVER_STORE[session] and SERVER_STORE[session][path]:
-        graph = SERVER_STORE[session][path]['graph']
-        graph_backup = SERVER_STORE[session][path]['graph_backup']
+    entry = SERVER_STORE.get(session, path) or dict()
+    if entry.get('graph') is not None and entry.get('project') is not None:
+        graph = entry['graph']
+        project = entry['project']
+        reachability = entry.get('reachability')
+        aggregation = entry.get('aggregation')
+        expanded = entry.get('expanded', set())
+    view = entry.get('view') or ViewState()  # highlight state of this session, the graph is shared
+    loading = no_update  # whether load-interval polls a background load
 
     # build graph if load-project-button has been clicked
     context = dash.callback_context
     if len(context.triggered) and context.triggered[0]:
         if context.triggered[0]['prop_id'] == 'load-project-button.n_clicks':
-            graph = build_ast_graph(path, include_path)
-            # noinspection PyTypeChecker
-            graph_backup = graph.copy()
-
-        if context.triggered[0]['prop_id'] == 'filter.n_submit':
-            # noinspection PyTypeChecker
-            graph = graph_backup.copy()
-            for n in graph.nodes:  # remove prior filter highlights
-                graph_backup.nodes[n]['data']['filtered'] = "false"
+            # sessions loading the same project with the same flags share its graph, loading it again rebuilds it
+            options = dict(pch_header=pch_header, watch=bool(watch), project_paths=(project_paths or '').split(),
+                           skip_preamble_bodies=bool(skip_preamble_bodies))
+            reload = project is not None and project.key == get_project_key(path, include_path, **options)
+            load = PROJECTS.load(path, include_path, workers=int(workers or 1), cache_dir=CACHE_DIR, reload=reload,
+                                 **options)
+            if entry.get('loading') is not None:
+                PROJECTS.release(entry['loading'])  # the load this session waited for until now
+            if not load.finished:
+                # parsed in the background, the ticks of load-interval show the graph as far as it is parsed
+                entry.update(loading=load, loading_key=load.key, load_progress=None, search=None)
+                SERVER_STORE.put(session, path, entry)
+                return [], session, False
+            PROJECTS.release(load)
+            if load.result is None:  # failed (or cancelled) before it could be polled, see show_load_progress
+                entry.update(loading=None, loading_key=None, load_progress=load.progress())
+                SERVER_STORE.put(session, path, entry)
+                return no_update, session, True
+            project = load.result
+            graph = get_base_graph(project)
+            view = ViewState()
+            loading = True
+
+        if context.triggered[0]['prop_id'] == 'load-interval.n_intervals':
+            load = entry.get('loading')  # type: Optional[ProjectLoad]
+            if load is None:
+                # the load runs in the worker process that got the click, one of the next ticks goes there
+                return no_update, session, True if entry.get('loading_key') is None else no_update
+            if load.finished:
+                PROJECTS.release(load)
+                entry.update(loading=None, loading_key=None, load_progress=load.progress())  # see show_load_progress
+                loading = True
+                if load.result is None:  # cancelled or failed
+                    SERVER_STORE.put(session, path, entry)
+                    return no_update, session, loading
+                project = load.result
+            else:
+                project = load.partial()
+                if project is None or project is entry.get('project'):
+                    return no_update, session, no_update
+            graph = get_base_graph(project)
+            search = entry.get('search')
+            if search:
+                graph = get_filtered_subgraph(graph, search, get_search_index(project),
+                                              *entry.get('neighborhood', (None, None)), view=view)
+
+        if context.triggered[0]['prop_id'] == 'watch-interval.n_intervals':
+            if project is None or project.watcher is None or project.version == entry.get('version'):
+                return no_update, session, no_update
+            graph = get_base_graph(project)
+            search = entry.get('search')
+            if search:
+                graph = get_filtered_subgraph(graph, search, get_search_index(project),
+                                              *entry.get('neighborhood', (None, None)), view=view)
+
+        if context.triggered[0]['prop_id'] == 'filter.n_submit' and project is not None:
+            graph = get_base_graph(project)
+            view = ViewState()  # remove prior filter highlights
             if search_value:  # do nothing on empty
-                # filter and do not forget to take the backup
-                graph = get_filtered_subgraph(graph, search_value)
+                graph = get_filtered_subgraph(graph, search_value, get_search_index(project), depth, max_nodes,
+                                              view=view)
 
     if graph is not None:
-        # reset all nodes to clean nodes (no highlight, no selection)
-        for n in graph.nodes:
-            graph.nodes[n]['data']['chain'] = 'false'
-            graph.nodes[n]['data']['selected'] = 'false'
-
+        # reset the highlight (no chain, no selection), the search matches stay
+        view = ViewState(filtered=view.filtered)
         if node_data and 'id' in node_data and node_data['id'] in graph.nodes and graph.nodes[node_data['id']]:
-            graph.nodes[node_data['id']]['data']['selected'] = "true"
-            # now highlight
-            graph.nodes[node_data['id']]['data']['chain'] = "true"  # include it
-            for p in get_parents_recursive(graph, node_data['id']):  # G.predecessors(node_data['id']):
-                graph.nodes[p]['data']['chain'] = "true"
-                graph.nodes[p]['data']['relationship'] = "parent"
-
-        # build cytoscape
-        elements = get_cytoscape_data_from_nx(graph)
-
-        if path and path not in SERVER_STORE[session]:
-            SERVER_STORE[session][path] = dict()
-        SERVER_STORE[session][path]['graph'] = graph
-        SERVER_STORE[session][path]['graph_backup'] = graph_backup
-
-    return elements, session
-
-
-def get_cytoscape_data_from_nx(graph: nx.DiGraph) -> List[Dict]:
-    nodes = [dict(data=graph.nodes[k]['data']) for k in graph.nodes if k]
-    node_names = [n['data']['id'] for n in nodes]
-    edges = []
-    for a, b in graph.edges:
-
-        highlight = "true" if graph.nodes[a]['data'].get('chain') == "true" and graph.nodes[b]['data'].get(
-            'chain') == "true" else "false"
-        if not a or not b:
-            continue
-
-        elif a in node_names and b in node_names:
-            edges.append(
-                dict(data=dict(source=a,
-                               target=b,
-                               highlight=highlight))
-            )
+            # now highlight the node and its callers
+            reachability = get_reachability(project, graph, reachability)
+            view = ViewState(reachability.ancestors(node_data['id']) | {node_data['id']}, node_data['id'],
+                             view.filtered)
+
+        # build cytoscape, the elements of a view shown before (same graph version and search) are reused
+        trigger = context.triggered[0]['prop_id'] if len(context.triggered) and context.triggered[0] else None
+        cytoscape_elements = entry.get('elements')
+        if cytoscape_elements is None or trigger == 'load-project-button.n_clicks':
+            cytoscape_elements = CytoscapeElements()
+        search = entry.get('search')
+        neighborhood = entry.get('neighborhood', (None, None))
+        if trigger == 'filter.n_submit':
+            search = search_value
+            neighborhood = (depth, max_nodes)
+        elif trigger == 'load-project-button.n_clicks':
+            search = None
+        view_key = (project.generation, project.version, search or '', *neighborhood)
+        if group_by:
+            # the groups are computed once per view, each set of expanded groups is cached by the aggregation
+            same_view = trigger != 'load-project-button.n_clicks' and \
+                entry.get('aggregation_view') == (*view_key, group_by)
+            if aggregation is None or not same_view:
+                aggregation = get_aggregation(project, graph, group_by)
+                if not same_view:
+                    expanded = aggregation.initial()
+            elements = aggregation.elements(expanded, view)
         else:
-            a_ok = a in node_names
-            b_ok = b in node_names
-            print(f'Some edges are wrong {a} ({a_ok}) and {b} ({b_ok})')
-    elements = [
-        *nodes,
-        *edges,
-    ]
-    return elements
-
-
-def get_filtered_subgraph(graph: nx.DiGraph, search_value: str):
-    target_nodes = set()
-    for n in graph.nodes:
-        if search_value.lower() in n.lower():
-            target_nodes.add(n)
-            graph.nodes[n]['data']['filtered'] = "true"
-
-    reachable_nodes = set()
-    # Perform a breadth-first search from each target node
-    for node in target_nodes:
-        reachable_nodes.update(nx.descendants(graph, node))
-        reachable_nodes.update(nx.ancestors(graph, node))
-    # Include the target nodes themselves
-    reachable_nodes.update(target_nodes)
-    if reachable_nodes:
-        filtered_graph = graph.subgraph(reachable_nodes).copy()
-    else:
-        filtered_graph = nx.DiGraph()  # empty
+            aggregation = None
+            elements = cytoscape_elements(graph, view_key, view)
+        positions = entry.get('positions')
+        if server_layout:
+            # laid out once per view and set of expanded groups, highlights keep the positions
+            if positions is None or trigger == 'load-project-button.n_clicks':
+                positions = ElementPositions()
+            elements = positions(elements, (*view_key, group_by, frozenset(expanded)) if group_by else view_key)
+        else:
+            positions = None
+
+        # a partial graph of a project that is still loading is not shared with other workers, see adopt_project
+        entry.update(graph=graph, graph_backup=get_base_graph(project), project=project,
+                     project_key=project.key if project.complete else None,
+                     reachability=reachability if graph is not get_base_graph(project) else None,
+                     elements=cytoscape_elements, aggregation=aggregation,
+                     aggregation_view=(*view_key, group_by) if aggregation is not None else None, expanded=expanded,
+                     positions=positions,
+                     view=view,  # what the browser shows, see highlight_callgraph
+                     version=project.version, search=search, neighborhood=neighborhood)
+        SERVER_STORE.put(session, path, entry)
+
+    return elements, session, loading
+
+
+def get_filtered_subgraph(graph: nx.DiGraph, search_value: str, index: Optional[SearchIndex] = None,
+                          depth: Optional[int] = None, max_nodes: Optional[int] = None,
+                          view: Optional[ViewState] = None):
+    with METRICS.span('filter'):
+        if index is None:
+            index = SearchIndex(graph.nodes)
+        target_nodes = {n for n in index.search(search_value) if n in graph}
+        if view is not None:
+            view.filtered = target_nodes
+
+        if depth is not None or max_nodes is not None:
+            # bounded ego graph, callers and callees that did not fit are summarized by marker nodes
+            reachable_nodes, hidden, dropped = get_neighborhood(graph, target_nodes,
+                                                                None if depth is None else int(depth),
+                                                                None if max_nodes is None else int(max_nodes))
+        else:
+            # one breadth-first search from all target nodes in each direction, they include the target nodes themselves
+            reachable_nodes = get_reachable(graph, target_nodes) | get_reachable(graph, target_nodes, reverse=True)
+            hidden, dropped = {}, 0
+        if reachable_nodes:
+            filtered_graph = graph.subgraph(reachable_nodes).copy()
+            add_truncation_markers(filtered_graph, hidden, dropped)
+        else:
+            filtered_graph = nx.DiGraph()  # empty
     # graph_backup = graph.copy()
     graph = filtered_graph
     return graph
@@ -1,67 +1,33 @@
 import dataclasses
-import json
+import multiprocessing
 import os.path
-from collections import defaultdict
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
 from pathlib import Path
 from pprint import pprint
-from typing import Union
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 import clang.cindex
 import networkx as nx
-from clang.cindex import CursorKind, Index, Config
+from clang.cindex import CursorKind, Index, Config, CompilationDatabase, CompileCommand, TranslationUnit
 
+from backends.clang.cache import TranslationUnitCache
+from backends.clang.pch import PrecompiledHeaders
+from utils.metrics import METRICS
 
-Config.set_library_path('/Applications/Xcode.app/Contents/Developer/Toolchains/XcodeDefault.xctoolchain/usr/lib')  # Replace with your Clang library path
 
+# the directory of libclang, LIBCLANG_PATH overrides it. Without either libclang is looked up on the library path
+LIBCLANG_PATH = os.environ.get('LIBCLANG_PATH',
+                               '/Applications/Xcode.app/Contents/Developer/Toolchains/XcodeDefault.xctoolchain/usr/lib')
+if 'LIBCLANG_PATH' in os.environ or os.path.isdir(LIBCLANG_PATH):
+    Config.set_library_path(LIBCLANG_PATH)
 
-def get_callgraph() -> nx.DiGraph:
-    graph = nx.DiGraph()
-    for f, ff in CALLGRAPH.items():
-        # get the caller
-        node_info = NODELIST.get(f, None)
-        if node_info is None:
-            continue
-        data = dict(id=f,
-                    label=f,
-                    file=node_info.file,
-                    start=node_info.start,
-                    end=node_info.end,
-                    mangled_name=node_info.mangled_name,
-                    kind=str(node_info.kind),
-                    chain="false")
-        graph.add_node(f, data=data)
-        # get the callees
-        for n in ff:
-            definition = n.get_definition()
-            if definition:
-                data = dict(id=fully_qualified_pretty(definition),
-                            label=fully_qualified_pretty(definition),
-                            file=definition.location.file.name,
-                            start=definition.extent.start.line,
-                            end=definition.extent.end.line,
-                            mangled_name=definition.mangled_name,
-                            kind=str(definition.kind),
-                            chain="false")
-            else:
-                try:
-                    nn = DECLARATIONS[fully_qualified(n)]
-                except KeyError:
-                    nn = {'start': n.extent.start.line, 'end': n.extent.end.line, 'file': n.location.file.name}
-
-                # nr = Node.from_cursor(n)
-                data = dict(id=fully_qualified_pretty(n),
-                            label=fully_qualified_pretty(n),
-                            file=nn['file'],
-                            start=nn['start'],
-                            end=nn['end'],
-                            mangled_name=n.mangled_name,
-                            kind=str(n.kind),
-                            chain="false")
-            graph.add_node(fully_qualified_pretty(n), data=data)
-            graph.add_edge(f, fully_qualified_pretty(n))
-            if f == 'llama_model_loader::llama_model_loader(const std::string &, bool)' and fully_qualified_pretty(n) == 'gguf_get_n_kv(struct gguf_context *)':
-                return graph
-    return graph
+# CXTranslationUnit_Flags the python bindings do not define
+PARSE_CREATE_PREAMBLE_ON_FIRST_PARSE = 0x100
+PARSE_LIMIT_SKIP_FUNCTION_BODIES_TO_PREAMBLE = 0x800
 
 
 @dataclasses.dataclass(frozen=True)
@@ -76,6 +42,7 @@ class Node:
     id: str
     label: str
     chain: str = "false"
+    definition: bool = False  # kept over the declarations of the same function, whatever order they are seen in
 
     @staticmethod
     def from_cursor(cursor: clang.cindex.Cursor):
@@ -89,10 +56,72 @@ class Node:
             kind=str(cursor.kind),
             id=cursor.spelling,
             label=cursor.displayname,
-            chain="false"
+            chain="false",
+            definition=cursor.is_definition()
         )
 
 
+@dataclasses.dataclass(frozen=True)
+class Call:
+    callee: str
+    qualified: str
+    data: Dict[str, Any]
+    resolved: bool  # data comes from the definition, not from the referenced declaration
+
+    @staticmethod
+    def from_cursor(cursor: clang.cindex.Cursor) -> Optional['Call']:
+        if not cursor.location.file:
+            return None  # builtins and implicit declarations have no location
+        callee = fully_qualified_pretty(cursor)
+        definition = cursor.get_definition()
+        if definition and definition.location.file:
+            data = dict(id=fully_qualified_pretty(definition),
+                        label=fully_qualified_pretty(definition),
+                        file=definition.location.file.name,
+                        start=definition.extent.start.line,
+                        end=definition.extent.end.line,
+                        mangled_name=definition.mangled_name,
+                        kind=str(definition.kind),
+                        chain="false")
+            return Call(callee=callee, qualified=fully_qualified(cursor), data=data, resolved=True)
+        data = dict(id=callee,
+                    label=callee,
+                    file=cursor.location.file.name,
+                    start=cursor.extent.start.line,
+                    end=cursor.extent.end.line,
+                    mangled_name=cursor.mangled_name,
+                    kind=str(cursor.kind),
+                    chain="false")
+        return Call(callee=callee, qualified=fully_qualified(cursor), data=data, resolved=False)
+
+
+@dataclasses.dataclass
+class TranslationUnitRecords:
+    """Plain, picklable call graph contributions of a single translation unit"""
+    file: str
+    nodes: Dict[str, Node] = dataclasses.field(default_factory=dict)
+    declarations: Dict[str, Dict] = dataclasses.field(default_factory=dict)
+    symbols: Dict[str, Call] = dataclasses.field(default_factory=dict)  # callees by USR, each resolved once
+    # caller -> callee USR -> lines of the call sites, in the order they were walked
+    calls: Dict[str, Dict[str, List[int]]] = dataclasses.field(default_factory=lambda: defaultdict(dict))
+    includes: List[str] = dataclasses.field(default_factory=list)
+    errors: int = 0  # error diagnostics of the translation unit
+
+
+def add_node(nodes: Dict[str, Node], name: str, node: Node):
+    # a definition is not replaced by a declaration seen later, e.g. in a header parsed after the source file
+    known = nodes.get(name)
+    if known is None or node.definition or not known.definition:
+        nodes[name] = node
+
+
+def add_declaration(declarations: Dict[str, Dict], name: str, declaration: Dict):
+    # the extent of the definition, as for add_node
+    known = declarations.get(name)
+    if known is None or declaration.get('definition') or not known.get('definition'):
+        declarations[name] = declaration
+
+
 def get_diag_info(diag):
     return {
         'severity': diag.severity,
@@ -103,28 +132,67 @@ def get_diag_info(diag):
     }
 
 
+class NameCache(threading.local):
+    """Memoizes qualified names per cursor (libclang cursors hash and compare by identity within their TU)
+
+    Names are resolved through the semantic parents, so caching every scope on the way means each scope is walked
+    only once per translation unit. Clear the cache after every TU, the cursors it holds keep the TU alive.
+    """
+
+    def __init__(self):
+        self.qualified = dict()  # type: Dict[clang.cindex.Cursor, str]
+        self.pretty = dict()  # type: Dict[clang.cindex.Cursor, str]
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.qualified.clear()
+        self.pretty.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+NAMES = NameCache()
+
+
 def fully_qualified(c):
     if c is None:
         return ''
-    elif c.kind == CursorKind.TRANSLATION_UNIT:
-        return ''
+    name = NAMES.qualified.get(c)
+    if name is not None:
+        NAMES.hits += 1
+        return name
+    NAMES.misses += 1
+    if c.kind == CursorKind.TRANSLATION_UNIT:
+        name = ''
     else:
         res = fully_qualified(c.semantic_parent)
         if res != '' and c.kind != CursorKind.VAR_DECL:
-            return res + '::' + c.spelling
-        return c.spelling
+            name = res + '::' + c.spelling
+        else:
+            name = c.spelling
+    NAMES.qualified[c] = name
+    return name
 
 
 def fully_qualified_pretty(c):
     if c is None:
         return ''
-    elif c.kind == CursorKind.TRANSLATION_UNIT:
-        return ''
+    name = NAMES.pretty.get(c)
+    if name is not None:
+        NAMES.hits += 1
+        return name
+    NAMES.misses += 1
+    if c.kind == CursorKind.TRANSLATION_UNIT:
+        name = ''
     else:
         res = fully_qualified(c.semantic_parent)
         if res != '':
-            return res + '::' + c.displayname
-        return c.displayname
+            name = res + '::' + c.displayname
+        else:
+            name = c.displayname
+    NAMES.pretty[c] = name
+    return name
 
 
 def is_excluded(node, xfiles, xprefs):
@@ -144,35 +212,75 @@ def is_excluded(node, xfiles, xprefs):
     return False
 
 
-def show_info(node, xfiles, xprefs, cur_fun=None):
-    if node.kind in [CursorKind.MEMBER_REF_EXPR, CursorKind.CALL_EXPR, CursorKind.DECL_REF_EXPR]:
-        if node.referenced and not is_excluded(node.referenced, xfiles, xprefs):
-            print(f'FN {node.kind}: {fully_qualified_pretty(cur_fun)}, {fully_qualified_pretty(node.referenced)}, {fully_qualified_pretty(node.lexical_parent)}')
-    if not is_excluded(node, xfiles, xprefs):
-        if node.kind == CursorKind.FUNCTION_TEMPLATE:
-            cur_fun = node
-            FULLNAMES[fully_qualified(cur_fun)].add(
-                fully_qualified_pretty(cur_fun))
-            NODELIST[fully_qualified_pretty(cur_fun)] = Node.from_cursor(cur_fun)
-
-        if node.kind == CursorKind.CXX_METHOD or \
-                node.kind == CursorKind.FUNCTION_DECL or \
-                node.kind == CursorKind.CONSTRUCTOR or \
-                node.kind == CursorKind.STRUCT_DECL:
-            # if not is_excluded(node, xfiles, xprefs):
-            cur_fun = node
-            FULLNAMES[fully_qualified(cur_fun)].add(
-                fully_qualified_pretty(cur_fun))
-            NODELIST[fully_qualified_pretty(cur_fun)] = Node.from_cursor(cur_fun)
-            DECLARATIONS[fully_qualified(cur_fun)] = dict(start=node.extent.start.line, end=node.extent.end.line, file=node.location.file.name)
-
-        if node.kind in [CursorKind.CALL_EXPR]:
-
-            if node.referenced:  # and not is_excluded(node.referenced, xfiles, xprefs):
-                CALLGRAPH[fully_qualified_pretty(cur_fun)].append(node.referenced)
-
-    for c in node.get_children():
-        show_info(c, xfiles, xprefs, cur_fun)
+class SubtreeFilter:
+    """Decides per source file whether the cursors from it are walked at all
+
+    Cursors from excluded paths (system headers) are skipped together with their whole subtree, and with
+    `project_paths` only the files below these directories are walked. Paths are resolved (symlinks, `..`) once per
+    file.
+    """
+
+    def __init__(self, xfiles, project_paths=None):
+        self.xfiles = xfiles
+        self.project_paths = [os.path.join(os.path.realpath(p), '') for p in project_paths or []]  # end with a /
+        self._walk = dict()  # type: Dict[str, bool]
+
+    def __call__(self, node) -> bool:
+        file = node.location.file
+        if not file:
+            return True  # implicit code and the translation unit itself
+        name = file.name
+        walk = self._walk.get(name)
+        if walk is None:
+            path = os.path.realpath(name)
+            walk = not any(name.startswith(xf) or path.startswith(xf) for xf in self.xfiles)
+            if walk and self.project_paths:
+                walk = any((path + os.sep).startswith(p) for p in self.project_paths)
+            self._walk[name] = walk
+        return walk
+
+
+def show_info(node, xfiles, xprefs, records: TranslationUnitRecords, cur_fun=None, project_paths=None):
+    # depth first, in the same order as a recursive walk, but without recursion and without descending into system
+    # headers at all
+    walk = SubtreeFilter(xfiles, project_paths)
+    callees = dict()  # type: Dict[str, Optional[Call]]  # by USR, None for callees without a location
+    visited = 0
+    stack = [(node, cur_fun)]
+    while stack:
+        node, cur_fun = stack.pop()
+        visited += 1
+        if not is_excluded(node, xfiles, xprefs):
+            if node.kind == CursorKind.FUNCTION_TEMPLATE:
+                cur_fun = node
+                add_node(records.nodes, fully_qualified_pretty(cur_fun), Node.from_cursor(cur_fun))
+
+            if node.kind == CursorKind.CXX_METHOD or \
+                    node.kind == CursorKind.FUNCTION_DECL or \
+                    node.kind == CursorKind.CONSTRUCTOR or \
+                    node.kind == CursorKind.STRUCT_DECL:
+                # if not is_excluded(node, xfiles, xprefs):
+                cur_fun = node
+                add_node(records.nodes, fully_qualified_pretty(cur_fun), Node.from_cursor(cur_fun))
+                add_declaration(records.declarations, fully_qualified(cur_fun),
+                                dict(start=node.extent.start.line, end=node.extent.end.line,
+                                     file=node.location.file.name, definition=node.is_definition()))
+
+            if node.kind in [CursorKind.CALL_EXPR]:
+
+                referenced = node.referenced
+                if referenced:  # and not is_excluded(node.referenced, xfiles, xprefs):
+                    # a function called from many places (or instantiated many times) is resolved only once
+                    usr = referenced.get_usr() or fully_qualified_pretty(referenced)
+                    if usr not in callees:
+                        call = callees[usr] = Call.from_cursor(referenced)
+                        if call is not None:
+                            records.symbols[usr] = call
+                    if callees[usr] is not None:
+                        records.calls[fully_qualified_pretty(cur_fun)].setdefault(usr, []).append(node.location.line)
+
+        stack.extend((c, cur_fun) for c in reversed([c for c in node.get_children() if walk(c)]))
+    METRICS.inc('callgraph_cursors_visited_total', visited)
 
 
 def pretty_print(n):
@@ -184,60 +292,344 @@ def pretty_print(n):
     return fully_qualified_pretty(n) + v
 
 
-def read_compile_commands(filename):
-    if filename.suffix == '.json':
-        with open(filename) as compdb:
-            return json.load(compdb)
+def get_compile_arguments(cmd: CompileCommand) -> List[str]:
+    # drop the compiler, the input and the output, libclang only needs the flags
+    filename = os.path.normpath(os.path.join(cmd.directory, cmd.filename))
+    arguments = list(cmd.arguments)[1:]
+    args = []
+    skip = False
+    for a in arguments:
+        if skip:
+            skip = False
+        elif a in ('-o', '-MF', '-MT', '-MQ'):
+            skip = True
+        elif a in ('-c', '-M', '-MM', '-MD', '-MMD') or a == cmd.filename or \
+                os.path.normpath(os.path.join(cmd.directory, a)) == filename:
+            continue
+        else:
+            args.append(a)
+    return [f'-working-directory={cmd.directory}', *args]
+
+
+def read_compile_commands(filename: Path) -> List[Dict]:
+    # compile_commands.json or the directory containing it, one entry per translation unit
+    directory = filename.parent if filename.suffix == '.json' else filename
+    db = CompilationDatabase.fromDirectory(str(directory))
+    commands = []
+    seen = set()
+    for cmd in db.getAllCompileCommands() or []:
+        file = os.path.normpath(os.path.join(cmd.directory, cmd.filename))
+        if file in seen:  # the same TU built in several configurations, the first one wins
+            continue
+        seen.add(file)
+        commands.append({'file': file, 'directory': cmd.directory, 'arguments': get_compile_arguments(cmd)})
+    return commands
+
+
+def analyze_source_file(cmd: Dict, cfg, index, cache: Optional[TranslationUnitCache] = None,
+                        pch: Optional[PrecompiledHeaders] = None) -> TranslationUnitRecords:
+    c = cmd['arguments']
+    key = cache.key(cmd['file'], c, cfg) if cache is not None else None
+    if key is not None:
+        records = cache.get(key)
+        if records is not None:
+            # the records may have been written by a load that spelled the file differently (cwd, symlink, ...)
+            records.file = str(cmd['file'])
+            print(f"{cmd['file']} (cached)")
+            METRICS.inc('callgraph_translation_units_total', result='cached')
+            return records
+
+    precompiled = pch.get(cfg['pch_header'], c) if pch is not None else None
+    if precompiled is not None:
+        c = [*c, '-include-pch', precompiled[0]]
+    with METRICS.span('parse'):
+        tu = index.parse(cmd['file'], c, options=cfg['parse_options'])  # , '-x c++','-std=c++11'
+    print(cmd['file'])
+    if not tu:
+        print("unable to load input")
+
+    records = TranslationUnitRecords(file=str(cmd['file']))
+    for d in tu.diagnostics:
+        if d.severity == d.Error or d.severity == d.Fatal:
+            # print(' '.join(c))
+            pprint(('diags', list(map(get_diag_info, tu.diagnostics))))
+            records.errors += 1
+
+    NAMES.clear()
+    with METRICS.span('walk'):
+        show_info(tu.cursor, cfg['excluded_paths'], cfg['excluded_prefixes'], records,
+                  project_paths=cfg['project_paths'])
+    records.includes = sorted({i.include.name for i in tu.get_includes()})
+    if precompiled is not None:  # the headers in the PCH are not reported as includes
+        records.includes = sorted({*records.includes, *precompiled[1]})
+    METRICS.inc('callgraph_name_cache_total', NAMES.hits, result='hit')
+    METRICS.inc('callgraph_name_cache_total', NAMES.misses, result='miss')
+    METRICS.inc('callgraph_diagnostics_total', records.errors)
+    METRICS.inc('callgraph_translation_units_total', result='parsed')
+    NAMES.clear()
+    del tu  # only plain records leave this function, the TU can be freed right away
+    if key is not None:
+        cache.put(key, records)
+    return records
+
+
+_WORKER_INDEX = None  # one libclang index per worker process
+_WORKER_CACHE = None
+_WORKER_PCH = None
+
+
+def open_cache(cfg) -> Optional[TranslationUnitCache]:
+    if not cfg.get('cache_dir'):
+        return None
+    return TranslationUnitCache(cfg['cache_dir'])
+
+
+def open_precompiled_headers(cfg, index) -> Optional[PrecompiledHeaders]:
+    if not cfg.get('pch_header'):
+        return None
+    return PrecompiledHeaders(os.path.join(cfg['cache_dir'] or tempfile.gettempdir(), 'pch'), index)
+
+
+def get_mp_context() -> multiprocessing.context.BaseContext:
+    # the workers start from a clean server process (or a fresh interpreter on Windows) instead of a fork of this one
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def _init_worker():
+    # a worker forked from the server starts with a copy of its metrics, they must not be sent back and counted twice
+    METRICS.drain()
+
+
+def _analyze_in_worker(cmd: Dict, cfg) -> Tuple[TranslationUnitRecords, Dict]:
+    # the metrics counted in the worker go back with the records, see Metrics.merge
+    global _WORKER_INDEX, _WORKER_CACHE, _WORKER_PCH
+    if _WORKER_INDEX is None:
+        _WORKER_INDEX = Index.create()
+        _WORKER_CACHE = open_cache(cfg)
+        _WORKER_PCH = open_precompiled_headers(cfg, _WORKER_INDEX)
+    try:
+        return analyze_source_file(cmd, cfg, _WORKER_INDEX, _WORKER_CACHE, _WORKER_PCH), METRICS.drain()
+    except Exception:
+        METRICS.drain()
+        raise
+
+
+class CallGraphBuilder:
+    """Merges the records of translation units into a call graph
+
+    A builder only holds plain records (no cursors, so no translation units are kept alive) and belongs to a single
+    load, throw it away or `clear` it once the graph is built.
+    """
+
+    def __init__(self):
+        self.callgraph = defaultdict(dict)  # type: Dict[str, Dict[str, List[int]]]
+        self.nodelist = dict()  # type: Dict[str, Node]
+        self.declarations = dict()  # type: Dict[str, Dict]
+        self.symbols = dict()  # type: Dict[str, Call]  # callees of the whole load by USR
+
+    def add(self, records: TranslationUnitRecords):
+        for name, node in records.nodes.items():
+            add_node(self.nodelist, name, node)
+        for name, declaration in records.declarations.items():
+            add_declaration(self.declarations, name, declaration)
+        for usr, call in records.symbols.items():
+            known = self.symbols.get(usr)
+            if known is None or call.resolved or not known.resolved:  # a definition seen by any TU wins
+                self.symbols[usr] = call
+        for caller, callees in records.calls.items():
+            merged = self.callgraph[caller]
+            for usr, lines in callees.items():
+                old = merged.get(usr)
+                if old is None or old == lines:
+                    merged[usr] = lines
+                else:
+                    # a caller in a header is walked by every TU including it, its call sites are the same ones
+                    merged[usr] = sorted((Counter(old) | Counter(lines)).elements())
+
+    def merge(self, records: Iterable[TranslationUnitRecords]) -> 'CallGraphBuilder':
+        # merge in file order so that the parallel and the serial path produce the same graph
+        for r in records:
+            self.add(r)
+        return self
+
+    def build(self) -> nx.DiGraph:
+        with METRICS.span('build'):
+            graph = self._build()
+        METRICS.set('callgraph_graph_nodes', graph.number_of_nodes())
+        METRICS.set('callgraph_graph_edges', graph.number_of_edges())
+        return graph
+
+    def _build(self) -> nx.DiGraph:
+        graph = nx.DiGraph()
+        for f, ff in self.callgraph.items():
+            # get the caller
+            node_info = self.nodelist.get(f, None)
+            if node_info is None:
+                continue
+            data = dict(id=f,
+                        label=f,
+                        file=node_info.file,
+                        start=node_info.start,
+                        end=node_info.end,
+                        mangled_name=node_info.mangled_name,
+                        kind=str(node_info.kind),
+                        chain="false")
+            graph.add_node(f, data=data)
+            # get the callees, an edge counts the call sites and keeps their lines
+            for usr, lines in ff.items():
+                call = self.symbols[usr]
+                data = dict(call.data)
+                if not call.resolved:
+                    # prefer the extent recorded while walking the project files
+                    nn = self.declarations.get(call.qualified)
+                    if nn is not None:
+                        data.update(file=nn['file'], start=nn['start'], end=nn['end'])
+                graph.add_node(call.callee, data=data)
+                edge = graph.get_edge_data(f, call.callee)
+                if edge is None:
+                    graph.add_edge(f, call.callee, count=len(lines), lines=list(lines))
+                else:  # several USRs with the same name, e.g. a function declared static in two files
+                    edge['lines'] = sorted(edge['lines'] + lines)
+                    edge['count'] = len(edge['lines'])
+        return graph
+
+    def clear(self):
+        self.callgraph.clear()
+        self.nodelist.clear()
+        self.declarations.clear()
+        self.symbols.clear()
+
+
+def get_graph_from_records(records: Iterable[TranslationUnitRecords]) -> nx.DiGraph:
+    return CallGraphBuilder().merge(records).build()
+
+
+def get_compilation_database(path) -> Optional[Path]:
+    path = Path(path)
+    if path.suffix == '.json' and path.is_file():
+        return path
+    if path.is_dir() and (path / 'compile_commands.json').is_file():
+        return path / 'compile_commands.json'
+    return None
+
+
+def get_translation_units(path, cfg) -> List[Dict]:
+    # with a compilation database only the TUs listed there are parsed, each with its own flags. A config without
+    # project paths gets the directory of the project, see get_project_directory
+    database = get_compilation_database(path)
+    if database is not None:
+        commands = read_compile_commands(database)
+        for cmd in commands:
+            cmd['arguments'] = cmd['arguments'] + cfg['clang_args']
     else:
-        return [{'command': '', 'file': filename}]
+        commands = [{'file': file, 'directory': None, 'arguments': cfg['clang_args']} for file in get_source_files(path)]
+    if cfg['project_paths'] is None:
+        cfg['project_paths'] = [get_project_directory(path, commands)]
+    return commands
 
 
-def analyze_source_files(file: Union[str, Path], cfg, index):
-    print('reading source files...')
-    for cmd in read_compile_commands(file):
+def get_project_directory(path, commands: List[Dict]) -> str:
+    # the directory containing the compilation database (or the scanned directory) and every translation unit, builds
+    # out of the source tree keep compile_commands.json in a directory next to the sources
+    database = get_compilation_database(path)
+    root = database.parent if database is not None else Path(path) if os.path.isdir(path) else Path(path).parent
+    return os.path.commonpath([os.path.realpath(p) for p in [root, *(cmd['file'] for cmd in commands)]])
 
-        c = cfg['clang_args']
-        tu = index.parse(cmd['file'], c)  # , '-x c++','-std=c++11'
-        print(cmd['file'])
-        if not tu:
-            print("unable to load input")
-
-        for d in tu.diagnostics:
-            if d.severity == d.Error or d.severity == d.Fatal:
-                # print(' '.join(c))
-                pprint(('diags', list(map(get_diag_info, tu.diagnostics))))
-
-        show_info(tu.cursor, cfg['excluded_paths'], cfg['excluded_prefixes'])
-
-
-def build_ast_graph(path, include_path) -> nx.DiGraph:
 
+def get_source_files(path) -> List[Path]:
     if os.path.isfile(path):
-        files = [Path(path)]
+        return [Path(path)]
+    files = []
+    for p in Path(path).rglob('*'):
+        if p.suffix in ['c.', '.cpp', '.h', '.hpp']:
+            files.append(p)
+    return sorted(files)  # the same order on every machine, see backends/clang/export.py --shard
+
+
+def get_config(include_path, cache_dir: Optional[Union[str, Path]] = None, project_paths: Optional[List[str]] = None,
+               skip_preamble_bodies: bool = False, pch_header: Optional[Union[str, Path]] = None):
+    parse_options = TranslationUnit.PARSE_NONE
+    if skip_preamble_bodies:
+        # only the bodies of the headers at the top of the main file are skipped, functions defined inline in project
+        # headers included there lose their calls
+        parse_options = TranslationUnit.PARSE_SKIP_FUNCTION_BODIES | TranslationUnit.PARSE_PRECOMPILED_PREAMBLE | \
+            PARSE_CREATE_PREAMBLE_ON_FIRST_PARSE | PARSE_LIMIT_SKIP_FUNCTION_BODIES_TO_PREAMBLE
+    return {'db': None,
+            'clang_args': include_path.split(),
+            'excluded_prefixes': ['std::', '__libcpp', 'operator', '__builtin', '__c11_atomic'],
+            'excluded_paths': ['/usr', '/Applications'],
+            # only files below these are walked, None for the directory of the project (see get_translation_units)
+            'project_paths': [str(p) for p in project_paths] if project_paths is not None else None,
+            'parse_options': parse_options,
+            'pch_header': str(pch_header) if pch_header else None,  # prefix header with the includes shared by all TUs
+            'config_filename': None,
+            'cache_dir': str(cache_dir) if cache_dir else None,
+            }
+
+
+def analyze_files(commands: List[Dict], cfg, workers: int = 1,
+                  on_error: Optional[Callable[[Dict, Exception], None]] = None) -> Iterator[TranslationUnitRecords]:
+    # yields the records of each translation unit in order, see analyze_commands
+    with closing(analyze_commands(commands, cfg, workers, on_error)) as results:
+        for _, records in results:
+            yield records
+
+
+def analyze_commands(commands: List[Dict], cfg, workers: int = 1,
+                     on_error: Optional[Callable[[Dict, Exception], None]] = None
+                     ) -> Iterator[Tuple[Dict, TranslationUnitRecords]]:
+    # yields each command with the records of its translation unit in order. With `on_error` a translation unit that
+    # fails is passed to it and skipped instead of ending the load. Closing the iterator early cancels the translation
+    # units not started
+    if workers and workers > 1 and len(commands) > 1:
+        # loads run in a thread of a threaded server, a forked worker could inherit a lock another thread holds
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(commands)), mp_context=get_mp_context(),
+                                   initializer=_init_worker)
+        try:
+            futures = [pool.submit(_analyze_in_worker, cmd, cfg) for cmd in commands]
+            for cmd, future in zip(commands, futures):
+                try:
+                    records, counted = future.result()
+                except Exception as e:
+                    METRICS.inc('callgraph_translation_units_total', result='failed')
+                    if on_error is None:
+                        raise
+                    on_error(cmd, e)
+                    continue
+                METRICS.merge(counted)
+                yield cmd, records
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
     else:
-        files = []
-        for p in Path(path).rglob('*'):
-            if p.suffix in ['c.', '.cpp', '.h', '.hpp']:
-                files.append(p)
-
-    cfg = {'db': None,
-           'clang_args': include_path.split(),
-           'excluded_prefixes': ['std::', '__libcpp', 'operator', '__builtin', '__c11_atomic'],
-           'excluded_paths': ['/usr', '/Applications'],
-           'config_filename': None,
-           }
-    index = Index.create()
-    for file in files:
-        analyze_source_files(file, cfg, index)
-
-    graph = get_callgraph()
+        index = Index.create()
+        cache = open_cache(cfg)
+        pch = open_precompiled_headers(cfg, index)
+        try:
+            for cmd in commands:
+                try:
+                    records = analyze_source_file(cmd, cfg, index, cache, pch)
+                except Exception as e:
+                    METRICS.inc('callgraph_translation_units_total', result='failed')
+                    if on_error is None:
+                        raise
+                    on_error(cmd, e)
+                    continue
+                yield cmd, records
+        finally:
+            if cache is not None:
+                cache.close()
+
+
+def build_ast_graph(path, include_path, workers: int = 1, cache_dir: Optional[Union[str, Path]] = None,
+                    **options) -> nx.DiGraph:
+    cfg = get_config(include_path, cache_dir, **options)
+    print('reading source files...')
+    builder = CallGraphBuilder()
+    builder.merge(analyze_files(get_translation_units(path, cfg), cfg, workers))
+
+    graph = builder.build()
+    builder.clear()
     print(graph)
 
     return graph
-
-
-CALLGRAPH = defaultdict(list)
-SECONDARY_CALLGRAPH = defaultdict(list)
-FULLNAMES = defaultdict(set)
-NODELIST = defaultdict()
-DECLARATIONS = defaultdict()
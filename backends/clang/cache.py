@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+CACHE_VERSION = 5  # bump whenever the pickled records change shape
+
+
+class FileDigests:
+    """Content digests of files, each version of a file (path, mtime, size) is only hashed once"""
+
+    def __init__(self):
+        self._digests = {}  # type: Dict[Tuple[str, int, int], str]
+
+    def __call__(self, filename: Union[str, Path]) -> Optional[str]:
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        stamp = (str(filename), st.st_mtime_ns, st.st_size)
+        if stamp not in self._digests:
+            h = hashlib.sha1()
+            with open(filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            self._digests[stamp] = h.hexdigest()
+        return self._digests[stamp]
+
+
+class TranslationUnitCache:
+    """On-disk store of the extracted records of each translation unit
+
+    Entries are keyed by the source file as spelled by its compile command, its content and the flags it was parsed
+    with. The headers a translation unit included are stored alongside with their content digest and checked on every
+    lookup, so touching a header invalidates every translation unit that includes it.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path]):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.filename = os.path.join(cache_dir, 'translation-units.sqlite')
+        # several worker processes may write at the same time
+        self.connection = sqlite3.connect(self.filename, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS tu ('
+                                'key TEXT PRIMARY KEY, file TEXT, dependencies TEXT, records BLOB)')
+        self.connection.commit()
+        # headers are shared by most translation units, hash each version only once
+        self.digest = FileDigests()
+
+    def key(self, filename: Union[str, Path], arguments: List[str], cfg) -> Optional[str]:
+        digest = self.digest(filename)
+        if digest is None:
+            return None
+        flags = json.dumps([arguments, cfg['excluded_paths'], cfg['excluded_prefixes'], cfg['project_paths'],
+                            cfg['parse_options']])
+        h = hashlib.sha1()
+        # the locations in the records are spelled like the file, relative to the working directory when it is
+        for part in (str(CACHE_VERSION), os.path.abspath(filename), str(filename), digest, flags):
+            h.update(part.encode())
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def get(self, key: str):
+        row = self.connection.execute('SELECT dependencies, records FROM tu WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        for filename, digest in json.loads(row[0]):
+            if self.digest(filename) != digest:
+                return None
+        try:
+            return pickle.loads(row[1])
+        except Exception:  # written by an incompatible version
+            return None
+
+    def put(self, key: str, records):
+        dependencies = [(filename, self.digest(filename)) for filename in records.includes]
+        self.connection.execute('INSERT OR REPLACE INTO tu (key, file, dependencies, records) VALUES (?, ?, ?, ?)',
+                                (key, records.file, json.dumps(dependencies),
+                                 pickle.dumps(records, protocol=pickle.HIGHEST_PROTOCOL)))
+        self.connection.commit()
+
+    def clear(self):
+        self.connection.execute('DELETE FROM tu')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""Extracts the call graph of a project into a file the explorer loads without parsing anything
+
+    python -m backends.clang.export ./src --flags "-I./src -std=c++17" -o callgraph.jsonl.gz
+    python -m backends.clang.export callgraph.jsonl.gz --compact callgraph.compact
+
+    python -m backends.clang.export ./src --flags "-I./src -std=c++17" --shard 0/3 -o shard-0.jsonl.gz
+    ... (--shard 1/3 and 2/3 on other machines)
+    python -m backends.clang.export --merge shard-*.jsonl.gz -o callgraph.jsonl.gz
+
+The records of each translation unit are written as one JSON line as soon as it is parsed, so the graph is never held
+in memory while extracting. Loading the file merges them in the same order as a load from the sources, the graph is
+the same. `--compact` also writes a CompactGraph directory (needs numpy), its arrays are memory-mapped when it is
+loaded. Either one can be entered as the path of a project in the explorer.
+
+`--shard K/N` only extracts every N-th translation unit starting with the K-th, each line keeps the position of its
+translation unit in the whole project. `--merge` checks that the shards were split from the same list of translation
+units and merges them back in that order, so the functions seen by several shards (e.g. defined in headers) end up
+as the same nodes and the graph is the same as from a single run.
+"""
+import argparse
+import gzip
+import hashlib
+import heapq
+import json
+import os
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import networkx as nx
+
+from backends.clang import Call, CallGraphBuilder, Node, TranslationUnitRecords, analyze_commands, analyze_files, \
+    get_config, get_translation_units
+from utils.networkx.compact import CompactGraph
+
+RECORDS_SUFFIXES = ('.jsonl', '.jsonl.gz')
+RECORDS_FORMAT = 'callgraph-records'
+RECORDS_VERSION = 3
+
+
+def get_artifact_format(path: Union[str, Path, None]) -> Optional[str]:
+    """`records` for JSON lines written by `write_records`, `compact` for a CompactGraph directory, None for sources"""
+    if not path:
+        return None
+    path = str(path)
+    if path.endswith(RECORDS_SUFFIXES) and os.path.isfile(path):
+        return 'records'
+    if os.path.isfile(os.path.join(path, 'graph.json')) and os.path.isfile(os.path.join(path, 'indptr.npy')):
+        return 'compact'  # the format and version are checked by CompactGraph.load
+    return None
+
+
+def _open(filename: Union[str, Path], mode: str) -> IO[str]:
+    if str(filename).endswith('.gz'):
+        return gzip.open(filename, mode + 't', encoding='utf-8', compresslevel=6)
+    return open(filename, mode, encoding='utf-8')
+
+
+def records_to_json(records: TranslationUnitRecords) -> Dict:
+    return dict(file=records.file,
+                nodes={k: vars(n) for k, n in records.nodes.items()},
+                declarations=records.declarations,
+                symbols={k: [c.callee, c.qualified, c.data, c.resolved] for k, c in records.symbols.items()},
+                calls=records.calls,
+                includes=records.includes,
+                errors=records.errors)
+
+
+def records_from_json(data: Dict) -> TranslationUnitRecords:
+    calls = defaultdict(dict, data['calls'])
+    return TranslationUnitRecords(file=data['file'],
+                                  nodes={k: Node(**n) for k, n in data['nodes'].items()},
+                                  declarations=data['declarations'],
+                                  symbols={k: Call(callee=c[0], qualified=c[1], data=c[2], resolved=c[3])
+                                           for k, c in data['symbols'].items()},
+                                  calls=calls,
+                                  includes=data['includes'],
+                                  errors=data.get('errors', 0))
+
+
+def write_records(records: Iterable[TranslationUnitRecords], filename: Union[str, Path], **header) -> int:
+    """Streams the records of translation units to JSON lines (gzip compressed for `.gz`), returns how many
+
+    `header` is written to the first line.
+    """
+    return write_indexed_records(((None, r) for r in records), filename, **header)
+
+
+def write_indexed_records(records: Iterable[Tuple[Optional[int], TranslationUnitRecords]], filename: Union[str, Path],
+                          **header) -> int:
+    """`write_records` of a shard, every line keeps the position of its translation unit in the whole project
+
+    The positions are those of the compile commands the records were parsed from, `read_shards` merges by them.
+    """
+    count = 0
+    with _open(filename, 'w') as f:
+        f.write(json.dumps(dict(format=RECORDS_FORMAT, version=RECORDS_VERSION, **header)) + '\n')
+        for index, r in records:
+            data = records_to_json(r)
+            if index is not None:
+                data['index'] = index
+            f.write(json.dumps(data, separators=(',', ':')) + '\n')
+            count += 1
+    return count
+
+
+def _read_lines(filename: Union[str, Path]) -> Iterator[Dict]:
+    # the header first, then the records of each translation unit as JSON
+    with _open(filename, 'r') as f:
+        header = json.loads(f.readline() or '{}')
+        if header.get('format') != RECORDS_FORMAT or header.get('version') != RECORDS_VERSION:
+            raise ValueError(f'{filename} is not a call graph written by this version of backends.clang.export')
+        yield header
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_records(filename: Union[str, Path]) -> Iterator[TranslationUnitRecords]:
+    """The records of `write_records`, one translation unit at a time"""
+    lines = _read_lines(filename)
+    header = next(lines)
+    if 'shards' in header:
+        raise ValueError(f'{filename} is shard {header["shard"]} of {header["shards"]}, merge the shards first '
+                         f'(python -m backends.clang.export --merge ...)')
+    for data in lines:
+        yield records_from_json(data)
+
+
+def get_shard(commands: Sequence[Dict], shard: int, shards: int) -> List[Tuple[int, Dict]]:
+    """The translation units of shard `shard` (0-based) of `shards`, with their positions in `commands`
+
+    Every shard takes every `shards`-th translation unit, so the directories of a project are spread over all of them.
+    """
+    if not 0 <= shard < shards:
+        raise ValueError(f'there is no shard {shard} of {shards}')
+    return [(i, cmd) for i, cmd in enumerate(commands) if i % shards == shard]
+
+
+def get_units_digest(commands: Sequence[Dict]) -> str:
+    # the list of translation units a run was split from, all its shards must have the same one
+    h = hashlib.sha1()
+    for cmd in commands:
+        h.update(str(cmd['file']).encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def read_shards(filenames: Sequence[Union[str, Path]]) -> Iterator[TranslationUnitRecords]:
+    """The records of all shards of a run, merged back in the order of their translation units in the project
+
+    Raises ValueError right away if a shard is missing, given twice or from another run.
+    """
+    readers = [_read_lines(filename) for filename in filenames]
+    headers = [next(reader) for reader in readers]
+    for filename, header in zip(filenames, headers):
+        if 'shards' not in header:
+            raise ValueError(f'{filename} is not a shard, write the shards with --shard')
+    first = headers[0]
+    for filename, header in zip(filenames, headers):
+        if (header['shards'], header['units'], header['digest']) != (first['shards'], first['units'], first['digest']):
+            raise ValueError(f'{filename} and {filenames[0]} are shards of different runs')
+    shards = sorted(header['shard'] for header in headers)
+    if shards != list(range(first['shards'])):
+        missing = sorted(set(range(first['shards'])) - set(shards))
+        raise ValueError(f'shards {missing} of {first["shards"]} are missing' if missing else
+                         f'a shard is given twice: {shards}')
+    # each shard is in order already, a heap merges them while reading one line of each at a time
+    return (records_from_json(data) for data in heapq.merge(*readers, key=lambda data: data['index']))
+
+
+def load_graph(path: Union[str, Path]):
+    """The graph of an exported file, a networkx graph for records and a (memory-mapped) CompactGraph otherwise"""
+    artifact = get_artifact_format(path)
+    if artifact == 'records':
+        return CallGraphBuilder().merge(read_records(path)).build()
+    if artifact == 'compact':
+        return CompactGraph.load(path)
+    raise ValueError(f'{path} is neither a records file ({", ".join(RECORDS_SUFFIXES)}) nor a compact graph')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', nargs='+',
+                        help='project directory, compile_commands.json, source file or exported records, with --merge '
+                             'the records files of all shards')
+    parser.add_argument('--flags', default='', help='compiler flags, e.g. include directories')
+    parser.add_argument('-o', '--output', help='records file to write (.jsonl or .jsonl.gz)')
+    parser.add_argument('--compact', help='CompactGraph directory to write (needs numpy)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--cache-dir', help='cache of parsed translation units, shared with the explorer')
+    parser.add_argument('--pch-header', help='prefix header with the includes shared by all translation units')
+    parser.add_argument('--project-path', action='append', dest='project_paths',
+                        help='only walk the files below this directory, can be given several times (default: the '
+                             'directory containing the compilation database and all translation units)')
+    parser.add_argument('--skip-preamble-bodies', action='store_true',
+                        help='skip the function bodies of the headers included at the top of each file, faster but '
+                             'inline functions defined there lose their calls')
+    parser.add_argument('--shard', help='K/N, only extract the K-th (from 0) of N shards of the translation units')
+    parser.add_argument('--merge', action='store_true', help='merge the records files of all shards of a run')
+    args = parser.parse_args()
+    if not args.output and not args.compact:
+        parser.error('nothing to write, use --output and/or --compact')
+    if args.output and not args.output.endswith(RECORDS_SUFFIXES):
+        parser.error(f'--output must end with one of {", ".join(RECORDS_SUFFIXES)}')
+    if len(args.path) > 1 and not args.merge:
+        parser.error('several paths are only merged with --merge')
+    shard = None
+    if args.shard:
+        try:
+            shard = tuple(int(part) for part in args.shard.split('/'))
+            get_shard([], *shard)
+        except (TypeError, ValueError):
+            parser.error(f'--shard {args.shard} is not K/N with 0 <= K < N')
+        if args.merge or not args.output or args.compact:
+            parser.error('a shard is only written as records (--output), merge all shards for a compact graph')
+
+    failed = []
+    indexed = None  # type: Optional[Iterator[Tuple[int, TranslationUnitRecords]]]  # the records of a shard
+    header = dict()
+    if args.merge:
+        try:
+            records = read_shards(args.path)
+        except ValueError as e:
+            parser.error(str(e))
+    elif get_artifact_format(args.path[0]) == 'records':
+        records = read_records(args.path[0])
+    else:
+        cfg = get_config(args.flags, args.cache_dir, project_paths=args.project_paths,
+                         skip_preamble_bodies=args.skip_preamble_bodies, pch_header=args.pch_header)
+
+        def on_error(cmd: Dict, e: Exception):
+            failed.append(cmd['file'])
+            print(f'{cmd["file"]}: {e}', file=sys.stderr)
+
+        commands = get_translation_units(args.path[0], cfg)
+        if shard is not None:
+            header = dict(shard=shard[0], shards=shard[1], units=len(commands), digest=get_units_digest(commands))
+            # each command carries its position in the project through the workers, see write_indexed_records
+            commands = [dict(cmd, index=i) for i, cmd in get_shard(commands, *shard)]
+            print(f'shard {shard[0]} of {shard[1]}: {len(commands)} translation units')
+            indexed = ((cmd['index'], r) for cmd, r in analyze_commands(commands, cfg, args.workers, on_error=on_error))
+        else:
+            records = analyze_files(commands, cfg, args.workers, on_error=on_error)
+
+    builder = CallGraphBuilder() if args.compact else None
+
+    def merged(rs: Iterable[TranslationUnitRecords]) -> Iterator[TranslationUnitRecords]:
+        # the compact graph needs all of them, the records file only one at a time
+        for r in rs:
+            if builder is not None:
+                builder.add(r)
+            yield r
+
+    if indexed is not None:
+        count = write_indexed_records(indexed, args.output, **header)
+        print(f'wrote {count} translation units to {args.output}')
+    elif args.output:
+        count = write_records(merged(records), args.output, **header)
+        print(f'wrote {count} translation units to {args.output}')
+    else:
+        for _ in merged(records):
+            pass
+    if builder is not None:
+        graph = builder.build()  # type: nx.DiGraph
+        builder.clear()
+        CompactGraph.from_networkx(graph).save(args.compact)
+        print(f'wrote {graph} to {args.compact}')
+    if failed:
+        print(f'{len(failed)} translation units could not be parsed', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
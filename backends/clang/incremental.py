@@ -0,0 +1,121 @@
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+import networkx as nx
+
+from backends.clang import TranslationUnitRecords, analyze_commands, get_config, get_graph_from_records, \
+    get_translation_units
+from utils.networkx import update_graph_in_place
+
+
+class ProjectWatcher:
+    """Keeps the call graph of a project up to date while its files are edited
+
+    The translation units of the project and the project headers they include are polled for modifications,
+    additions and removals. Only the translation units whose file or one of whose included headers changed are parsed
+    again, their records replace the old ones and the
+    resulting difference is patched into `graph` in place.
+    """
+
+    def __init__(self, path: Union[str, Path], include_path: str, workers: int = 1,
+                 cache_dir: Optional[Union[str, Path]] = None, interval: float = 2.0,
+                 on_update: Optional[Callable[['ProjectWatcher', Set[str]], None]] = None, **options):
+        self.path = path
+        self.cfg = get_config(include_path, cache_dir, **options)
+        self.workers = workers
+        self.interval = interval
+        self.on_update = on_update
+        self.lock = threading.RLock()  # held while the graph is patched
+        self.version = 0
+        self.records = dict()  # type: Dict[str, TranslationUnitRecords]
+        self.graph = None  # type: Optional[nx.DiGraph]
+        self._stamps = dict()  # type: Dict[str, Tuple[int, int]]
+        self._stop = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def load(self, records: Optional[Dict[str, TranslationUnitRecords]] = None) -> nx.DiGraph:
+        # `records` of the translation units by the file of their compile command, when they were parsed already
+        # (e.g. by a ProjectLoad). `poll` replaces them by the same key
+        commands = get_translation_units(self.path, self.cfg)
+        if records is not None:
+            self.records.update(records)
+        else:
+            for cmd, r in analyze_commands(commands, self.cfg, self.workers):
+                self.records[str(cmd['file'])] = r
+        self._stamps = self._scan(commands)
+        self.graph = get_graph_from_records(self.records.values())
+        return self.graph
+
+    def _watched_files(self, commands: List[Dict]) -> Set[str]:
+        # headers are only watched through the TUs including them, system headers are ignored
+        files = {str(cmd['file']) for cmd in commands}
+        for records in self.records.values():
+            for i in records.includes:
+                if not any(i.startswith(x) for x in self.cfg['excluded_paths']):
+                    files.add(i)
+        return files
+
+    def _scan(self, commands: List[Dict]) -> Dict[str, Tuple[int, int]]:
+        stamps = dict()
+        for file in self._watched_files(commands):
+            try:
+                st = os.stat(file)
+            except OSError:
+                continue
+            stamps[str(file)] = (st.st_mtime_ns, st.st_size)
+        return stamps
+
+    def _dependents(self, changed: Set[str]) -> Set[str]:
+        # source files whose translation units include one of the changed files
+        changed = {os.path.abspath(c) for c in changed}
+        affected = set()
+        for file, records in self.records.items():
+            if any(os.path.abspath(i) in changed for i in records.includes):
+                affected.add(file)
+        return affected
+
+    def poll(self) -> Set[str]:
+        """Checks the project once and returns the files whose translation units were parsed again"""
+        commands = get_translation_units(self.path, self.cfg)
+        stamps = self._scan(commands)
+        changed = {f for f, s in stamps.items() if self._stamps.get(f) != s}
+        removed = set(self._stamps) - set(stamps)
+        if not changed and not removed:
+            return set()
+
+        affected = (changed | self._dependents(changed | removed)) - removed
+        affected_commands = [cmd for cmd in commands if str(cmd['file']) in affected]
+        updated = {str(cmd['file']): r for cmd, r in analyze_commands(affected_commands, self.cfg, self.workers)}
+
+        with self.lock:
+            for file in removed:
+                self.records.pop(file, None)
+            self.records.update(updated)
+            update_graph_in_place(self.graph, get_graph_from_records(self.records.values()))
+            # headers that are newly included start being watched, the rest keeps the stamps from before parsing
+            self._stamps = dict(self._scan(commands), **stamps)
+            self.version += 1
+
+        if self.on_update is not None:
+            self.on_update(self, affected | removed)
+        return affected | removed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:  # keep watching, the next save usually fixes it
+                print(f'Incremental update of {self.path} failed: {e}')
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f'watch {self.path}', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from clang.cindex import Index
+
+from backends.clang.cache import FileDigests
+
+
+def get_header_language(arguments: List[str]) -> str:
+    for i, a in enumerate(arguments):
+        language = arguments[i + 1] if a == '-x' and i + 1 < len(arguments) else a[2:] if a.startswith('-x') else None
+        if language in ('c', 'c-header'):
+            return 'c-header'
+    return 'c++-header'
+
+
+class PrecompiledHeaders:
+    """Compiles a prefix header (the heavy includes shared by all translation units) once per set of flags
+
+    The PCH files are kept in `directory` together with the digests of every header they contain, so they are reused
+    across loads until one of these headers changes.
+    """
+
+    def __init__(self, directory: Union[str, Path], index: Index):
+        self.directory = str(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self.index = index
+        self.digest = FileDigests()
+        self._built = dict()  # type: Dict[str, Optional[Tuple[str, List[str]]]]
+
+    def _is_valid(self, pch: str, meta: str) -> Optional[List[str]]:
+        if not os.path.isfile(pch) or not os.path.isfile(meta):
+            return None
+        try:
+            with open(meta) as f:
+                dependencies = json.load(f)
+        except (OSError, ValueError):  # removed or not fully written, it is built again
+            return None
+        if any(self.digest(filename) != digest for filename, digest in dependencies):
+            return None
+        return [filename for filename, _ in dependencies]
+
+    def get(self, header: Union[str, Path], arguments: List[str]) -> Optional[Tuple[str, List[str]]]:
+        """The PCH for `header` parsed with `arguments` and the headers it contains, None if it does not build"""
+        h = hashlib.sha1()
+        for part in (os.path.abspath(header), self.digest(header) or '', json.dumps(arguments)):
+            h.update(part.encode())
+            h.update(b'\0')
+        key = h.hexdigest()
+        if key in self._built:
+            return self._built[key]
+
+        pch = os.path.join(self.directory, f'{key}.pch')
+        meta = os.path.join(self.directory, f'{key}.json')
+        includes = self._is_valid(pch, meta)
+        if includes is None:
+            tu = self.index.parse(str(header), [*arguments, '-x', get_header_language(arguments)])
+            errors = [d for d in tu.diagnostics if d.severity in (d.Error, d.Fatal)] if tu else []
+            if not tu or errors:
+                print(f'unable to precompile {header}, parsing without it')
+                self._built[key] = None
+                return None
+            includes = sorted({str(header), *(i.include.name for i in tu.get_includes())})
+            # write next to the final names and rename, other workers may be building the same PCH. The digests go
+            # first so that a worker never finds the PCH without them
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.json')
+            with os.fdopen(fd, 'w') as f:
+                json.dump([(filename, self.digest(filename)) for filename in includes], f)
+            os.replace(tmp, meta)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.pch')
+            os.close(fd)
+            tu.save(tmp)
+            os.replace(tmp, pch)
+            print(f'precompiled {header} ({len(includes)} headers)')
+        self._built[key] = (pch, includes)
+        return self._built[key]
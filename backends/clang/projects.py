@@ -0,0 +1,327 @@
+import itertools
+import threading
+import time
+import traceback
+import weakref
+from contextlib import closing, nullcontext
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple, Union
+
+import networkx as nx
+
+from backends.clang import CallGraphBuilder, TranslationUnitRecords, analyze_commands, get_config, get_translation_units
+from backends.clang.export import get_artifact_format, read_records
+from backends.clang.incremental import ProjectWatcher
+from utils.metrics import METRICS
+from utils.networkx.compact import CompactGraph
+
+GENERATIONS = itertools.count()
+
+
+class Project:
+    """The call graph of a project, shared read-only by every session that loaded it with the same flags
+
+    Nothing but the watcher (if the project is watched) changes the graph, sessions keep their view state apart. Data
+    derived from the graph (search index, reachability, ...) is built once for all of them with `cached`, it is
+    dropped whenever the watcher updated the graph.
+    """
+
+    def __init__(self, key: Hashable, graph: Union[nx.DiGraph, CompactGraph],
+                 watcher: Optional[ProjectWatcher] = None, version: int = 0, complete: bool = True):
+        self.key = key
+        self.graph = graph
+        self.watcher = watcher
+        self.complete = complete  # False for the partial graph of a project that is still loading
+        # tells the graphs of a key apart (partial, loaded, reloaded), their versions start over
+        self.generation = next(GENERATIONS)
+        self._version = version
+        self._cache = dict()  # type: Dict[str, Any]
+        self._cache_version = self.version
+        self._cache_lock = threading.RLock()
+        if watcher is not None:
+            # the last session dropping the project stops its watcher, the watcher does not reference the project
+            weakref.finalize(self, watcher.stop)
+
+    @property
+    def version(self) -> int:
+        return self.watcher.version if self.watcher is not None else self._version
+
+    @property
+    def lock(self):
+        # held by the watcher while it patches the graph
+        return self.watcher.lock if self.watcher is not None else nullcontext()
+
+    def cached(self, name: str, build: Callable[[], Any]) -> Any:
+        with self._cache_lock:
+            if self._cache_version != self.version:
+                self._cache.clear()
+                self._cache_version = self.version
+            if name not in self._cache:
+                METRICS.inc('callgraph_project_cache_total', data=name, result='miss')
+                with self.lock:
+                    self._cache[name] = build()
+            else:
+                METRICS.inc('callgraph_project_cache_total', data=name, result='hit')
+            return self._cache[name]
+
+
+class ProjectLoad:
+    """Parses a project in a background thread, so that loading a large project does not block a request
+
+    `progress` tells how many translation units are parsed, which one is next and how many errors there were so far,
+    `partial` is a Project with the graph of the translation units parsed until now, to browse while the rest is
+    still loading. `cancel` stops after the translation units being parsed right now. Once every translation unit
+    is merged, `finish` turns the load into the Project (see `result`), `wait` blocks until then. `holders` counts the
+    sessions waiting for it, see SharedProjects.release.
+    """
+
+    def __init__(self, key: Hashable, path: Union[str, Path], cfg: Dict, workers: int = 1,
+                 finish: Optional[Callable[['ProjectLoad'], Project]] = None, keep_records: bool = False,
+                 records: Optional[Callable[[], Iterator[TranslationUnitRecords]]] = None):
+        self.key = key
+        self.path = path
+        self.cfg = cfg
+        self.workers = workers
+        self.finish = finish
+        self.source = records  # records parsed elsewhere (e.g. exported), instead of parsing the project
+        self.state = 'pending'  # running, done, cancelled or failed
+        self.result = None  # type: Optional[Project]
+        self.error = None  # type: Optional[str]
+        self.total = None  # type: Optional[int]
+        self.done = 0
+        self.current = None  # type: Optional[str]
+        self.failed = []  # type: List[str]  # translation units that could not be parsed, with the reason
+        self.diagnostics = 0  # error diagnostics of the parsed translation units
+        self.version = 0  # translation units merged, every one changes the partial graph
+        self.holders = 0
+        # records by the file of their compile command, see ProjectWatcher.load
+        self.records = dict() if keep_records else None  # type: Optional[Dict[str, TranslationUnitRecords]]
+        self._builder = CallGraphBuilder()
+        self._lock = threading.Lock()  # held while records are merged or the partial graph is built
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+        self._partial = None  # type: Optional[Project]
+        self._partial_time = 0.0
+        self._commands = []  # type: List[Dict]
+        self._thread = None  # type: Optional[threading.Thread]
+
+    @classmethod
+    def loaded(cls, project: Project) -> 'ProjectLoad':
+        # a project that is loaded already, as a finished load
+        load = cls(project.key, None, {})
+        load.state = 'done'
+        load.result = project
+        load._finished.set()
+        return load
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    def start(self) -> 'ProjectLoad':
+        if self._thread is None and not self.finished:
+            self.state = 'running'
+            self._thread = threading.Thread(target=self._run, name=f'load {self.path}', daemon=True)
+            self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[Project]:
+        """The loaded project, None if the load was cancelled (or is still running after `timeout`)"""
+        self._finished.wait(timeout)
+        if self.state == 'failed':
+            raise RuntimeError(f'loading {self.path} failed: {self.error}')
+        return self.result
+
+    def progress(self) -> Dict[str, Any]:
+        return dict(state=self.state, done=self.done, total=self.total, current=self.current,
+                    failed=len(self.failed), diagnostics=self.diagnostics, error=self.error)
+
+    def partial(self, min_interval: float = 2.0) -> Optional[Project]:
+        """The project as far as it is parsed, built again at most every `min_interval` seconds"""
+        with self._lock:
+            if not self.version or self.finished:
+                return None
+            if self._partial is None or (self._partial.version != self.version and
+                                         time.monotonic() - self._partial_time >= min_interval):
+                self._partial = Project(self.key, self._builder.build(), version=self.version, complete=False)
+                self._partial_time = time.monotonic()
+            return self._partial
+
+    def build(self) -> nx.DiGraph:
+        with self._lock:
+            return self._builder.build()
+
+    def _advance(self):
+        self.done += 1
+        self.current = str(self._commands[self.done]['file']) if self.done < len(self._commands) else None
+
+    def _failed(self, cmd: Dict, e: Exception):
+        self.failed.append(f'{cmd["file"]}: {e}')
+        self._advance()
+
+    def _run(self):
+        try:
+            if self.source is not None:
+                results = ((None, r) for r in self.source())
+            else:
+                commands = self._commands = get_translation_units(self.path, self.cfg)
+                self.total = len(commands)
+                self.current = str(commands[0]['file']) if commands else None
+                results = analyze_commands(commands, self.cfg, self.workers, on_error=self._failed)
+            with closing(results):
+                for cmd, r in results:
+                    with self._lock:
+                        self._builder.add(r)
+                        if self.records is not None:
+                            self.records[str(cmd['file']) if cmd is not None else r.file] = r
+                        self.diagnostics += r.errors
+                        self.version += 1
+                    self._advance()
+                    if self._cancel.is_set():
+                        break
+            if self._cancel.is_set():
+                self.state = 'cancelled'
+            else:
+                self.result = self.finish(self) if self.finish is not None else Project(self.key, self.build())
+                self.state = 'done'
+        except Exception as e:
+            traceback.print_exc()
+            self.error = str(e)
+            self.state = 'failed'
+        finally:
+            self.current = None
+            with self._lock:
+                self._builder.clear()
+                self._partial = None
+            self._finished.set()
+
+
+def no_records() -> Iterator[TranslationUnitRecords]:
+    # a compact graph is loaded as a whole when its load finishes
+    yield from ()
+
+
+def get_project_key(path, include_path, pch_header=None, watch=False, project_paths=None,
+                    skip_preamble_bodies=False) -> Tuple:
+    return (str(Path(path).resolve()) if path else path, include_path or '', pch_header or '', bool(watch),
+            tuple(str(Path(p).resolve()) for p in project_paths) if project_paths else (), bool(skip_preamble_bodies))
+
+
+class SharedProjects:
+    """Projects by path and flags, each one is built once while any session uses it
+
+    Sessions asking for a project that is loaded (or being loaded) get the same Project (or ProjectLoad), projects no
+    session refers to anymore are released. A session that stops waiting for a load `release`s it, the load is cancelled
+    once no session waits for it anymore. `reload=True` builds it again, the sessions still using the old graph keep
+    it until they load the project themselves. With `compact=True` projects that are not watched keep their graph as a
+    CompactGraph (needs numpy), watched ones are patched in place and stay networkx graphs.
+    """
+
+    def __init__(self, compact: bool = False):
+        self.compact = compact
+        self._projects = weakref.WeakValueDictionary()  # type: weakref.WeakValueDictionary[Hashable, Project]
+        self._loads = dict()  # type: Dict[Hashable, ProjectLoad]  # running loads
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._projects)
+
+    def load(self, path: Union[str, Path], include_path: str, workers: int = 1,
+             cache_dir: Optional[Union[str, Path]] = None, pch_header: Optional[str] = None, watch: bool = False,
+             reload: bool = False, project_paths: Optional[List[str]] = None,
+             skip_preamble_bodies: bool = False) -> ProjectLoad:
+        """Starts loading a project in the background, sessions asking for it while it loads share the load
+
+        Every call holds the load it returns until it is passed to `release`. `project_paths` and `skip_preamble_bodies`
+        are passed to get_config, without project paths only the files in the directory of the project are walked.
+        """
+        key = get_project_key(path, include_path, pch_header, watch, project_paths, skip_preamble_bodies)
+        options = dict(pch_header=pch_header, project_paths=project_paths or None,
+                       skip_preamble_bodies=skip_preamble_bodies)
+        with self._lock:
+            load = self._loads.get(key)
+            if load is not None and not load.finished and not load.cancelled:
+                load.holders += 1
+                return load  # a reload while it loads gets the graph being built
+            project = None if reload else self._projects.get(key)
+            if project is not None:
+                return ProjectLoad.loaded(project)
+
+            artifact = get_artifact_format(path)
+            if artifact is not None:
+                # extracted offline (see backends/clang/export.py), nothing is parsed and there is nothing to watch
+                def finish_artifact(done: ProjectLoad) -> Project:
+                    if artifact == 'compact':
+                        graph = CompactGraph.load(path)
+                    else:
+                        graph = done.build()
+                        graph = CompactGraph.from_networkx(graph) if self.compact else graph
+                    return self._loaded(key, Project(key, graph))
+
+                load = self._loads[key] = ProjectLoad(
+                    key, path, {}, finish=finish_artifact,
+                    records=no_records if artifact == 'compact' else lambda: read_records(path))
+                load.holders += 1
+                return load.start()
+
+            watcher = None
+            if watch:
+                # the watcher patches the graph in place whenever a file of the project changes
+                watcher = ProjectWatcher(path, include_path, workers=workers, cache_dir=cache_dir, **options)
+                cfg = watcher.cfg
+            else:
+                cfg = get_config(include_path, cache_dir, **options)
+
+            def finish(done: ProjectLoad) -> Project:
+                if watcher is not None:
+                    graph = watcher.load(done.records)
+                    watcher.start()
+                    project = Project(key, graph, watcher)
+                else:
+                    graph = done.build()
+                    project = Project(key, CompactGraph.from_networkx(graph) if self.compact else graph)
+                return self._loaded(key, project)
+
+            load = self._loads[key] = ProjectLoad(key, path, cfg, workers=workers, finish=finish,
+                                                  keep_records=watcher is not None)
+            load.holders += 1
+        return load.start()
+
+    def release(self, load: ProjectLoad):
+        """A session no longer waits for `load`, it is cancelled if no other session does"""
+        with self._lock:
+            load.holders -= 1
+            if load.holders <= 0 and not load.finished:
+                load.cancel()
+
+    def _loaded(self, key: Hashable, project: Project) -> Project:
+        with self._lock:
+            self._projects[key] = project
+            self._loads.pop(key, None)
+        return project
+
+    def get(self, path: Union[str, Path], include_path: str, workers: int = 1,
+            cache_dir: Optional[Union[str, Path]] = None, pch_header: Optional[str] = None, watch: bool = False,
+            reload: bool = False, **options) -> Optional[Project]:
+        """Loads a project and waits for it, see `load`"""
+        load = self.load(path, include_path, workers=workers, cache_dir=cache_dir, pch_header=pch_header,
+                         watch=watch, reload=reload, **options)
+        try:
+            return load.wait()
+        finally:
+            self.release(load)
+
+    def adopt(self, key: Hashable, graph: Union[nx.DiGraph, CompactGraph]) -> Project:
+        """The project of `key`, made from `graph` (e.g. loaded from a shared store) unless it is loaded already"""
+        with self._lock:
+            project = self._projects.get(key)
+            if project is None:
+                project = self._projects[key] = Project(key, graph)
+            return project
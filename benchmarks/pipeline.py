@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""Times every stage of loading and showing a generated C++ project, and the memory each one takes
+
+    python -m benchmarks.pipeline --files 200 --functions 20 --fan-out 4 -o results.json
+    python -m benchmarks.pipeline --files 200 --functions 20 --fan-out 4 --baseline results.json
+
+The project is generated from the options (with the same seed the same project), `--directory` keeps it. The stages
+are parsing with libclang, walking the cursors into records, building the call graph, filtering it, highlighting the
+callers of tapped functions and serializing it for cytoscape. Every stage gets its time, the peak of the Python memory
+it allocated on top of what was there before (tracemalloc, libclang's own memory is not seen) and the peak resident
+memory of the process after it. The results are written as JSON, `--baseline` prints how a run compares to another.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+
+from clang.cindex import Index
+
+from backends.clang import NAMES, CallGraphBuilder, TranslationUnitRecords, get_config, get_translation_units, \
+    show_info
+from utils.cytoscape import ViewState, get_cytoscape_data_from_nx
+from utils.networkx import get_reachability_index
+
+RESULTS_FORMAT = 'callgraph-benchmark'
+RESULTS_VERSION = 1
+
+
+def generate_project(directory: Union[str, Path], files: int = 50, functions: int = 20, fan_out: int = 4,
+                     namespaces: int = 4, templates: int = 2, recursion: float = 0.1, seed: int = 0) -> Dict:
+    """Writes a C++ project of `files` modules, each a header and a source file, with a compile_commands.json
+
+    Every module has `functions` functions in one of `namespaces` nested namespaces, each calling `fan_out` functions
+    of its own or an earlier module (the headers of those are included), plus `templates` function templates defined
+    in the header that are instantiated by the callers. A `recursion` share of the functions call themselves or the
+    function before them. Returns the numbers of what was written.
+    """
+    rng = random.Random(seed)
+    directory = Path(directory)
+    (directory / 'include').mkdir(parents=True, exist_ok=True)
+    (directory / 'src').mkdir(parents=True, exist_ok=True)
+
+    def opening(m: int) -> str:
+        return f'namespace ns{m % namespaces} {{ namespace detail{m % 3} {{'
+
+    def qualified(m: int, name: str) -> str:
+        return f'::ns{m % namespaces}::detail{m % 3}::{name}' if namespaces else name
+
+    commands = []
+    lines = 0
+    calls = 0
+    for m in range(files):
+        header = ['#pragma once', '']
+        if namespaces:
+            header.append(opening(m))
+        header += [f'int f_{m}_{j}(int x);' for j in range(functions)]
+        for t in range(templates):
+            header += ['', 'template <typename T>',
+                       f'T t_{m}_{t}(T x) {{',
+                       f'    return x > 0 ? t_{m}_{t}<T>(x - 1) + T(1) : T(0);',
+                       '}']
+        header.append(f'struct Module{m} {{')
+        header += [f'    int method_{j}(int x) const {{ return f_{m}_{j}(x) + {j}; }}'
+                   for j in range(min(3, functions))]
+        header.append('};')
+        if namespaces:
+            header.append('}}')
+        header.append('')
+
+        includes = set()
+        bodies = []
+        for j in range(functions):
+            body = []
+            for _ in range(fan_out):
+                # mostly nearby modules, like the layers of a real project
+                callee_module = max(0, m - int(rng.expovariate(0.5))) if m else 0
+                callee = rng.randrange(functions)
+                if callee_module == m and callee == j:
+                    continue
+                includes.add(callee_module)
+                body.append(f'    r += {qualified(callee_module, f"f_{callee_module}_{callee}")}(x + {len(body)});')
+            if templates:
+                t_module = rng.choice(sorted(includes | {m}))
+                t = rng.randrange(templates)
+                includes.add(t_module)
+                body.append(f'    r += {qualified(t_module, f"t_{t_module}_{t}")}<{rng.choice(["int", "long"])}>(x);')
+            if rng.random() < recursion:
+                target = f'f_{m}_{j}' if j == 0 or rng.random() < 0.5 else f'f_{m}_{j - 1}'
+                body.append(f'    if (x > 1) r += {target}(x / 2);')
+            calls += len(body)
+            bodies += [f'int f_{m}_{j}(int x) {{', '    int r = x;', *body, '    return r;', '}', '']
+
+        source = [f'#include "module_{i}.h"' for i in sorted(includes | {m})] + ['']
+        if namespaces:
+            source.append(opening(m))
+        source += bodies
+        if namespaces:
+            source.append('}}')
+        source_file = (directory / 'src' / f'module_{m}.cpp').resolve()
+        (directory / 'include' / f'module_{m}.h').write_text('\n'.join(header) + '\n')
+        source_file.write_text('\n'.join(source) + '\n')
+        lines += len(header) + len(source)
+        commands.append(dict(directory=str(directory.resolve()), file=str(source_file),
+                             arguments=['clang++', '-x', 'c++', '-std=c++17', f'-I{(directory / "include").resolve()}',
+                                        '-c', str(source_file)]))
+    with open(directory / 'compile_commands.json', 'w') as f:
+        json.dump(commands, f, indent=1)
+    return dict(files=2 * files, translation_units=files, functions=files * functions, templates=files * templates,
+                lines=lines, call_sites=calls)
+
+
+def max_rss() -> Optional[int]:
+    # peak resident memory of the process in bytes, a high-water mark that never goes down
+    try:
+        import resource
+    except ImportError:  # windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Stages:
+    """Time and memory of named stages, a stage entered several times (e.g. once per file) adds up its times"""
+
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.results = dict()  # type: Dict[str, Dict]
+
+    @contextlib.contextmanager
+    def __call__(self, name: str) -> Iterator[None]:
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            stage = self.results.setdefault(name, dict(seconds=0.0, calls=0, peak_bytes=None, max_rss_bytes=None))
+            stage['seconds'] += seconds
+            stage['calls'] += 1
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] - before
+                stage['peak_bytes'] = max(stage['peak_bytes'] or 0, peak)
+            stage['max_rss_bytes'] = max_rss()
+
+
+def run(path: Union[str, Path], flags: str = '', taps: int = 100, search: Optional[str] = None,
+        trace_memory: bool = True, seed: int = 0) -> Dict:
+    """Runs every stage on the project at `path` and returns the results"""
+    from app import get_filtered_subgraph  # the filter of the app, importing it sets up the (unused) Dash app
+
+    stages = Stages(trace_memory)
+    cfg = get_config(flags)
+    commands = get_translation_units(path, cfg)
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        index = Index.create()
+        builder = CallGraphBuilder()
+        errors = 0
+        for cmd in commands:
+            with stages('parse'):
+                tu = index.parse(str(cmd['file']), cmd['arguments'], options=cfg['parse_options'])
+            errors += sum(1 for d in tu.diagnostics if d.severity >= d.Error)
+            records = TranslationUnitRecords(file=str(cmd['file']))
+            with stages('walk'):
+                NAMES.clear()
+                show_info(tu.cursor, cfg['excluded_paths'], cfg['excluded_prefixes'], records,
+                          project_paths=cfg['project_paths'])
+                records.includes = sorted({i.include.name for i in tu.get_includes()})
+            NAMES.clear()
+            del tu
+            with stages('merge'):
+                builder.add(records)
+        with stages('build'):
+            graph = builder.build()
+        builder.clear()
+
+        rng = random.Random(seed)
+        names = sorted(graph.nodes, key=str)
+        if search is None and names:
+            search = str(names[len(names) // 2]).split('(')[0]
+        with stages('filter'):
+            filtered = get_filtered_subgraph(graph, search or '', view=ViewState())
+        with stages('reachability'):
+            reachability = get_reachability_index(graph)
+        with stages('highlight'):
+            for node in rng.sample(names, min(taps, len(names))):
+                ViewState(reachability.ancestors(node) | {node}, node)
+        with stages('cytoscape'):
+            elements = get_cytoscape_data_from_nx(graph)
+        with stages('cytoscape_filtered'):
+            get_cytoscape_data_from_nx(filtered)
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    return dict(translation_units=len(commands), errors=errors, search=search, taps=min(taps, graph.number_of_nodes()),
+                graph=dict(nodes=graph.number_of_nodes(), edges=graph.number_of_edges(), elements=len(elements)),
+                filtered=dict(nodes=filtered.number_of_nodes(), edges=filtered.number_of_edges()),
+                stages=stages.results)
+
+
+def compare(results: Dict, baseline: Dict) -> List[str]:
+    lines = [f'{"stage":<20} {"seconds":>9} {"baseline":>9} {"ratio":>7} {"peak MB":>9} {"baseline":>9}']
+    for name, stage in results['stages'].items():
+        base = baseline.get('stages', {}).get(name)
+        if base is None:
+            lines.append(f'{name:<20} {stage["seconds"]:9.3f} {"-":>9}')
+            continue
+        ratio = stage['seconds'] / base['seconds'] if base['seconds'] else float('nan')
+        peak = f'{stage["peak_bytes"] / 2 ** 20:9.1f}' if stage['peak_bytes'] is not None else f'{"-":>9}'
+        base_peak = f'{base["peak_bytes"] / 2 ** 20:9.1f}' if base.get('peak_bytes') is not None else f'{"-":>9}'
+        lines.append(f'{name:<20} {stage["seconds"]:9.3f} {base["seconds"]:9.3f} {ratio:7.2f} {peak} {base_peak}')
+    if results.get('generator') != baseline.get('generator'):
+        lines.append('the projects differ, the baseline was generated with other options')
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=50, help='modules, each one a header and a source file')
+    parser.add_argument('--functions', type=int, default=20, help='functions per module')
+    parser.add_argument('--fan-out', type=int, default=4, help='calls per function')
+    parser.add_argument('--namespaces', type=int, default=4, help='distinct namespaces, 0 for none')
+    parser.add_argument('--templates', type=int, default=2, help='function templates per module')
+    parser.add_argument('--recursion', type=float, default=0.1, help='share of (mutually) recursive functions')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--directory', help='where to generate the project, it is kept (default: a temporary one)')
+    parser.add_argument('--project', help='benchmark an existing project instead of generating one')
+    parser.add_argument('--flags', default='', help='compiler flags for --project, e.g. include directories')
+    parser.add_argument('--taps', type=int, default=100, help='functions whose callers are highlighted')
+    parser.add_argument('--search', help='filter of the filter stage (default: a function in the middle)')
+    parser.add_argument('--no-trace-memory', action='store_true',
+                        help='only times, tracemalloc slows down the Python stages')
+    parser.add_argument('-o', '--output', help='JSON file to write the results to (default: stdout)')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    generator = None
+    with contextlib.ExitStack() as stack:
+        path = args.project
+        if path is None:
+            path = args.directory or stack.enter_context(tempfile.TemporaryDirectory(prefix='callgraph-benchmark-'))
+            generator = dict(files=args.files, functions=args.functions, fan_out=args.fan_out,
+                             namespaces=args.namespaces, templates=args.templates, recursion=args.recursion,
+                             seed=args.seed)
+            project = generate_project(path, **generator)
+            print(f'generated {project["translation_units"]} translation units, {project["functions"]} functions and '
+                  f'{project["call_sites"]} call sites in {path}', file=sys.stderr)
+        results = dict(format=RESULTS_FORMAT, version=RESULTS_VERSION,
+                       created=datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                       python=platform.python_version(), platform=platform.platform(), generator=generator,
+                       project=args.project, trace_memory=not args.no_trace_memory,
+                       **run(path, args.flags, args.taps, args.search, not args.no_trace_memory, args.seed))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print('\n'.join(compare(results, baseline)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
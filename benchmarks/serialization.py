@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Times the cytoscape serialization on generated call graphs
+
+    python -m benchmarks.serialization --edges 10000 100000 1000000
+"""
+import argparse
+import random
+import time
+from typing import Dict, List
+
+import networkx as nx
+from plotly.io.json import to_json_plotly
+
+from utils.cytoscape import CytoscapeElements, ViewState, get_cytoscape_data_from_nx
+from utils.networkx.compact import CompactGraph, np
+
+
+def generate_graph(edges: int, fan_out: int = 5, seed: int = 0) -> nx.DiGraph:
+    rng = random.Random(seed)
+    nodes = max(2, edges // fan_out)
+    graph = nx.DiGraph()
+    for i in range(nodes):
+        name = f'ns{i % 97}::Class{i % 1009}::method_{i}(int, const std::string &)'
+        graph.add_node(name, data=dict(id=name, label=name, file=f'src/file_{i % 4001}.cpp', start=i, end=i + 10,
+                                       mangled_name=f'_ZN{i}', kind='CursorKind.CXX_METHOD', chain="false"))
+    names = list(graph.nodes)
+    added = set()
+    while len(added) < edges:
+        added.add((rng.choice(names), rng.choice(names)))
+    graph.add_edges_from(added)
+    return graph
+
+
+def get_cytoscape_data_from_nx_legacy(graph: nx.DiGraph) -> List[Dict]:
+    # the list based implementation this benchmark compares against (without the print of wrong edges)
+    nodes = [dict(data=graph.nodes[k]['data']) for k in graph.nodes if k]
+    node_names = [n['data']['id'] for n in nodes]
+    edges = []
+    for a, b in graph.edges:
+        highlight = "true" if graph.nodes[a]['data'].get('chain') == "true" and graph.nodes[b]['data'].get(
+            'chain') == "true" else "false"
+        if not a or not b:
+            continue
+        elif a in node_names and b in node_names:
+            edges.append(dict(data=dict(source=a, target=b, highlight=highlight)))
+    return [*nodes, *edges]
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--edges', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--legacy-max-edges', type=int, default=10_000,
+                        help='the legacy implementation is quadratic, only run it up to this size')
+    args = parser.parse_args()
+
+    print(f'{"edges":>9} {"nodes":>8} {"legacy":>9} {"linear":>9} {"compact":>9} {"cached":>9} {"dumps":>9} '
+          f'{"payload":>10}')
+    for edges in args.edges:
+        graph = generate_graph(edges)
+        legacy = '-'
+        if edges <= args.legacy_max_edges:
+            t, _ = timed(get_cytoscape_data_from_nx_legacy, graph)
+            legacy = f'{t:8.3f}s'
+        t_linear, elements = timed(get_cytoscape_data_from_nx, graph)
+        compact = '-'
+        if np is not None:  # numpy is optional
+            t, _ = timed(get_cytoscape_data_from_nx, CompactGraph.from_networkx(graph))
+            compact = f'{t:8.3f}s'
+
+        cache = CytoscapeElements()
+        cache(graph, 1, ViewState())
+        highlighted = ViewState(chain=list(graph.nodes)[::100])  # a highlight change
+        t_cached, _ = timed(cache, graph, 1, highlighted)
+        t_dumps, payload = timed(to_json_plotly, elements)  # what Dash serializes responses with, orjson if installed
+        print(f'{edges:>9} {graph.number_of_nodes():>8} {legacy:>9} {t_linear:8.3f}s {compact:>9} {t_cached:8.3f}s '
+              f'{t_dumps:8.3f}s '
+              f'{len(payload) / 1e6:8.1f}MB')
+
+
+if __name__ == '__main__':
+    main()
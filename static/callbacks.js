@@ -4,38 +4,109 @@
 
 import hljs from './highlight.min.js';
 
+const PAGE_LINES = 200;
+let snippet = null;  // the lines shown in #code, see hl_code
+
+function renderCode(elem) {
+    const code = hljs.highlight(snippet.code, {"language": "c++"})
+    const lines = code.value.split('\n');
+    const output = new Array(lines.length);
+    for (let i = 0; i < lines.length; i++) {
+        const line = snippet.first + i;
+        const selected = line >= snippet.start && line <= snippet.end ? 'selected' : '';
+        output[i] = `<span class='h-linenum ${selected}'>${line}</span>${lines[i]}`;
+    }
+    elem.innerHTML = output.join('\n') + '\n';
+}
+
+function pageCode(elem, direction) {
+    // fetches the previous or next page of lines of the file and keeps the visible lines in place
+    if (!snippet || snippet.loading) {
+        return;
+    }
+    const first = direction < 0 ? Math.max(1, snippet.first - PAGE_LINES) : snippet.last + 1;
+    const last = direction < 0 ? snippet.first - 1 : Math.min(snippet.total, snippet.last + PAGE_LINES);
+    if (last < first) {
+        return;
+    }
+    const current = snippet;
+    current.loading = true;
+    const params = new URLSearchParams({
+        session: current.session, path: current.path || '', file: current.filename, first: first, last: last
+    });
+    fetch('snippet?' + params.toString())
+        .then(response => response.ok ? response.json() : Promise.reject(response.status))
+        .then(page => {
+            if (snippet !== current) {
+                return;  // another function was tapped meanwhile
+            }
+            const height = elem.scrollHeight;
+            if (direction < 0) {
+                snippet.code = page.code + '\n' + snippet.code;
+                snippet.first = page.first;
+            } else {
+                snippet.code = snippet.code + '\n' + page.code;
+                snippet.last = page.last;
+            }
+            snippet.total = page.total;
+            renderCode(elem);
+            if (direction < 0) {
+                elem.scrollTop += elem.scrollHeight - height;
+            }
+        })
+        .catch(status => console.log('snippet', status))
+        .finally(() => { current.loading = false; });
+}
 
 
 window.dash_clientside = Object.assign({}, window.dash_clientside, {
     clientside: {
         hl_code: function(data) {
-
+            // data only holds the lines around the function, more are fetched from /snippet when scrolled to an end
             const elem = document.getElementById('code');
-            // console.log(id, elem)
-            const code = hljs.highlight(data.code, {"language": "c++"})
-            // console.log(code.value)
-            const start = data.start - 1;
-            const end = data.end - 1;
-            let lines = code.value.split('\n');
-            let output = ''
-            for (let i = 0; i < lines.length; i++) {
-
-                let selected = "";
-                if (i >= start && i <= end) {
-                    selected = "selected";
-                }
-                output += `<span class='h-linenum ${selected}'>` + i + "</span>"
-                output += lines[i]
-                output += '\n'
+            snippet = Object.assign({}, data, {loading: false});
+            if (!elem.dataset.paging) {
+                elem.dataset.paging = '1';
+                elem.addEventListener('scroll', function() {
+                    if (elem.scrollTop < 200) {
+                        pageCode(elem, -1);
+                    } else if (elem.scrollTop + elem.clientHeight > elem.scrollHeight - 200) {
+                        pageCode(elem, 1);
+                    }
+                });
             }
-            console.log(start, end)
-
-            elem.innerHTML = output;
+            renderCode(elem);
 
-            const firstSelected = document.querySelector('.selected')
-
-            firstSelected.scrollIntoView();
+            const firstSelected = elem.querySelector('.selected')
+            if (firstSelected) {
+                firstSelected.scrollIntoView();
+            }
 
+            return {};
+        },
+        apply_highlight: function(diff) {
+            // patches the changed nodes into the running cytoscape instance instead of replacing all elements
+            if (!diff || !diff.nodes) {
+                return window.dash_clientside.no_update;
+            }
+            const container = document.getElementById('callgraph');
+            if (!container || !container._cyreg || !container._cyreg.cy) {
+                return window.dash_clientside.no_update;
+            }
+            const cy = container._cyreg.cy;
+            cy.batch(function() {
+                for (const [id, data] of Object.entries(diff.nodes)) {
+                    const node = cy.getElementById(id);
+                    if (node.empty()) {
+                        continue;
+                    }
+                    node.data(data);
+                    node.connectedEdges().forEach(function(edge) {
+                        const highlight = edge.source().data('chain') === 'true' && edge.target().data('chain') === 'true';
+                        edge.data('highlight', highlight ? 'true' : 'false');
+                    });
+                }
+            });
             return {};
         }
     }
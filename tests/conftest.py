@@ -0,0 +1,26 @@
+import shutil
+from pathlib import Path
+
+import pytest
+from clang.cindex import Index, LibclangError
+
+TESTFILES = Path(__file__).resolve().parent.parent / 'testfiles'
+
+
+@pytest.fixture(scope='session')
+def libclang():
+    try:
+        Index.create()
+    except LibclangError:
+        pytest.skip('libclang not found, set LIBCLANG_PATH to the directory containing it')
+
+
+@pytest.fixture
+def project(tmp_path: Path, libclang) -> Path:
+    # a copy of the test files, to edit them
+    return Path(shutil.copytree(TESTFILES, tmp_path / 'project'))
+
+
+@pytest.fixture
+def flags(project: Path) -> str:
+    return f'-x c++ -std=c++17 -I{project}'
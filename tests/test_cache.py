@@ -0,0 +1,48 @@
+import os
+
+from clang.cindex import Index
+
+from backends.clang import analyze_source_file, get_config
+from backends.clang.cache import TranslationUnitCache
+from utils.metrics import METRICS
+
+CACHED = ('callgraph_translation_units_total', (('result', 'cached'),))
+
+
+def analyze(file, cfg, cache):
+    return analyze_source_file({'file': file, 'directory': None, 'arguments': cfg['clang_args']}, cfg,
+                               Index.create(), cache)
+
+
+def test_records_have_the_spelling_of_the_load(project, flags, tmp_path, monkeypatch):
+    cfg = get_config(flags, tmp_path / 'cache')
+    cache = TranslationUnitCache(cfg['cache_dir'])
+    monkeypatch.chdir(project.parent)
+    relative = os.path.join('project', 'test.cpp')
+    written = analyze(relative, cfg, cache)
+    assert written.file == relative
+    assert written.nodes['main()'].file == relative
+
+    METRICS.drain()
+    # another spelling of the same file is parsed again, the locations in the records are spelled like it
+    parsed = analyze(str(project / 'test.cpp'), cfg, cache)
+    assert CACHED not in METRICS.drain()['counters']
+    assert parsed.file == parsed.nodes['main()'].file == str(project / 'test.cpp')
+    cached = analyze(relative, cfg, cache)
+    assert METRICS.drain()['counters'].get(CACHED) == 1
+    assert cached.file == cached.nodes['main()'].file == relative
+    assert cached.calls == written.calls
+
+
+def test_changed_header_is_parsed_again(project, flags, tmp_path):
+    cfg = get_config(flags, tmp_path / 'cache')
+    cache = TranslationUnitCache(cfg['cache_dir'])
+    analyze(str(project / 'test.cpp'), cfg, cache)
+    METRICS.drain()
+    analyze(str(project / 'test.cpp'), cfg, cache)
+    assert METRICS.drain()['counters'].get(CACHED) == 1
+
+    with open(project / 'outside.h', 'a') as f:
+        f.write('int outside_sub(int a, int b);\n')
+    analyze(str(project / 'test.cpp'), cfg, cache)
+    assert CACHED not in METRICS.drain()['counters']
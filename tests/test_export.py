@@ -0,0 +1,62 @@
+import sys
+
+import pytest
+
+from backends.clang.export import load_graph, main, read_records, read_shards
+
+
+def export(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['export', *map(str, args), '--workers', '1'])
+    main()
+
+
+def dump(graph):
+    return sorted(graph.nodes(data=True), key=str), sorted(graph.edges(data=True), key=str)
+
+
+def test_merged_shards_are_the_graph_of_a_single_run(project, flags, tmp_path, monkeypatch):
+    cache = tmp_path / 'cache'
+    export(monkeypatch, project, '--flags', flags, '-o', tmp_path / 'all.jsonl')
+    # the shards get cache hits, next to those of a run from another directory with other spellings of the files
+    export(monkeypatch, project, '--flags', flags, '--cache-dir', cache, '-o', tmp_path / 'warm.jsonl')
+    monkeypatch.chdir(project.parent)
+    export(monkeypatch, project.name, '--flags', flags, '--cache-dir', cache, '-o', tmp_path / 'relative.jsonl')
+    monkeypatch.chdir(tmp_path)
+    shards = [tmp_path / f'shard-{k}.jsonl.gz' for k in range(3)]
+    for k, shard in enumerate(shards):
+        export(monkeypatch, project, '--flags', flags, '--cache-dir', cache, '--shard', f'{k}/3', '-o', shard)
+
+    export(monkeypatch, *reversed(shards), '--merge', '-o', tmp_path / 'merged.jsonl')
+    assert [r.file for r in read_records(tmp_path / 'merged.jsonl')] == \
+        [r.file for r in read_records(tmp_path / 'all.jsonl')]
+    assert dump(load_graph(tmp_path / 'merged.jsonl')) == dump(load_graph(tmp_path / 'all.jsonl'))
+
+
+def test_shards_must_be_complete(project, flags, tmp_path, monkeypatch):
+    shards = [tmp_path / f'shard-{k}.jsonl' for k in range(2)]
+    for k, shard in enumerate(shards):
+        export(monkeypatch, project, '--flags', flags, '--shard', f'{k}/2', '-o', shard)
+    with pytest.raises(ValueError, match='missing'):
+        read_shards(shards[:1])
+    with pytest.raises(ValueError, match='twice'):
+        read_shards([*shards, shards[1]])
+    with pytest.raises(ValueError, match='merge the shards first'):
+        next(read_records(shards[0]))
+
+
+def test_project_paths_limit_the_walked_files(project, flags, tmp_path, monkeypatch):
+    (project / 'lib').mkdir()
+    (project / 'lib' / 'lib.h').write_text('inline int lib_helper(int a) { return a; }\n'
+                                           'inline int lib_twice(int a) { return lib_helper(a) + lib_helper(a); }\n')
+    (project / 'src').mkdir()
+    (project / 'src' / 'use.cpp').write_text('#include "../lib/lib.h"\nint use() { return lib_twice(2); }\n')
+
+    # by default the whole directory of the project is walked
+    export(monkeypatch, project, '--flags', flags, '-o', tmp_path / 'all.jsonl')
+    graph = load_graph(tmp_path / 'all.jsonl')
+    assert graph.has_edge('use()', 'lib_twice(int)') and graph.has_edge('lib_twice(int)', 'lib_helper(int)')
+
+    export(monkeypatch, project, '--flags', flags, '--project-path', project / 'src', '-o', tmp_path / 'src.jsonl')
+    graph = load_graph(tmp_path / 'src.jsonl')
+    assert graph.has_edge('use()', 'lib_twice(int)') and not graph.has_edge('lib_twice(int)', 'lib_helper(int)')
+    assert 'main()' not in graph
@@ -0,0 +1,43 @@
+from backends.clang.projects import SharedProjects
+
+
+def edit(filename, old: str, new: str):
+    with open(filename) as f:
+        text = f.read()
+    assert old in text
+    with open(filename, 'w') as f:
+        f.write(text.replace(old, new))
+
+
+def test_edit_replaces_the_records_of_a_cached_load(project, flags, tmp_path, monkeypatch):
+    # the cache is written by a load that spells the files relative to another directory
+    monkeypatch.chdir(project.parent)
+    SharedProjects().get(project.name, flags, cache_dir=tmp_path / 'cache')
+    monkeypatch.chdir(tmp_path)
+
+    watched = SharedProjects().get(project, flags, cache_dir=tmp_path / 'cache', watch=True)
+    watcher = watched.watcher
+    watcher.stop()  # polled by hand below
+    files = set(watcher.records)
+    assert watched.graph.has_edge('main()', 'AddNumber::add(int, int)')
+
+    edit(project / 'test.cpp', 'auto k = adder.add(4, 4);', 'auto k = 8;')
+    assert watcher.poll() == {str(project / 'test.cpp')}
+    assert set(watcher.records) == files
+    assert not watched.graph.has_edge('main()', 'AddNumber::add(int, int)')
+    assert watched.graph.has_edge('main()', 'outside_add(int, int)')
+    assert watched.version == 1
+
+
+def test_edit_of_a_header_parses_the_files_including_it(project, flags, tmp_path):
+    watched = SharedProjects().get(project, flags, watch=True)
+    watcher = watched.watcher
+    watcher.stop()
+    assert not watched.graph.has_edge('outside_add(int, int)', '_inline_adder(int, int)')
+
+    edit(project / 'outside.h', 'int outside_add(int a, int b);',
+         'int outside_add(int a, int b);\ninline int twice(int a) { return outside_add(a, a); }')
+    updated = watcher.poll()
+    assert str(project / 'outside.h') in updated and str(project / 'test.cpp') in updated
+    assert watched.graph.has_edge('twice(int)', 'outside_add(int, int)')
+    assert watcher.poll() == set()
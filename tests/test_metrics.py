@@ -0,0 +1,46 @@
+from backends.clang import analyze_files, get_config, get_translation_units
+from utils.metrics import METRICS, Metrics
+
+
+def test_render_histogram_in_order():
+    metrics = Metrics(buckets=(0.5, 2.5, 10.0))
+    metrics.inc('callgraph_elements_total', 3)
+    for value in (0.1, 2.0, 3.0, 30.0):
+        metrics.observe('callgraph_span_seconds', value, stage='parse')
+    metrics.observe('callgraph_span_seconds', 1.0, stage='build')
+
+    lines = [line for line in metrics.render().splitlines() if line.startswith('callgraph_span_seconds')]
+    parse = [line for line in lines if 'stage="parse"' in line]
+    assert [line.split(' ')[0] for line in parse] == [
+        'callgraph_span_seconds_bucket{stage="parse",le="0.5"}',
+        'callgraph_span_seconds_bucket{stage="parse",le="2.5"}',
+        'callgraph_span_seconds_bucket{stage="parse",le="10"}',
+        'callgraph_span_seconds_bucket{stage="parse",le="+Inf"}',
+        'callgraph_span_seconds_sum{stage="parse"}',
+        'callgraph_span_seconds_count{stage="parse"}',
+    ]
+    assert [float(line.split(' ')[1]) for line in parse] == [1, 2, 3, 4, 35.1, 4]
+    # the series of one histogram follow each other, sorted by their labels
+    assert lines[:6] == [line for line in lines if 'stage="build"' in line]
+    assert lines[6:] == parse
+
+
+def test_pooled_load_counts_once(project, flags):
+    cfg = get_config(flags)
+    commands = get_translation_units(project, cfg)
+    assert len(commands) > 2
+    METRICS.drain()
+    METRICS.inc('callgraph_translation_units_total', 1000, result='parsed')
+    METRICS.inc('callgraph_diagnostics_total', 1000)
+
+    list(analyze_files(commands, cfg))
+    serial = METRICS.drain()['counters']
+    METRICS.inc('callgraph_translation_units_total', 1000, result='parsed')
+    METRICS.inc('callgraph_diagnostics_total', 1000)
+    list(analyze_files(commands, cfg, workers=2))
+    pooled = METRICS.drain()['counters']
+
+    parsed = ('callgraph_translation_units_total', (('result', 'parsed'),))
+    assert serial[parsed] == pooled[parsed] == 1000 + len(commands)
+    diagnostics = ('callgraph_diagnostics_total', ())
+    assert serial[diagnostics] == pooled[diagnostics]
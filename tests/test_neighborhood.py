@@ -0,0 +1,22 @@
+import networkx as nx
+
+from utils.networkx import add_truncation_markers, get_neighborhood
+
+
+def test_matches_beyond_the_budget_are_counted():
+    graph = nx.DiGraph([('main', f'f{i}') for i in range(5)])
+    nodes, hidden, dropped = get_neighborhood(graph, [f'f{i}' for i in range(5)], depth=0, max_nodes=2)
+    assert nodes == {'f0', 'f1'}
+    assert dropped == 3
+    assert hidden == {('f0', True): 1, ('f1', True): 1}
+
+    shown = graph.subgraph(nodes).copy()
+    add_truncation_markers(shown, hidden, dropped)
+    assert shown.nodes['more matches']['data']['label'] == '+3 matches'
+    assert shown.nodes['callers of f0']['data']['label'] == '+1 callers'
+
+
+def test_all_matches_fit():
+    graph = nx.DiGraph([('main', 'f'), ('f', 'g')])
+    nodes, hidden, dropped = get_neighborhood(graph, ['f'], max_nodes=10)
+    assert (nodes, hidden, dropped) == ({'main', 'f', 'g'}, {}, 0)
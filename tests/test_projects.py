@@ -0,0 +1,45 @@
+import threading
+
+from backends.clang import projects
+from backends.clang.projects import SharedProjects
+
+
+def gate_parsing(monkeypatch) -> threading.Event:
+    # translation units are merged once the event is set, the loads run until then
+    gate = threading.Event()
+    analyze_commands = projects.analyze_commands
+
+    def gated(*args, **kwargs):
+        for result in analyze_commands(*args, **kwargs):
+            gate.wait(30)
+            yield result
+
+    monkeypatch.setattr(projects, 'analyze_commands', gated)
+    return gate
+
+
+def test_a_load_goes_on_while_a_session_waits_for_it(project, flags, monkeypatch):
+    gate = gate_parsing(monkeypatch)
+    shared = SharedProjects()
+    load = shared.load(project, flags)
+    assert shared.load(project, flags) is load
+    shared.release(load)
+    gate.set()
+    assert load.wait(30) is not None
+    assert load.state == 'done'
+
+
+def test_a_load_no_session_waits_for_is_cancelled(project, flags, monkeypatch):
+    gate = gate_parsing(monkeypatch)
+    shared = SharedProjects()
+    load = shared.load(project, flags)
+    shared.load(project, flags)
+    shared.release(load)
+    shared.release(load)
+    # the next session does not get the cancelled load, even while it still parses
+    again = shared.load(project, flags)
+    assert again is not load
+    gate.set()
+    assert load.wait(30) is None
+    assert load.state == 'cancelled'
+    assert again.wait(30) is not None
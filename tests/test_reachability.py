@@ -0,0 +1,64 @@
+import random
+import tracemalloc
+
+import networkx as nx
+import pytest
+
+from utils.networkx.reachability import ReachabilityIndex
+
+
+def random_graph(n: int, edges: int, seed: int) -> nx.DiGraph:
+    # calls mostly go down, some go back up (recursion) or to the function itself
+    rng = random.Random(seed)
+    graph = nx.DiGraph()
+    graph.add_nodes_from(range(n))
+    for _ in range(edges):
+        a, b = rng.randrange(n), rng.randrange(n)
+        if a < b or rng.random() < 0.1:
+            graph.add_edge(a, b)
+    return graph
+
+
+def expected(graph: nx.DiGraph, reach, node) -> set:
+    # networkx leaves the node out, the index has it when the node is on a cycle
+    on_cycle = graph.has_edge(node, node) or any(node in nx.descendants(graph, n) for n in graph.successors(node))
+    return reach(graph, node) | ({node} if on_cycle else set())
+
+
+@pytest.mark.parametrize('max_bytes', [0, 64 << 20])
+def test_callers_and_callees_are_those_of_networkx(max_bytes):
+    for seed in range(5):
+        graph = random_graph(60, 120, seed)
+        index = ReachabilityIndex(graph, max_bytes=max_bytes)
+        for node in random.Random(seed).sample(list(graph), len(graph)):
+            assert index.ancestors(node) == expected(graph, nx.ancestors, node)
+            assert index.descendants(node) == expected(graph, nx.descendants, node)
+        for a in graph:
+            assert all(index.is_ancestor(a, node) == (a in index.ancestors(node)) for node in graph)
+
+
+def test_callers_of_a_hub_take_bounded_memory():
+    # every function of a large project calls the logger, its callers are every function
+    rng = random.Random(1)
+    graph = nx.DiGraph()
+    n = 100_000
+    for i in range(n):
+        graph.add_edge(f'f{i}', 'log')
+        for j in (rng.randrange(n), rng.randrange(n)):
+            if j > i or rng.random() < 0.01:
+                graph.add_edge(f'f{i}', f'f{j}')
+    index = ReachabilityIndex(graph, max_bytes=1 << 20)
+
+    tracemalloc.start()
+    try:
+        callers = index.ancestors('log')
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert callers == nx.ancestors(graph, 'log')
+    # the callers alone take about 8 MB, a bitset for every one of them took more than 1 GB
+    assert peak < 64 << 20
+    for node in ('f0', 'f50000', 'f99999'):
+        assert index.ancestors(node) == expected(graph, nx.ancestors, node)
+        assert index.descendants(node) == expected(graph, nx.descendants, node)
+    assert index.size <= index.max_bytes
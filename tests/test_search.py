@@ -0,0 +1,19 @@
+from utils.search import SearchIndex
+
+NAMES = ['Widget::Widget()', 'Widget::~Widget()', 'Foo::operator*(const Foo &)', 'Foo::operator+(const Foo &)',
+         'add_widget(Widget *)', 'AddNumber::add(int, int)', 'main()']
+
+
+def test_cpp_names_are_found_literally():
+    index = SearchIndex(NAMES)
+    assert index.search('~Widget') == {'Widget::~Widget()'}
+    assert index.search('operator*') == {'Foo::operator*(const Foo &)'}
+    assert index.search('Foo::operator*') == {'Foo::operator*(const Foo &)'}
+
+
+def test_search_syntax():
+    index = SearchIndex(NAMES)
+    assert index.search('add*') == {'add_widget(Widget *)', 'AddNumber::add(int, int)'}
+    assert index.search('widget') == {'Widget::Widget()', 'Widget::~Widget()', 'add_widget(Widget *)'}
+    assert index.search('fuzzy:adnm') == {'AddNumber::add(int, int)'}
+    assert index.search(r're:^foo::operator[*+]') == {'Foo::operator*(const Foo &)', 'Foo::operator+(const Foo &)'}
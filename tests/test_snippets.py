@@ -0,0 +1,41 @@
+import os
+
+from utils.snippets import LineIndex, SnippetCache
+
+
+def write(path, text: str) -> str:
+    with open(path, 'w', newline='') as f:
+        f.write(text)
+    return str(path)
+
+
+def test_window_around_a_function(tmp_path):
+    filename = write(tmp_path / 'long.cpp', ''.join(f'line {i}\n' for i in range(1, 1001)))
+    cache = SnippetCache(context=5, max_lines=20)
+    window = cache.window(filename, 100, 102)
+    assert (window['first'], window['last'], window['total']) == (95, 107, 1000)
+    assert window['code'].split('\n') == [f'line {i}' for i in range(95, 108)]
+    # at the top of the file, and a function longer than a window is cut
+    assert cache.window(filename, 2, 3)['first'] == 1
+    window = cache.window(filename, 500, 600)
+    assert (window['first'], window['last']) == (495, 514)
+    assert cache.lines(filename, 998, 2000) == (['line 998', 'line 999', 'line 1000'], 998, 1000, 1000)
+
+
+def test_lines_are_split_like_the_line_index(tmp_path):
+    # form feeds and other separators str.splitlines breaks at are part of a line, \r\n ends one
+    filename = write(tmp_path / 'ff.c', 'int a;\r\n\x0c\nint b; \x1c int c;\nint d;')
+    assert len(LineIndex.build(filename)) == 4
+    lines, first, last, total = SnippetCache().lines(filename, 1, 4)
+    assert lines == ['int a;', '\x0c', 'int b; \x1c int c;', 'int d;']
+    assert (first, last, total) == (1, 4, 4)
+
+
+def test_changed_files_are_indexed_again(tmp_path):
+    filename = write(tmp_path / 'a.cpp', 'one\ntwo\n')
+    cache = SnippetCache()
+    assert cache.lines(filename, 1, 10)[0] == ['one', 'two']
+    write(filename, 'one\ntwo\nthree\n')
+    os.utime(filename, ns=(0, 0))  # a different mtime even on coarse file system clocks
+    assert cache.lines(filename, 1, 10) == (['one', 'two', 'three'], 1, 3, 3)
+    assert cache.lines(write(tmp_path / 'empty.cpp', ''), 1, 10) == ([], 1, 0, 0)
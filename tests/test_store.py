@@ -0,0 +1,99 @@
+import gc
+import sqlite3
+import time
+from contextlib import closing
+
+import networkx as nx
+
+from backends.clang.projects import SharedProjects
+from utils.store import MemoryStore, SQLiteStore
+
+
+def test_evicted_entries_are_passed_to_on_evict():
+    evicted = []
+    store = MemoryStore(max_entries=2, on_evict=lambda entry: evicted.append(entry['name']))
+    for name in 'abc':
+        store.put('session', name, {'name': name})
+    assert evicted == ['a']
+    store.put('session', 'b', {'name': 'b again'})  # replaced, not evicted
+    assert evicted == ['a']
+    store.pop('session', 'c')
+    assert evicted == ['a', 'c']
+    assert store.get('session', 'b')['name'] == 'b again'
+
+
+def test_expired_entries_are_passed_to_on_evict():
+    evicted = []
+    store = MemoryStore(ttl=0, on_evict=lambda entry: evicted.append(entry['name']))
+    store.put('session', 'a', {'name': 'a', 'graph': nx.DiGraph([(1, 2)])})
+    assert store.get('session', 'a') is None
+    assert evicted == ['a'] and store.size == 0
+
+
+def test_the_watcher_of_an_evicted_project_stops(project, flags):
+    projects = SharedProjects()
+    store = MemoryStore(max_entries=1)
+    watched = projects.get(project, flags, watch=True)
+    watcher = watched.watcher
+    store.put('session', 'watched', {'project': watched, 'graph': watched.graph})
+    del watched
+    store.put('session', 'other', {})
+    gc.collect()
+    assert watcher._stop.is_set() and watcher._thread is None
+    assert not len(projects)
+
+
+def chain(n: int) -> nx.DiGraph:
+    return nx.DiGraph([(f'f{i}', f'f{i + 1}', {'count': 1}) for i in range(n)])
+
+
+def stored_graphs(filename) -> int:
+    with closing(sqlite3.connect(filename)) as connection:
+        return connection.execute('SELECT COUNT(*) FROM graphs').fetchone()[0]
+
+
+def test_entries_are_shared_between_processes(tmp_path):
+    loaded = []
+    filename = str(tmp_path / 'store.sqlite')
+    a, b = SQLiteStore(filename), SQLiteStore(filename, on_load=loaded.append)
+    graph = chain(3)
+    a.put('session', 'path', {'graph': graph, 'graph_backup': graph, 'search': 'f1', 'project': object()})
+
+    entry = b.get('session', 'path')
+    assert entry['search'] == 'f1' and 'project' not in entry  # process local parts stay in their process
+    assert nx.utils.graphs_equal(entry['graph'], graph) and entry['graph'] is entry['graph_backup']
+    assert loaded == [entry]
+    assert b.get('session', 'path') is entry  # unchanged since b loaded it
+
+    a.put('session', 'path', {'graph': chain(2), 'graph_backup': graph, 'search': 'f0'})
+    entry = b.get('session', 'path')
+    assert entry['search'] == 'f0' and len(entry['graph']) == 3 and len(loaded) == 2
+
+
+def test_graphs_are_stored_once_and_removed_with_the_last_entry(tmp_path):
+    filename = str(tmp_path / 'store.sqlite')
+    a, b = SQLiteStore(filename), SQLiteStore(filename)
+    base_a, base_b = chain(50), chain(50)  # the same project built by two workers
+    a.put('s1', 'p', {'graph': base_a, 'graph_backup': base_a})
+    b.put('s2', 'p', {'graph': base_b, 'graph_backup': base_b})
+    assert stored_graphs(filename) == 1
+
+    for n in (10, 20, 30):  # every search makes a new filtered graph
+        a.put('s1', 'p', {'graph': chain(n), 'graph_backup': base_a})
+    assert stored_graphs(filename) == 2
+    a.put('s1', 'p', {'graph': base_a, 'graph_backup': base_a})
+    assert stored_graphs(filename) == 1
+
+    b.put('s2', 'p', {'graph': chain(5), 'graph_backup': chain(6)})
+    a.put('s1', 'p', {'graph': chain(7), 'graph_backup': chain(8)})
+    assert stored_graphs(filename) == 4
+
+
+def test_expired_entries_are_removed_from_the_file(tmp_path):
+    filename = str(tmp_path / 'store.sqlite')
+    a = SQLiteStore(filename, ttl=0.05)
+    a.put('s1', 'p', {'graph': chain(3)})
+    time.sleep(0.1)
+    a.put('s2', 'p', {'graph': chain(4)})
+    assert SQLiteStore(filename).get('s1', 'p') is None
+    assert stored_graphs(filename) == 1
@@ -1,3 +1,4 @@
+import os
 from typing import Any, Dict, List
 
 from dash import dcc
@@ -9,26 +10,41 @@ def get_layout() -> html.Div:
     return html.Div(
         [
             html.Div([
-                dcc.Input(id='filter', type='text', placeholder='Search', debounce=True),
+                # substring search, `re:<pattern>` for a regular expression, `fuzzy:<chars>` fuzzy, `<prefix>*` by
+                # prefix
+                dcc.Input(id='filter', type='text', placeholder='Search', list='filter-suggestions'),
+                html.Datalist(id='filter-suggestions'),
+                # with a depth or a node budget the search only shows the nearest callers and callees of the matches
+                dcc.Input(id='filter-depth', type='number', min=0, step=1, placeholder='Depth'),
+                dcc.Input(id='filter-max-nodes', type='number', min=1, step=1, value=500, placeholder='Max. nodes'),
+                # large graphs are easier to read collapsed, a tap on a group expands or collapses it
+                dcc.Dropdown(id='group-by', placeholder='Group by', clearable=True, searchable=False,
+                             options=[{'label': 'Namespace', 'value': 'namespace'},
+                                      {'label': 'Class', 'value': 'class'},
+                                      {'label': 'File', 'value': 'file'}]),
                 # dcc.Dropdown(id='file-list', multi=True),
-                html.Button(html.I(className="fa fa-refresh"), id='reset-button')
+                # positions computed once per view on the server instead of dagre in the browser
+                dcc.Checklist(id='server-layout', options=[{'label': 'Server layout', 'value': 'server'}], value=[]),
+                html.Button(html.I(className="fa fa-refresh"), id='reset-button'),
+                # files parsed so far while a project loads in the background, the button cancels the load
+                html.Div([
+                    html.Span(id='load-progress-text'),
+                    html.Button(html.I(className='fa fa-xmark'), id='cancel-load-button', title='Cancel')
+                ], id='load-progress', style={'display': 'none'}),
 
             ], id='graph-toolbar'),
             html.Div([
                 dcc.Store(id='code-store'),
+                dcc.Store(id='highlight-store'),  # highlight changes of a tap, see static/callbacks.js:apply_highlight
+                dcc.Store(id='highlight-applied'),
                 dcc.Store(id='session-store', storage_type='memory'),  # Store the session identifier
+                dcc.Interval(id='watch-interval', interval=2000, disabled=True),  # picks up incremental updates
+                dcc.Interval(id='load-interval', interval=1000, disabled=True),  # polls a project loading
                 dcc.Loading([
                     cyto.Cytoscape(id='callgraph', elements=[],
                                    userZoomingEnabled=True,
                                    autoRefreshLayout=True,
-                                   layout={
-                                       'name': 'dagre',
-                                       'spacingFactor': 1.5,
-                                       'rankSep': 150,
-                                       # 'nodeSep': 200,
-                                       'edgeSep': 150,
-                                       'padding': 100,
-                                   },
+                                   layout=get_cyto_layout(),
                                    stylesheet=get_cyto_stylesheet())
                 ], className='loading', parent_className='outer-loading', type="circle")
             ]),
@@ -56,6 +72,28 @@ def get_layout() -> html.Div:
                                       placeholder='Enter include directories like this',
                                       # debounce=True
                                       ),
+                            html.Label('Precompiled header (optional, a header with the includes all files share)'),
+                            dcc.Input(className='w100', id='pch-header-string',
+                                      placeholder='e.g. ./src/pch.h',
+                                      ),
+                            html.Label('Project directories (optional, only the files below them are walked for '
+                                       'functions and calls, by default the directory of the project)'),
+                            dcc.Input(className='w100', id='project-paths-string',
+                                      placeholder='e.g. ./src ./include',
+                                      ),
+                            html.Label('Parallel workers (1 parses serially)'),
+                            dcc.Input(className='w100', id='workers', type='number', min=1, step=1,
+                                      value=os.cpu_count() or 1,
+                                      ),
+                            dcc.Checklist(id='watch-project',
+                                          options=[{'label': 'Watch the project and update on file changes',
+                                                    'value': 'watch'}],
+                                          value=[]),
+                            dcc.Checklist(id='skip-preamble-bodies',
+                                          options=[{'label': 'Skip the function bodies of the headers included first '
+                                                             '(faster, inline functions there lose their calls)',
+                                                    'value': 'skip'}],
+                                          value=[]),
                         ]),
                     ], id='modal-body'),
                     html.Div([
@@ -71,6 +109,24 @@ def get_layout() -> html.Div:
         ], id='dash')
 
 
+def get_cyto_layout(server_side: bool = False) -> Dict[str, Any]:
+    if server_side:
+        # the elements carry their positions, see utils/cytoscape/layout.py
+        return {
+            'name': 'preset',
+            'fit': True,
+            'padding': 100,
+        }
+    return {
+        'name': 'dagre',
+        'spacingFactor': 1.5,
+        'rankSep': 150,
+        # 'nodeSep': 200,
+        'edgeSep': 150,
+        'padding': 100,
+    }
+
+
 def get_cyto_stylesheet() -> List[Dict[str, Any]]:
     return [
         {
@@ -124,6 +180,37 @@ def get_cyto_stylesheet() -> List[Dict[str, Any]]:
                 'line-color': 'rgb(59, 127, 180)'
             }
         },
+        {
+            'selector': 'node[group = "true"]',
+            'style': {
+                'background-color': 'rgb(60, 64, 66)',
+                'border-style': 'dashed',
+            }
+        },
+        {
+            'selector': 'node[expanded = "true"]',
+            'style': {
+                'text-valign': 'top',
+                'background-opacity': 0.2,
+            }
+        },
+        {
+            'selector': 'edge[count > 1]',
+            'style': {
+                'label': 'data(count)',
+                'color': 'rgb(184, 194, 200)',
+                'width': 'mapData(count, 1, 100, 1, 8)',
+            }
+        },
+        {
+            'selector': 'node[kind = "marker"]',
+            'style': {
+                'shape': 'round-rectangle',
+                'border-style': 'dotted',
+                'background-color': 'rgb(43, 46, 48)',
+                'font-style': 'italic',
+            }
+        },
         {
             'selector': 'node[filtered = "true"]',
             'style': {
@@ -0,0 +1,159 @@
+import gc
+from contextlib import contextmanager
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+import networkx as nx
+
+from utils.metrics import METRICS
+from utils.networkx.compact import CompactGraph, np
+
+
+@contextmanager
+def gc_paused():
+    # millions of small dicts trigger the cyclic collector over and over, none of them are garbage yet
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class ViewState:
+    """Highlight state of one session on a graph that is shared with other sessions
+
+    The graph data is never written, cytoscape elements get `chain`, `selected`, `filtered` and `relationship` from
+    here. `chain` holds the selected node and its callers, `filtered` the matches of the search.
+    """
+
+    def __init__(self, chain: Optional[Set] = None, selected=None, filtered: Optional[Set] = None):
+        self.chain = set(chain or ())
+        self.selected = selected
+        self.filtered = set(filtered or ())
+
+    def flags(self, n) -> Dict[str, str]:
+        flags = dict(chain="true" if n in self.chain else "false",
+                     selected="true" if n == self.selected else "false",
+                     filtered="true" if n in self.filtered else "false")
+        if n in self.chain and n != self.selected:
+            flags['relationship'] = "parent"
+        return flags
+
+    def copy(self) -> 'ViewState':
+        return ViewState(self.chain, self.selected, self.filtered)
+
+    def changed(self, other: 'ViewState') -> Set:
+        # nodes whose flags differ between the two states
+        return (self.chain ^ other.chain) | (self.filtered ^ other.filtered) | \
+            ({self.selected, other.selected} if self.selected != other.selected else set())
+
+
+def get_cytoscape_data_from_nx(graph: nx.DiGraph, view: Optional[ViewState] = None) -> List[Dict]:
+    with gc_paused(), METRICS.span('cytoscape'):
+        if isinstance(graph, CompactGraph):
+            elements = _get_cytoscape_data_from_compact(graph, view)
+        else:
+            elements = _get_cytoscape_data_from_nx(graph, view)
+    METRICS.inc('callgraph_elements_total', len(elements))
+    return elements
+
+
+def _get_cytoscape_data_from_nx(graph: nx.DiGraph, view: Optional[ViewState] = None) -> List[Dict]:
+    # one pass over nodes and edges, node data is looked up in a plain dict instead of the graph views
+    data = {k: d['data'] for k, d in graph.nodes(data=True)}
+    if view is not None:  # the view state is merged into copies, the graph data stays as it is
+        nodes = [dict(data=dict(d, **view.flags(k))) for k, d in data.items() if k]
+        chain = view.chain
+    else:
+        nodes = [dict(data=d) for k, d in data.items() if k]
+        chain = {k for k, d in data.items() if d.get('chain') == "true"}
+    node_names = {n['data']['id'] for n in nodes}  # cytoscape knows the nodes by their data id
+    edges = []
+    wrong = 0
+    for a, successors in graph.adjacency():
+        if not a:
+            continue
+        a_ok = a in node_names
+        for b in successors:
+            if not b:
+                continue
+            if not a_ok or b not in node_names:
+                wrong += 1
+                continue
+            edges.append(dict(data=dict(source=a, target=b,
+                                        highlight="true" if a in chain and b in chain else "false")))
+    if wrong:
+        print(f'Skipped {wrong} edges whose source or target is not a node id')
+    elements = [
+        *nodes,
+        *edges,
+    ]
+    return elements
+
+
+def _get_cytoscape_data_from_compact(graph: CompactGraph, view: Optional[ViewState] = None) -> List[Dict]:
+    # the same elements as from a networkx graph, the edges are checked and highlighted on the arrays
+    names = graph.names
+    data = graph.node_data_list()
+    if view is not None:
+        nodes = [dict(data=dict(d, **view.flags(k))) for k, d in zip(names, data) if k]
+        chain = view.chain
+    else:
+        nodes = [dict(data=d) for k, d in zip(names, data) if k]
+        chain = {k for k, d in zip(names, data) if d.get('chain') == "true"}
+    node_names = {n['data']['id'] for n in nodes}
+    named = np.fromiter((bool(k) for k in names), dtype=bool, count=len(names))
+    valid = np.fromiter((bool(k) and k in node_names for k in names), dtype=bool, count=len(names))
+    in_chain = np.fromiter((k in chain for k in names), dtype=bool, count=len(names))
+    sources, targets = graph.edge_ids()
+    ok = valid[sources] & valid[targets]
+    wrong = int(np.count_nonzero(named[sources] & named[targets] & ~ok))
+    highlight = (in_chain[sources] & in_chain[targets])[ok].tolist()
+    edges = [dict(data=dict(source=names[a], target=names[b], highlight="true" if h else "false"))
+             for a, b, h in zip(sources[ok].tolist(), targets[ok].tolist(), highlight)]
+    if wrong:
+        print(f'Skipped {wrong} edges whose source or target is not a node id')
+    return [*nodes, *edges]
+
+
+class CytoscapeElements:
+    """Cytoscape elements of one view of a graph, built once and reused while only the view state changes
+
+    The node elements are copies of the graph data with the flags of the session's ViewState, on later calls only the
+    nodes whose flags changed and the edges around them are updated. The elements are built again when `key` (e.g.
+    the graph version and the search) changes, without a key the graph object identifies the view.
+    """
+
+    def __init__(self):
+        self._key = None
+        self._size = None
+        self._elements = []  # type: List[Dict]
+        self._nodes = dict()  # type: Dict[Hashable, Dict]
+        self._edges = dict()  # type: Dict[Tuple[Hashable, Hashable], Dict]
+        self._view = ViewState()
+
+    def __call__(self, graph: nx.DiGraph, key=None, view: Optional[ViewState] = None) -> List[Dict]:
+        view = view if view is not None else ViewState()
+        key = key if key is not None else id(graph)
+        size = (graph.number_of_nodes(), graph.number_of_edges())
+        if self._key != key or self._size != size:
+            self._elements = get_cytoscape_data_from_nx(graph, view)
+            self._nodes = {e['data']['id']: e['data'] for e in self._elements if 'source' not in e['data']}
+            self._edges = {(e['data']['source'], e['data']['target']): e['data'] for e in self._elements
+                           if 'source' in e['data']}
+            self._key = key
+            self._size = size
+            self._view = view.copy()
+            return self._elements
+        for n in view.changed(self._view):
+            if n not in self._nodes:
+                continue
+            data = self._nodes[n]
+            data.pop('relationship', None)
+            data.update(view.flags(n))
+            for a, b in (*graph.in_edges(n), *graph.out_edges(n)):
+                if (a, b) in self._edges:
+                    self._edges[a, b]['highlight'] = "true" if a in view.chain and b in view.chain else "false"
+        self._view = view.copy()
+        return self._elements
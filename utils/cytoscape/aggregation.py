@@ -0,0 +1,221 @@
+import os
+import threading
+from collections import OrderedDict, defaultdict, deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import networkx as nx
+
+from utils.cytoscape import ViewState, gc_paused
+
+GROUP_MODES = ('namespace', 'class', 'file')
+METHOD_KINDS = {'CursorKind.CXX_METHOD', 'CursorKind.CONSTRUCTOR', 'CursorKind.DESTRUCTOR',
+                'CursorKind.CONVERSION_FUNCTION'}
+GROUP_PREFIX = 'group:'
+
+
+def split_scopes(name: str) -> List[str]:
+    """Splits a qualified name like `ns::Class<T, U>::method(int)` into its scopes `['ns', 'Class<T, U>', 'method']`
+
+    Only `::` outside of template arguments count, the parameter list is dropped.
+    """
+    head = name.split('(', 1)[0]
+    if '<' not in head and 'operator' not in head:
+        return head.split('::')
+    scopes = []
+    depth = 0
+    start = 0
+    i = 0
+    while i < len(name):
+        if name.startswith('operator', i) and depth == 0:
+            break  # `operator<`, `operator()`, ... do not open anything
+        c = name[i]
+        if c == '<':
+            depth += 1
+        elif c == '>':
+            depth = max(0, depth - 1)
+        elif c == '(' and depth == 0:
+            break
+        elif c == ':' and depth == 0 and name.startswith('::', i):
+            scopes.append(name[start:i])
+            i += 2
+            start = i
+            continue
+        i += 1
+    last = name[start:]
+    if not last.startswith('operator'):
+        last = last.split('(', 1)[0]
+    scopes.append(last)
+    return scopes
+
+
+def get_group_path(node, data: Dict, mode: str, root: str = '') -> Tuple[str, ...]:
+    """The nested groups of a node, outermost first, an empty path keeps the node at the top level"""
+    if data.get('kind') == 'marker':  # placeholders of cut off callers or callees, see get_neighborhood
+        return ()
+    if mode == 'file':
+        filename = data.get('file')
+        if not filename:
+            return ()
+        filename = os.path.abspath(filename)
+        if root:
+            filename = os.path.relpath(filename, root)
+        return tuple(p for p in filename.split(os.sep) if p not in ('', '.'))
+    scopes = split_scopes(str(node))[:-1]
+    if mode == 'namespace' and scopes and data.get('kind') in METHOD_KINDS:
+        scopes = scopes[:-1]  # the class of a method is not a namespace
+    return tuple(scopes)
+
+
+def compress_paths(paths: Dict[object, Tuple[str, ...]], separator: str) -> Dict[object, Tuple[str, ...]]:
+    """Merges groups that only contain a single subgroup into it, e.g. the directories above the sources"""
+    size = defaultdict(int)
+    children = defaultdict(set)
+    for path in paths.values():
+        for depth in range(1, len(path) + 1):
+            size[path[:depth]] += 1
+            children[path[:depth - 1]].add(path[:depth])
+
+    compressed = dict()
+    for n, path in paths.items():
+        parts = []
+        start = 0
+        for depth in range(1, len(path) + 1):
+            group = path[:depth]
+            # a group without functions of its own and a single subgroup is not worth a level
+            if depth < len(path) and len(children[group]) == 1 and size[next(iter(children[group]))] == size[group]:
+                continue
+            parts.append(separator.join(path[start:depth]))
+            start = depth
+        compressed[n] = tuple(parts)
+    return compressed
+
+
+class GraphAggregation:
+    """Hierarchical level of detail view of a call graph
+
+    Nodes are grouped by namespace, enclosing class (namespaces and classes) or source file (directories and files).
+    A collapsed group is shown as a single node with the number of functions it contains, edges between collapsed
+    groups are merged and carry the number of calls they stand for. An expanded group is a compound node around its
+    subgroups and functions. The group tree is built once per graph, the elements of each set of expanded groups are
+    kept in a small LRU cache so going back and forth between zoom levels does not aggregate again.
+    """
+
+    def __init__(self, graph: nx.DiGraph, mode: str, max_cached: int = 32):
+        if mode not in GROUP_MODES:
+            raise ValueError(f'unknown group mode {mode}, use one of {", ".join(GROUP_MODES)}')
+        self.graph = graph
+        self.mode = mode
+        self.max_cached = max_cached
+        root = ''
+        if mode == 'file':
+            directories = {os.path.dirname(os.path.abspath(d['file'])) for _, d in graph.nodes(data='data')
+                           if d and d.get('file')}
+            root = os.path.commonpath(directories) if directories else ''
+        paths = {n: get_group_path(n, data or {}, mode, root) for n, data in graph.nodes(data='data') if n}
+        self.paths = compress_paths(paths, os.sep if mode == 'file' else '::')  # type: Dict[object, Tuple[str, ...]]
+        self.children = defaultdict(set)  # type: Dict[Tuple[str, ...], Set[Tuple[str, ...]]]
+        self.size = defaultdict(int)  # type: Dict[Tuple[str, ...], int]
+        for path in self.paths.values():
+            for depth in range(1, len(path) + 1):
+                self.size[path[:depth]] += 1
+                self.children[path[:depth - 1]].add(path[:depth])
+        self._ids = {self.group_id(path): path for path in self.size}
+        self._cache = OrderedDict()  # type: OrderedDict[frozenset, Tuple[List[Dict], List[Tuple], List[Dict]]]
+        self._lock = threading.Lock()
+
+    def group_id(self, path: Tuple[str, ...]) -> str:
+        return GROUP_PREFIX + self.mode + ':' + '/'.join(path)
+
+    def group_path(self, group_id: str) -> Optional[Tuple[str, ...]]:
+        return self._ids.get(group_id)
+
+    def initial(self, max_nodes: int = 50) -> Set[Tuple[str, ...]]:
+        """Expands groups breadth first, as long as the view does not get more than `max_nodes` visible nodes"""
+        expanded = set()
+        visible = len(self.children[()]) + sum(1 for p in self.paths.values() if not p)
+        queue = deque(sorted(self.children[()]))
+        while queue:
+            path = queue.popleft()
+            grows = len(self.children[path]) + self.size[path] - sum(self.size[c] for c in self.children[path])
+            if visible + grows - 1 > max_nodes:
+                continue
+            expanded.add(path)
+            visible += grows - 1
+            queue.extend(sorted(self.children[path]))
+        return expanded
+
+    @staticmethod
+    def _collapsed(path: Tuple[str, ...], expanded: Set[Tuple[str, ...]]) -> Optional[Tuple[str, ...]]:
+        # the outermost collapsed group of a path, None when all of them are expanded
+        for depth in range(1, len(path) + 1):
+            if path[:depth] not in expanded:
+                return path[:depth]
+        return None
+
+    def _build(self, expanded: frozenset) -> Tuple[List[Dict], List[Tuple], List[Dict]]:
+        # far fewer groups than functions, the outermost collapsed group is looked up once per group
+        collapsed = {path: self._collapsed(path, expanded) for path in {*self.paths.values()}}
+        representatives = {n: collapsed[path] or n for n, path in self.paths.items()}
+        groups = dict()  # type: Dict[Tuple[str, ...], Dict]
+        leaves = []
+
+        def add_group(path: Tuple[str, ...]):
+            if not path or path in groups:
+                return
+            add_group(path[:-1])
+            data = dict(id=self.group_id(path), group='true', expanded='true' if path in expanded else 'false',
+                        label=path[-1] if path in expanded else f'{path[-1]} ({self.size[path]})',
+                        size=self.size[path], chain='false', selected='false')
+            if len(path) > 1:
+                data['parent'] = self.group_id(path[:-1])
+            groups[path] = dict(data=data)
+
+        for n, r in representatives.items():
+            if isinstance(r, tuple):
+                add_group(r)
+            else:
+                add_group(self.paths[n])
+                leaves.append((n, self.group_id(self.paths[n]) if self.paths[n] else None))
+
+        counts = defaultdict(int)
+        for a, successors in self.graph.adjacency():
+            ra = representatives.get(a)
+            if ra is None:
+                continue
+            for b in successors:
+                rb = representatives.get(b)
+                if rb is None:
+                    continue
+                if ra == rb and isinstance(ra, tuple):
+                    continue  # calls inside a collapsed group
+                counts[ra, rb] += 1
+        edges = []
+        for (ra, rb), count in counts.items():
+            source = self.group_id(ra) if isinstance(ra, tuple) else ra
+            target = self.group_id(rb) if isinstance(rb, tuple) else rb
+            edges.append(dict(data=dict(source=source, target=target, count=count, highlight='false')))
+        return list(groups.values()), leaves, edges
+
+    def elements(self, expanded: Iterable[Tuple[str, ...]], view: Optional[ViewState] = None) -> List[Dict]:
+        view = view if view is not None else ViewState()
+        key = frozenset(expanded)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+            else:
+                with gc_paused():
+                    self._cache[key] = self._build(key)
+                while len(self._cache) > self.max_cached:
+                    self._cache.popitem(last=False)
+            groups, leaves, edges = self._cache[key]
+        # the elements are copied on every call, with the flags of the view, positions are set on them (see
+        # ElementPositions) and the aggregation of a project is shared by its sessions. The graph data is shared
+        nodes = []
+        for n, parent in leaves:
+            data = dict(self.graph.nodes[n]['data'], **view.flags(n))
+            if parent:
+                data['parent'] = parent
+            nodes.append(dict(data=data))
+        edges = [dict(data=dict(e['data'], highlight='true' if e['data']['source'] in view.chain and
+                                e['data']['target'] in view.chain else 'false')) for e in edges]
+        return [*(dict(g) for g in groups), *nodes, *edges]
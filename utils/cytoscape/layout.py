@@ -0,0 +1,53 @@
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Tuple
+
+import networkx as nx
+
+from utils.networkx.layout import get_layered_layout
+
+CHARACTER_WIDTH = 8  # px of a label character in the monospace node font
+NODE_PADDING = 20
+
+
+class ElementPositions:
+    """Server side positions of cytoscape elements, shown with the `preset` layout
+
+    The positions of a view are computed once, from the elements themselves so that grouped views are laid out as
+    they are shown, and kept per key (e.g. graph version, search and expanded groups) in a small LRU cache. Highlight
+    changes neither change the key nor move a node, the browser does not lay out anything.
+    """
+
+    def __init__(self, max_cached: int = 16):
+        self.max_cached = max_cached
+        self._positions = OrderedDict()  # type: OrderedDict[Hashable, Dict[str, Tuple[float, float]]]
+
+    def __call__(self, elements: List[Dict], key: Hashable) -> List[Dict]:
+        if key in self._positions:
+            self._positions.move_to_end(key)
+        else:
+            self._positions[key] = get_element_positions(elements)
+            while len(self._positions) > self.max_cached:
+                self._positions.popitem(last=False)
+        positions = self._positions[key]
+        for e in elements:
+            xy = positions.get(e['data'].get('id'))
+            if xy is not None:
+                e['position'] = {'x': xy[0], 'y': xy[1]}
+        return elements
+
+
+def get_element_positions(elements: List[Dict]) -> Dict[str, Tuple[float, float]]:
+    # expanded groups are compound nodes, cytoscape sizes them around their members
+    graph = nx.DiGraph()
+    labels = dict()
+    for e in elements:
+        data = e['data']
+        if 'source' in data or data.get('expanded') == 'true':
+            continue
+        graph.add_node(data['id'])
+        labels[data['id']] = str(data.get('label', data['id']))
+    for e in elements:
+        data = e['data']
+        if 'source' in data and data['source'] in graph and data['target'] in graph:
+            graph.add_edge(data['source'], data['target'])
+    return get_layered_layout(graph, width=lambda n: len(labels[n]) * CHARACTER_WIDTH + NODE_PADDING)
@@ -0,0 +1,194 @@
+import bisect
+import cProfile
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# name -> (type, help) of every metric the explorer exports, see Metrics.render
+METRICS_HELP = {
+    'callgraph_span_seconds': ('histogram', 'Time spent in each stage (parse, walk, build, filter, cytoscape, ...)'),
+    'callgraph_request_seconds': ('histogram', 'Time to answer a request, by Dash callback or route'),
+    'callgraph_response_bytes_total': ('counter', 'Bytes sent in responses, by Dash callback or route'),
+    'callgraph_translation_units_total': ('counter', 'Translation units by result (parsed, cached, failed)'),
+    'callgraph_diagnostics_total': ('counter', 'Error diagnostics of the parsed translation units'),
+    'callgraph_cursors_visited_total': ('counter', 'Cursors visited while walking translation units'),
+    'callgraph_name_cache_total': ('counter', 'Lookups of qualified names by result (hit, miss)'),
+    'callgraph_project_cache_total': ('counter', 'Lookups of data derived from a project graph by data and result'),
+    'callgraph_snippet_cache_total': ('counter', 'Lookups of line indexes of source files by result (hit, miss)'),
+    'callgraph_graph_nodes': ('gauge', 'Nodes of the last call graph built'),
+    'callgraph_graph_edges': ('gauge', 'Edges of the last call graph built'),
+    'callgraph_elements_total': ('counter', 'Cytoscape elements serialized'),
+    'callgraph_projects': ('gauge', 'Projects loaded in this process'),
+    'callgraph_store_entries': ('gauge', 'Entries (session and project) in the server store of this process'),
+    'callgraph_store_bytes': ('gauge', 'Estimated memory of the graphs in the server store of this process'),
+    'callgraph_store_session_bytes': ('gauge', 'Estimated memory of the graphs of a session, by a hash of the session'),
+}
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, str], float]  # name, labels, value
+
+
+def _labels(labels: Dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format(name: str, labels: Labels, value: float) -> str:
+    inner = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return f'{name}{{{inner}}} {value:.17g}' if inner else f'{name} {value:.17g}'
+
+
+class Metrics:
+    """Counters, gauges and histograms of this process, rendered in the Prometheus text format
+
+    `span` times a stage into the `callgraph_span_seconds` histogram. Values that are cheaper to read when scraped
+    (sizes of the store, ...) come from `collector` functions. Worker processes send what they counted back with their
+    results, `drain` takes it out of the worker and `merge` adds it to the server's metrics.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self._counters = defaultdict(float)  # type: Dict[Tuple[str, Labels], float]
+        self._gauges = dict()  # type: Dict[Tuple[str, Labels], float]
+        self._histograms = dict()  # type: Dict[Tuple[str, Labels], List]  # counts per bucket, sum, count
+        self._collectors = []  # type: List[Callable[[], Iterable[Sample]]]
+
+    def inc(self, name: str, value: float = 1, **labels):
+        with self.lock:
+            self._counters[name, _labels(labels)] += value
+
+    def set(self, name: str, value: float, **labels):
+        with self.lock:
+            self._gauges[name, _labels(labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        with self.lock:
+            histogram = self._histograms.get((name, _labels(labels)))
+            if histogram is None:
+                histogram = self._histograms[name, _labels(labels)] = [[0] * len(self.buckets), 0.0, 0]
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def span(self, stage: str, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('callgraph_span_seconds', time.perf_counter() - start, stage=stage, **labels)
+
+    def collector(self, collect: Callable[[], Iterable[Sample]]) -> Callable[[], Iterable[Sample]]:
+        self._collectors.append(collect)
+        return collect
+
+    def drain(self) -> Dict:
+        """Counters and histograms counted since the last drain, they are reset"""
+        with self.lock:
+            counted = dict(counters=dict(self._counters), histograms=self._histograms)
+            self._counters = defaultdict(float)
+            self._histograms = dict()
+            return counted
+
+    def merge(self, counted: Dict):
+        with self.lock:
+            for key, value in counted['counters'].items():
+                self._counters[key] += value
+            for key, (buckets, total, count) in counted['histograms'].items():
+                histogram = self._histograms.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+                histogram[0] = [a + b for a, b in zip(histogram[0], buckets)]
+                histogram[1] += total
+                histogram[2] += count
+
+    def render(self) -> str:
+        gauges = dict()
+        for collect in self._collectors:
+            try:
+                for name, labels, value in collect():
+                    gauges[name, _labels(labels)] = value
+            except Exception as e:  # a broken collector must not take the other metrics down
+                print(f'Collecting metrics failed: {e}')
+        with self.lock:
+            gauges.update(self._gauges)
+            samples = defaultdict(list)  # type: Dict[str, List[str]]
+            for (name, labels), value in sorted((*self._counters.items(), *gauges.items()), key=lambda item: item[0]):
+                samples[name].append(_format(name, labels, value))
+            # the lines of a histogram stay in the order of the buckets, then +Inf, sum and count
+            for (name, labels), (buckets, total, count) in sorted(self._histograms.items(), key=lambda item: item[0]):
+                cumulative = 0
+                for bound, n in zip(self.buckets, buckets):
+                    cumulative += n
+                    samples[name].append(_format(f'{name}_bucket', (*labels, ('le', f'{bound:g}')), cumulative))
+                samples[name].append(_format(f'{name}_bucket', (*labels, ('le', '+Inf')), count))
+                samples[name].append(_format(f'{name}_sum', labels, total))
+                samples[name].append(_format(f'{name}_count', labels, count))
+        lines = []
+        for name in sorted(samples):
+            kind, text = METRICS_HELP.get(name, ('untyped', name))
+            lines += [f'# HELP {name} {text}', f'# TYPE {name} {kind}', *samples[name]]
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+def get_request_label(request) -> str:
+    # Dash callbacks all post to the same route, they are told apart by their outputs (`..a.b...c.d..` for several)
+    if request.path.endswith('/_dash-update-component'):
+        body = request.get_json(silent=True) or {}
+        output = str(body.get('output', '')).strip('.').replace('...', ',')
+        return re.sub(r'[^\w.,@-]+', ' ', output).strip()[:120] or request.path
+    # the rule, not the path, so that unknown paths do not make a new series each
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def instrument_server(server, metrics: Metrics = METRICS, profile_dir: Optional[str] = None):
+    """Times every request of a Flask server and adds the `/metrics` route
+
+    With `profile_dir` a request that has the header `X-Callgraph-Profile: 1` or the cookie `callgraph-profile=1` is run
+    under cProfile and its stats are written there (open them with snakeviz or `python -m pstats`). Samplers like py-spy
+    need nothing from here, the stages show up by their function names.
+    """
+    import flask
+
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+
+    @server.before_request
+    def start_request():
+        flask.g.metrics_start = time.perf_counter()
+        if profile_dir and (flask.request.headers.get('X-Callgraph-Profile') == '1' or
+                            flask.request.cookies.get('callgraph-profile') == '1'):
+            flask.g.profiler = cProfile.Profile()
+            flask.g.profiler.enable()
+
+    @server.after_request
+    def finish_request(response):
+        profiler = flask.g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            name = re.sub(r'[^\w.-]+', '_', get_request_label(flask.request))[:80]
+            profiler.dump_stats(os.path.join(profile_dir, f'{time.strftime("%Y%m%d-%H%M%S")}-{name}.prof'))
+        start = flask.g.pop('metrics_start', None)
+        if start is not None and flask.request.path != '/metrics':
+            label = get_request_label(flask.request)
+            metrics.observe('callgraph_request_seconds', time.perf_counter() - start, callback=label)
+            if not response.is_streamed:
+                metrics.inc('callgraph_response_bytes_total', response.calculate_content_length() or 0,
+                            callback=label)
+        return response
+
+    @server.route('/metrics')
+    def get_metrics():
+        return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
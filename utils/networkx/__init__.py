@@ -1,23 +1,144 @@
+from collections import deque
+from typing import Dict, Hashable, Optional, Set, Tuple
+
 import networkx as nx
 
+from utils.networkx.compact import CompactGraph, CompactReachability
+from utils.networkx.reachability import ReachabilityIndex
+
 
 def get_parents_recursive(graph: nx.DiGraph, node, parents=None):
+    # every caller once, in depth first order, terminates on recursive calls
     if parents is None:
         parents = []
-
-    for parent in graph.predecessors(node):
+    seen = set(parents)
+    stack = list(reversed(list(graph.predecessors(node))))
+    while stack:
+        parent = stack.pop()
+        if parent in seen:
+            continue
+        seen.add(parent)
         parents.append(parent)
-        get_parents_recursive(graph, parent, parents)
-
+        stack.extend(reversed(list(graph.predecessors(parent))))
     return parents
 
 
 def get_successors_recursive(graph: nx.DiGraph, node, successors=None):
+    # every callee once, in depth first order, terminates on recursive calls
     if successors is None:
         successors = []
-
-    for successor in graph.successors(node):
+    seen = set(successors)
+    stack = list(reversed(list(graph.successors(node))))
+    while stack:
+        successor = stack.pop()
+        if successor in seen:
+            continue
+        seen.add(successor)
         successors.append(successor)
-        get_successors_recursive(graph, successor, successors)
-
+        stack.extend(reversed(list(graph.successors(successor))))
     return successors
+
+
+def update_graph_in_place(graph: nx.DiGraph, new_graph: nx.DiGraph,
+                          keep=('chain', 'selected', 'filtered', 'relationship')):
+    # patch graph so that it equals new_graph without touching unchanged nodes (and their view state)
+    graph.remove_nodes_from([n for n in graph.nodes if n not in new_graph])
+    for n, attrs in new_graph.nodes(data=True):
+        if n not in graph:
+            graph.add_node(n, **attrs)
+            continue
+        old = graph.nodes[n].get('data', {})
+        new = attrs.get('data', {})
+        if {k: v for k, v in old.items() if k not in keep} != {k: v for k, v in new.items() if k not in keep}:
+            graph.nodes[n]['data'] = dict(new, **{k: old[k] for k in keep if k in old})
+    graph.remove_edges_from([e for e in graph.edges if not new_graph.has_edge(*e)])
+    for a, b, attrs in new_graph.edges(data=True):
+        if not graph.has_edge(a, b):
+            graph.add_edge(a, b, **attrs)
+        elif graph[a][b] != attrs:  # e.g. the number of call sites changed
+            graph[a][b].update(attrs)
+
+
+def get_reachable(graph: nx.DiGraph, sources, reverse=False) -> set:
+    # one breadth-first search from all sources at once, every node is visited at most once
+    if isinstance(graph, CompactGraph):
+        return graph.reachable(sources, reverse)
+    neighbors = graph.predecessors if reverse else graph.successors
+    reachable = set(sources)
+    queue = deque(reachable)
+    while queue:
+        for n in neighbors(queue.popleft()):
+            if n not in reachable:
+                reachable.add(n)
+                queue.append(n)
+    return reachable
+
+
+def get_reachability_index(graph: nx.DiGraph):
+    # a compact graph is searched on its arrays, its condensation would need the networkx graph again
+    if isinstance(graph, CompactGraph):
+        return CompactReachability(graph)
+    return ReachabilityIndex(graph)
+
+
+def get_neighborhood(graph: nx.DiGraph, sources, depth: Optional[int] = None,
+                     max_nodes: Optional[int] = None) -> Tuple[Set, Dict[Tuple[Hashable, bool], int], int]:
+    """Callers and callees of the sources up to `depth` calls away, at most `max_nodes` nodes
+
+    A single breadth-first search walks up (callers) and down (callees) from all sources at once, so the nearest
+    nodes are kept when the budget runs out. Returns the nodes, for every node whose callers (reverse=True) or
+    callees (reverse=False) were cut off by the depth or the budget how many of them were left out, and how many of
+    the sources themselves did not fit.
+    """
+    nodes = set()
+    queue = deque()
+    sources = sorted((s for s in sources if s in graph), key=str)
+    for s in sources[:max_nodes]:
+        nodes.add(s)
+        queue.append((s, 0, None))  # node, distance, direction (None for both)
+    expanded = set()
+    cut = set()
+    while queue:
+        n, distance, direction = queue.popleft()
+        for reverse in ((True, False) if direction is None else (direction,)):
+            if (n, reverse) in expanded:
+                continue
+            expanded.add((n, reverse))
+            neighbors = graph.predecessors(n) if reverse else graph.successors(n)
+            if depth is not None and distance >= depth:
+                cut.add((n, reverse))
+                continue
+            for m in neighbors:
+                if m in nodes:
+                    if (m, reverse) not in expanded:  # reached the other way before, walk on in this direction too
+                        queue.append((m, distance + 1, reverse))
+                    continue
+                if max_nodes is not None and len(nodes) >= max_nodes:
+                    cut.add((n, reverse))
+                    break
+                nodes.add(m)
+                queue.append((m, distance + 1, reverse))
+
+    hidden = dict()
+    for n, reverse in cut:
+        count = sum(1 for m in (graph.predecessors(n) if reverse else graph.successors(n)) if m not in nodes)
+        if count:
+            hidden[n, reverse] = count
+    return nodes, hidden, len(sources) - len(sources[:max_nodes])
+
+
+def add_truncation_markers(graph: nx.DiGraph, hidden: Dict[Tuple[Hashable, bool], int], dropped: int = 0):
+    # one placeholder node per cut off side of a node, e.g. `+12 callers`, and one for the matches left out
+    if dropped:
+        graph.add_node('more matches', data=dict(id='more matches', label=f'+{dropped} matches', kind='marker',
+                                                 truncated='true', hidden=dropped, chain='false'))
+    for (n, reverse), count in hidden.items():
+        if n not in graph:
+            continue
+        marker = f'{"callers" if reverse else "callees"} of {n}'
+        graph.add_node(marker, data=dict(id=marker, label=f'+{count} {"callers" if reverse else "callees"}',
+                                         kind='marker', truncated='true', hidden=count, chain='false'))
+        if reverse:
+            graph.add_edge(marker, n)
+        else:
+            graph.add_edge(n, marker)
@@ -0,0 +1,305 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+import networkx as nx
+
+try:
+    import numpy as np
+except ImportError:  # optional, only needed for CompactGraph
+    np = None
+
+COMPACT_FORMAT = 'compact-callgraph'
+COMPACT_VERSION = 1
+ARRAYS = ('indptr', 'indices', 'rindptr', 'rindices')
+
+
+class CompactNodeView:
+    # the part of networkx' NodeView the app reads: iteration, membership, `nodes[n]['data']` and `nodes(data=...)`
+    def __init__(self, graph: 'CompactGraph'):
+        self._graph = graph
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self._graph.names)
+
+    def __len__(self):
+        return len(self._graph.names)
+
+    def __contains__(self, n):
+        return n in self._graph.index
+
+    def __getitem__(self, n) -> Dict:
+        return dict(data=self._graph.node_data(n))
+
+    def __call__(self, data=False, default=None):
+        if data is False:
+            return self
+        names = self._graph.names
+        if data is True:
+            return ((n, dict(data=d)) for n, d in zip(names, self._graph.node_data_list()))
+        if data == 'data':
+            return zip(names, self._graph.node_data_list())
+        return ((n, default) for n in names)
+
+
+class CompactGraph:
+    """Read-only call graph in a few flat arrays, for projects with millions of calls
+
+    Node ids are numbered, every key of the node data (file, kind, label, ...) is a table of its distinct values and an
+    int32 array with the index of each node's value in it, so a file or kind shared by thousands of functions is stored
+    once. Calls are kept in compressed sparse row form in both directions, `indptr`/`indices` for the callees and
+    `rindptr`/`rindices` for the callers, `counts` has the number of call sites of each call in `indices`. The part of
+    the networkx DiGraph API the app reads (nodes, successors, predecessors, adjacency, subgraph, ...) is answered from
+    the arrays, so it can stand in for the graph it was made from. Data dicts are made on access, writing to them does
+    not change the graph.
+    """
+
+    def __init__(self, names: List[Hashable], columns: Dict[str, Tuple[List, 'np.ndarray']],
+                 indptr: 'np.ndarray', indices: 'np.ndarray', rindptr: Optional['np.ndarray'] = None,
+                 rindices: Optional['np.ndarray'] = None, counts: Optional['np.ndarray'] = None):
+        if np is None:
+            raise ImportError('CompactGraph needs numpy, install it with `pip install numpy`')
+        self.names = names
+        self.columns = columns  # key -> (distinct values, value index per node or -1)
+        self.indptr = indptr
+        self.indices = indices
+        self.counts = counts if counts is not None else np.ones(len(indices), dtype=np.int32)
+        self._index()
+        if rindptr is None or rindices is None:
+            # callers are the callees sorted by target, argsort keeps them in source order
+            sources = np.repeat(np.arange(len(names), dtype=np.int32), np.diff(indptr))
+            rindices = sources[np.argsort(indices, kind='stable')]
+            rindptr = np.zeros(len(names) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(indices, minlength=len(names)), out=rindptr[1:])
+        self.rindptr = rindptr
+        self.rindices = rindices
+
+    def _index(self):
+        self.index = {n: i for i, n in enumerate(self.names)}  # type: Dict[Hashable, int]
+        self.nodes = CompactNodeView(self)
+
+    def __getstate__(self):
+        # the index is rebuilt from the names, it is as large as them
+        return {k: v for k, v in self.__dict__.items() if k not in ('index', 'nodes')}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._index()
+
+    @classmethod
+    def from_networkx(cls, graph: nx.DiGraph) -> 'CompactGraph':
+        """The compact form of a graph whose nodes have a `data` dict with hashable values"""
+        if np is None:
+            raise ImportError('CompactGraph needs numpy, install it with `pip install numpy`')
+        names = list(graph.nodes)
+        index = {n: i for i, n in enumerate(names)}
+        tables = dict()  # type: Dict[str, Dict[Hashable, int]]
+        codes = dict()  # type: Dict[str, np.ndarray]
+        for i, (_, data) in enumerate(graph.nodes(data='data')):
+            for k, v in (data or {}).items():
+                table = tables.get(k)
+                if table is None:
+                    table = tables[k] = dict()
+                    codes[k] = np.full(len(names), -1, dtype=np.int32)
+                code = table.get(v)
+                if code is None:
+                    code = table[v] = len(table)
+                codes[k][i] = code
+        columns = {k: (list(table), codes[k]) for k, table in tables.items()}
+
+        indptr = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter((len(graph.succ[n]) for n in names), dtype=np.int64, count=len(names)),
+                  out=indptr[1:])
+        indices = np.fromiter((index[b] for n in names for b in graph.succ[n]), dtype=np.int32,
+                              count=int(indptr[-1]))
+        # the lines of the call sites are left out, they would take more memory than the whole graph
+        counts = np.fromiter((e.get('count', 1) for n in names for e in graph.succ[n].values()), dtype=np.int32,
+                             count=int(indptr[-1]))
+        return cls(names, columns, indptr, indices, counts=counts)
+
+    def save(self, directory: Union[str, Path]):
+        """Writes the arrays as .npy files and the names and values as JSON, see `load`"""
+        os.makedirs(directory, exist_ok=True)
+        for name in (*ARRAYS, 'counts'):
+            np.save(os.path.join(directory, f'{name}.npy'), getattr(self, name))
+        for i, (_, codes) in enumerate(self.columns.values()):
+            np.save(os.path.join(directory, f'column_{i}.npy'), codes)
+        with open(os.path.join(directory, 'graph.json'), 'w', encoding='utf-8') as f:
+            json.dump(dict(format=COMPACT_FORMAT, version=COMPACT_VERSION, names=self.names,
+                           columns=[dict(key=k, values=values) for k, (values, _) in self.columns.items()]), f)
+
+    @classmethod
+    def load(cls, directory: Union[str, Path], mmap: bool = True) -> 'CompactGraph':
+        """A graph written by `save`, with `mmap` its arrays are paged in from the files when they are used"""
+        if np is None:
+            raise ImportError('CompactGraph needs numpy, install it with `pip install numpy`')
+        with open(os.path.join(directory, 'graph.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format') != COMPACT_FORMAT or meta.get('version') != COMPACT_VERSION:
+            raise ValueError(f'{directory} is not a compact graph written by this version')
+        mode = 'r' if mmap else None
+        arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mode) for name in ARRAYS}
+        if os.path.isfile(os.path.join(directory, 'counts.npy')):  # written since call sites are counted
+            arrays['counts'] = np.load(os.path.join(directory, 'counts.npy'), mmap_mode=mode)
+        columns = {c['key']: (c['values'], np.load(os.path.join(directory, f'column_{i}.npy'), mmap_mode=mode))
+                   for i, c in enumerate(meta['columns'])}
+        return cls(meta['names'], columns, **arrays)
+
+    def to_networkx(self) -> nx.DiGraph:
+        return self.subgraph(self.names)
+
+    @property
+    def nbytes(self) -> int:
+        # arrays and interned values, the strings themselves estimated at 64 bytes each
+        arrays = self.indptr.nbytes + self.indices.nbytes + self.rindptr.nbytes + self.rindices.nbytes + \
+            self.counts.nbytes
+        values = len(self.names) + sum(len(values) for values, _ in self.columns.values())
+        return arrays + sum(codes.nbytes for _, codes in self.columns.values()) + values * 64 + len(self.index) * 100
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, n):
+        return n in self.index
+
+    def number_of_nodes(self) -> int:
+        return len(self.names)
+
+    def number_of_edges(self) -> int:
+        return len(self.indices)
+
+    def node_data(self, n) -> Dict:
+        i = self.index[n]
+        data = dict()
+        for k, (values, codes) in self.columns.items():
+            code = int(codes[i])
+            if code >= 0:
+                data[k] = values[code]
+        return data
+
+    def node_data_list(self, ids: Optional[Iterable[int]] = None) -> List[Dict]:
+        """Data dicts of all nodes (or of the node numbers `ids`), a column at a time instead of a node at a time"""
+        ids = np.arange(len(self.names)) if ids is None else np.asarray(ids, dtype=np.int64)
+        data = [dict() for _ in range(len(ids))]
+        for k, (values, codes) in self.columns.items():
+            for d, code in zip(data, codes[ids].tolist()):
+                if code >= 0:
+                    d[k] = values[code]
+        return data
+
+    def _successor_ids(self, i: int) -> 'np.ndarray':
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def _predecessor_ids(self, i: int) -> 'np.ndarray':
+        return self.rindices[self.rindptr[i]:self.rindptr[i + 1]]
+
+    def successors(self, n) -> List[Hashable]:
+        return [self.names[j] for j in self._successor_ids(self.index[n]).tolist()]
+
+    def predecessors(self, n) -> List[Hashable]:
+        return [self.names[j] for j in self._predecessor_ids(self.index[n]).tolist()]
+
+    def has_edge(self, a, b) -> bool:
+        if a not in self.index or b not in self.index:
+            return False
+        return bool(np.any(self._successor_ids(self.index[a]) == self.index[b]))
+
+    def out_edges(self, n) -> List[Tuple[Hashable, Hashable]]:
+        return [(n, b) for b in self.successors(n)]
+
+    def in_edges(self, n) -> List[Tuple[Hashable, Hashable]]:
+        return [(a, n) for a in self.predecessors(n)]
+
+    def adjacency(self) -> Iterator[Tuple[Hashable, List[Hashable]]]:
+        names = self.names
+        indptr = self.indptr.tolist()
+        indices = self.indices.tolist()
+        for i, n in enumerate(names):
+            yield n, [names[j] for j in indices[indptr[i]:indptr[i + 1]]]
+
+    def edge_ids(self) -> Tuple['np.ndarray', 'np.ndarray']:
+        # source and target number of every call
+        sources = np.repeat(np.arange(len(self.names), dtype=np.int32), np.diff(self.indptr))
+        return sources, self.indices
+
+    def ids(self, nodes: Iterable[Hashable]) -> 'np.ndarray':
+        return np.fromiter((self.index[n] for n in nodes if n in self.index), dtype=np.int64)
+
+    def reachable_ids(self, sources: 'np.ndarray', reverse: bool = False, include_sources: bool = True) -> 'np.ndarray':
+        """Mask of the nodes reachable from the node numbers `sources`, a vectorized breadth-first search
+
+        Each step gathers the neighbors of the whole frontier from the CSR arrays at once. Without `include_sources` a
+        source is only part of the result if it is reachable from a source (e.g. on a cycle).
+        """
+        indptr, indices = (self.rindptr, self.rindices) if reverse else (self.indptr, self.indices)
+        seen = np.zeros(len(self.names), dtype=bool)
+        frontier = np.unique(np.asarray(sources, dtype=np.int64))
+        if include_sources:
+            seen[frontier] = True
+        while frontier.size:
+            starts = indptr[frontier]
+            lengths = indptr[frontier + 1] - starts
+            total = int(lengths.sum())
+            if not total:
+                break
+            # positions of the neighbors of every frontier node in `indices`, one arange instead of one slice each
+            offsets = np.cumsum(lengths) - lengths
+            neighbors = indices[np.arange(total) - np.repeat(offsets - starts, lengths)]
+            frontier = np.unique(neighbors[~seen[neighbors]])
+            seen[frontier] = True
+        return seen
+
+    def reachable(self, sources: Iterable[Hashable], reverse: bool = False) -> Set[Hashable]:
+        return {self.names[i] for i in np.flatnonzero(self.reachable_ids(self.ids(sources), reverse)).tolist()}
+
+    def subgraph(self, nodes: Iterable[Hashable]) -> nx.DiGraph:
+        """A networkx graph of `nodes` and the calls between them, filtered views are small enough to be mutable"""
+        ids = np.unique(self.ids(nodes))
+        keep = np.zeros(len(self.names), dtype=bool)
+        keep[ids] = True
+        graph = nx.DiGraph()
+        graph.add_nodes_from((self.names[i], dict(data=d)) for i, d in zip(ids.tolist(), self.node_data_list(ids)))
+        sources, targets = self.edge_ids()
+        inside = keep[sources] & keep[targets]
+        graph.add_edges_from((self.names[a], self.names[b], dict(count=c))
+                             for a, b, c in zip(sources[inside].tolist(), targets[inside].tolist(),
+                                                self.counts[inside].tolist()))
+        return graph
+
+    def copy(self) -> 'CompactGraph':
+        # read-only, a copy would be the same graph
+        return self
+
+
+class CompactReachability:
+    """Callers and callees on a CompactGraph, with the interface of ReachabilityIndex
+
+    Every query is a vectorized breadth-first search over the CSR arrays, nothing is precomputed, so the index costs no
+    memory on graphs where the bitsets of the condensation would not fit.
+    """
+
+    def __init__(self, graph: CompactGraph):
+        self.graph = graph
+
+    def _reach(self, node, reverse: bool) -> Set:
+        graph = self.graph
+        i = graph.index[node]
+        # start from the neighbors, the node itself is only reached again if it is on a cycle
+        neighbors = graph._predecessor_ids(i) if reverse else graph._successor_ids(i)
+        mask = graph.reachable_ids(neighbors, reverse)
+        return {graph.names[j] for j in np.flatnonzero(mask).tolist()}
+
+    def ancestors(self, node) -> Set:
+        """All direct and indirect callers of node (node itself only if it is on a cycle)"""
+        return self._reach(node, reverse=True)
+
+    def descendants(self, node) -> Set:
+        """All direct and indirect callees of node (node itself only if it is on a cycle)"""
+        return self._reach(node, reverse=False)
+
+    def is_ancestor(self, ancestor, node) -> bool:
+        return ancestor in self.ancestors(node)
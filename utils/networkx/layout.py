@@ -0,0 +1,75 @@
+from collections import defaultdict
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+import networkx as nx
+
+
+def get_layers(graph: nx.DiGraph) -> Dict[Hashable, int]:
+    # longest path layering of the condensation, the functions of a recursion share a layer
+    condensation = nx.condensation(graph)
+    members = condensation.graph['mapping']
+    layer = dict()
+    for c in nx.topological_sort(condensation):
+        layer[c] = max((layer[p] + 1 for p in condensation.predecessors(c)), default=0)
+    return {n: layer[c] for n, c in members.items()}
+
+
+def get_layered_layout(graph: nx.DiGraph, width: Optional[Callable[[Hashable], float]] = None,
+                       rank_sep: float = 150, node_sep: float = 50,
+                       sweeps: int = 4) -> Dict[Hashable, Tuple[float, float]]:
+    """Top to bottom layered (Sugiyama style) positions of the nodes, callers above their callees
+
+    Nodes are put on the layer of their longest call chain from a root, the order within the layers is improved by a
+    few barycenter sweeps down and up to reduce crossings, and each node is then placed below the mean position of its
+    callers without overlapping its neighbors. Every step is linear in the number of edges (up to sorting the layers),
+    so it stays usable where the browser side dagre layout does not.
+    """
+    if width is None:
+        def width(_n):
+            return 0
+    layer_of = get_layers(graph)
+    layers = defaultdict(list)  # type: Dict[int, List[Hashable]]
+    for n in graph.nodes:
+        layers[layer_of[n]].append(n)
+    layers = [layers[i] for i in range(len(layers))]
+
+    # order within the layers
+    position = dict()
+    for nodes in layers:
+        for i, n in enumerate(nodes):
+            position[n] = i
+    for sweep in range(sweeps):
+        down = sweep % 2 == 0
+        for nodes in (layers[1:] if down else reversed(layers[:-1])):
+            neighbors = graph.predecessors if down else graph.successors
+            barycenter = dict()
+            for n in nodes:
+                ps = [position[m] for m in neighbors(n) if layer_of[m] != layer_of[n]]
+                barycenter[n] = sum(ps) / len(ps) if ps else position[n]
+            nodes.sort(key=lambda n: barycenter[n])
+            for i, n in enumerate(nodes):
+                position[n] = i
+
+    # coordinates, each layer is packed left to right and centered below its callers
+    x = dict()
+    for index, nodes in enumerate(layers):
+        desired = []
+        for n in nodes:
+            ps = [x[m] for m in graph.predecessors(n) if m in x]
+            desired.append(sum(ps) / len(ps) if ps else None)
+        placed = []
+        left = None
+        for n, d in zip(nodes, desired):
+            minimum = left + node_sep + width(n) / 2 if left is not None else None
+            xn = d if d is not None else (minimum if minimum is not None else 0)
+            if minimum is not None and xn < minimum:
+                xn = minimum
+            placed.append(xn)
+            left = xn + width(n) / 2
+        # the packing only pushes to the right, shift the layer back so that it is centered where it wanted to be
+        wanted = [d for d in desired if d is not None]
+        shift = (sum(wanted) - sum(p for p, d in zip(placed, desired) if d is not None)) / len(wanted) if wanted else \
+            -(placed[0] + placed[-1]) / 2
+        for n, xn in zip(nodes, placed):
+            x[n] = xn + shift
+    return {n: (x[n], layer_of[n] * rank_sep) for n in graph.nodes}
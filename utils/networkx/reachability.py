@@ -0,0 +1,98 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Set, Tuple
+
+import networkx as nx
+
+
+def _bits(components) -> int:
+    # one pass over a bytearray, or-ing single bits into an int copies it for every component
+    components = list(components)
+    if not components:
+        return 0
+    buffer = bytearray(max(components) // 8 + 1)
+    for c in components:
+        buffer[c >> 3] |= 1 << (c & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def _decode(bits: int) -> List[int]:
+    # positions of the set bits, lowest first
+    return [i for i, b in enumerate(reversed(bin(bits)[2:])) if b == '1']
+
+
+class ReachabilityIndex:
+    """Answers "all callers of X" and "all callees of X" on a call graph with cycles
+
+    The graph is condensed into its strongly connected components (recursion, mutual recursion), which form a DAG.
+    A query walks the DAG once and keeps the components it reached as an int bitset over component ids. The bitsets of
+    recent queries stay in an LRU cache of at most `max_bytes`, a later walk stops at every component whose bitset is
+    cached and takes it over. Bitsets are not kept for every component on the way: on a graph with a hub every function
+    calls (a logger) that would take memory quadratic in the number of functions.
+    """
+
+    def __init__(self, graph: nx.DiGraph, max_bytes: int = 64 << 20):
+        self.graph = graph
+        self.condensed = nx.condensation(graph)
+        self.component = self.condensed.graph['mapping']  # type: Dict[Hashable, int]
+        self.members = {c: data['members'] for c, data in self.condensed.nodes(data=True)}  # type: Dict[int, Set]
+        self.max_bytes = max_bytes
+        self.size = 0  # bytes of the cached bitsets
+        self._cache = OrderedDict()  # type: OrderedDict[Tuple[bool, int], int]  # by direction and component
+        self._lock = threading.Lock()  # the index of a project is shared by the sessions showing it
+
+    def _reach(self, component: int, reverse: bool) -> int:
+        with self._lock:
+            bits = self._cache.get((reverse, component))
+            if bits is not None:
+                self._cache.move_to_end((reverse, component))
+                return bits
+        neighbors = self.condensed.predecessors if reverse else self.condensed.successors
+        bits = 0
+        reached = set()
+        stack = [component]
+        while stack:
+            for n in neighbors(stack.pop()):
+                if n in reached:
+                    continue
+                reached.add(n)
+                known = self._cache.get((reverse, n))
+                if known is not None:
+                    bits |= known  # the walk does not go on below a component whose bitset is known
+                else:
+                    stack.append(n)
+        bits |= _bits(reached)
+        with self._lock:
+            if (reverse, component) not in self._cache:
+                self._cache[reverse, component] = bits
+                self.size += sys.getsizeof(bits)
+            while self.size > self.max_bytes and len(self._cache) > 1:
+                self.size -= sys.getsizeof(self._cache.popitem(last=False)[1])
+        return bits
+
+    def _nodes(self, node, bits: int) -> Set:
+        c = self.component[node]
+        nodes = set()
+        for r in _decode(bits):
+            nodes.update(self.members[r])
+        if len(self.members[c]) > 1:  # inside a cycle every member reaches every other one
+            nodes.update(self.members[c])
+        nodes.discard(node)
+        if len(self.members[c]) > 1 or self.graph.has_edge(node, node):
+            nodes.add(node)
+        return nodes
+
+    def ancestors(self, node) -> Set:
+        """All direct and indirect callers of node (node itself only if it is on a cycle)"""
+        return self._nodes(node, self._reach(self.component[node], reverse=True))
+
+    def descendants(self, node) -> Set:
+        """All direct and indirect callees of node (node itself only if it is on a cycle)"""
+        return self._nodes(node, self._reach(self.component[node], reverse=False))
+
+    def is_ancestor(self, ancestor, node) -> bool:
+        a, c = self.component[ancestor], self.component[node]
+        if a == c:
+            return ancestor != node or len(self.members[c]) > 1 or self.graph.has_edge(node, node)
+        return bool(self._reach(c, reverse=True) >> a & 1)
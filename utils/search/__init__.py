@@ -0,0 +1,90 @@
+import bisect
+import re
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, List, Set
+
+
+class SearchIndex:
+    """Case insensitive name index, built once per graph and queried on every search
+
+    Substring queries intersect the posting lists of the query's n-grams and only verify the few candidates left,
+    prefix queries bisect a sorted list of every name and of each `::` suffix of it (so `add` finds
+    `AddNumber::add(int, int)` while typing), regex and fuzzy (in-order characters) queries scan the lowered names.
+    """
+
+    def __init__(self, names: Iterable[Hashable], n: int = 3):
+        self.n = n
+        self.names = [name for name in names]  # type: List[Hashable]
+        self.lowered = [str(name).lower() for name in self.names]
+        grams = defaultdict(set)  # type: Dict[str, Set[int]]
+        prefixes = []
+        for i, name in enumerate(self.lowered):
+            for j in range(len(name) - n + 1):
+                grams[name[j:j + n]].add(i)
+            prefixes.append((name, i))
+            start = name.find('::')
+            while start != -1:
+                prefixes.append((name[start + 2:], i))
+                start = name.find('::', start + 2)
+        self.grams = {g: sorted(ids) for g, ids in grams.items()}
+        prefixes.sort()
+        self.prefix_keys = [p for p, _ in prefixes]
+        self.prefix_ids = [i for _, i in prefixes]
+
+    def __len__(self):
+        return len(self.names)
+
+    def _ids(self, ids: Iterable[int]) -> Set[Hashable]:
+        return {self.names[i] for i in ids}
+
+    def substring(self, query: str) -> Set[Hashable]:
+        query = query.lower()
+        if len(query) < self.n:
+            return self._ids(i for i, name in enumerate(self.lowered) if query in name)
+        postings = []
+        for j in range(len(query) - self.n + 1):
+            ids = self.grams.get(query[j:j + self.n])
+            if ids is None:
+                return set()
+            postings.append(ids)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for ids in postings[1:]:
+            candidates.intersection_update(ids)
+            if not candidates:
+                return set()
+        return self._ids(i for i in candidates if query in self.lowered[i])
+
+    def prefix(self, query: str, limit: int = 0) -> Set[Hashable]:
+        query = query.lower()
+        start = bisect.bisect_left(self.prefix_keys, query)
+        found = set()
+        for k in range(start, len(self.prefix_keys)):
+            if not self.prefix_keys[k].startswith(query):
+                break
+            found.add(self.prefix_ids[k])
+            if limit and len(found) >= limit:
+                break
+        return self._ids(found)
+
+    def regex(self, pattern: str) -> Set[Hashable]:
+        try:
+            expression = re.compile(pattern, re.IGNORECASE)
+        except re.error:
+            return set()
+        return self._ids(i for i, name in enumerate(self.lowered) if expression.search(name))
+
+    def fuzzy(self, query: str) -> Set[Hashable]:
+        expression = re.compile('.*?'.join(re.escape(c) for c in query.lower()))
+        return self._ids(i for i, name in enumerate(self.lowered) if expression.search(name))
+
+    def search(self, query: str) -> Set[Hashable]:
+        # `re:<pattern>` searches with a regular expression, `fuzzy:<chars>` fuzzy, `<prefix>*` by prefix unless a
+        # name contains the query itself (`operator*`), everything else (`~Widget`) is a substring search
+        if query.startswith('re:'):
+            return self.regex(query[3:])
+        if query.startswith('fuzzy:'):
+            return self.fuzzy(query[6:])
+        if query.endswith('*') and len(query) > 1:
+            return self.substring(query) or self.prefix(query[:-1])
+        return self.substring(query)
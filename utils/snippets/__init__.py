@@ -0,0 +1,93 @@
+import mmap
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from utils.metrics import METRICS
+
+
+class LineIndex:
+    """Byte offsets of the lines of one version (mtime and size) of a file"""
+
+    def __init__(self, filename: str, stamp: Tuple[int, int], offsets: array):
+        self.filename = filename
+        self.stamp = stamp
+        self.offsets = offsets  # start of every line, and the end of the file
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @staticmethod
+    def build(filename: str) -> 'LineIndex':
+        st = os.stat(filename)
+        offsets = array('q', [0])
+        if st.st_size:
+            with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                position = m.find(b'\n')
+                while position != -1:
+                    offsets.append(position + 1)
+                    position = m.find(b'\n', position + 1)
+                if offsets[-1] != st.st_size:  # last line without a newline
+                    offsets.append(st.st_size)
+        return LineIndex(filename, (st.st_mtime_ns, st.st_size), offsets)
+
+
+class SnippetCache:
+    """Serves windows of source lines instead of whole files
+
+    The line offsets of the most recently used `max_files` files are kept in an LRU cache and dropped when the mtime
+    or size of a file changes. A window is read through mmap from the offsets of its first and last line, so a tap on
+    a function in a file with tens of thousands of lines only reads and sends the lines around it.
+    """
+
+    def __init__(self, max_files: int = 64, context: int = 30, max_lines: int = 500):
+        self.max_files = max_files
+        self.context = context  # lines shown above and below a function
+        self.max_lines = max_lines  # longest window, longer functions are cut and paged
+        self.lock = threading.Lock()
+        self._indexes = OrderedDict()  # type: OrderedDict[str, LineIndex]
+
+    def index(self, filename: str) -> LineIndex:
+        filename = os.path.abspath(filename)
+        st = os.stat(filename)
+        with self.lock:
+            index = self._indexes.get(filename)
+            if index is not None and index.stamp == (st.st_mtime_ns, st.st_size):
+                self._indexes.move_to_end(filename)
+                METRICS.inc('callgraph_snippet_cache_total', result='hit')
+                return index
+        METRICS.inc('callgraph_snippet_cache_total', result='miss')
+        index = LineIndex.build(filename)
+        with self.lock:
+            self._indexes[filename] = index
+            self._indexes.move_to_end(filename)
+            while len(self._indexes) > self.max_files:
+                self._indexes.popitem(last=False)
+        return index
+
+    def lines(self, filename: str, first: int, last: int) -> Tuple[List[str], int, int, int]:
+        """Lines `first` to `last` (1-based, inclusive, clamped to the file), their range and the number of lines"""
+        index = self.index(filename)
+        total = len(index)
+        first = max(1, first)
+        last = min(total, last)
+        if not total or last < first:
+            return [], first, first - 1, total
+        with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            data = m[index.offsets[first - 1]:index.offsets[last]]
+        # split on newlines only, as LineIndex does (splitlines also breaks at form feeds, \x1c-\x1e, \u2028, ...)
+        lines = [line.rstrip('\r') for line in data.decode('utf-8', errors='replace').split('\n')]
+        if lines[-1] == '':  # the newline of the last line
+            lines.pop()
+        return lines, first, last, total
+
+    def window(self, filename: str, start: int, end: Optional[int] = None) -> Dict:
+        """The lines of a function (`start` to `end`) with some context, at most `max_lines` of them"""
+        end = max(start, end or start)
+        first = max(1, start - self.context)
+        last = min(end + self.context, first + self.max_lines - 1)
+        lines, first, last, total = self.lines(filename, first, last)
+        return dict(code='\n'.join(lines), first=first, last=last, total=total, start=start, end=end,
+                    filename=filename)
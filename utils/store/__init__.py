@@ -0,0 +1,286 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+import networkx as nx
+
+from utils.metrics import METRICS
+from utils.networkx.compact import CompactGraph
+
+NODE_BYTES = 1000  # about the memory of a graph node with its data dict
+EDGE_BYTES = 120
+# entry values that only live in the process that made them, they are rebuilt when another worker needs them
+LOCAL_KEYS = ('project', 'reachability', 'elements', 'aggregation', 'positions', 'loading')
+GRAPH_TYPES = (nx.Graph, CompactGraph)
+
+Key = Tuple[Hashable, Hashable]
+
+
+def estimate_size(graph: nx.Graph) -> int:
+    # rough memory of a graph and the data of its nodes
+    if isinstance(graph, CompactGraph):
+        return graph.nbytes
+    return graph.number_of_nodes() * NODE_BYTES + graph.number_of_edges() * EDGE_BYTES
+
+
+def get_graphs(entry: Dict) -> Dict[int, nx.Graph]:
+    return {id(v): v for v in entry.values() if isinstance(v, GRAPH_TYPES)}
+
+
+class MemoryStore:
+    """Per session and project entries of the app, kept in this process
+
+    Least recently used entries are evicted once there are more than `max_entries` of them or their graphs take more
+    than `max_bytes` (estimated, a graph shared by several entries counts once), entries not used for `ttl` seconds
+    expire. `on_evict` is called with every entry that is evicted, expires or is popped (not when `put` replaces it),
+    e.g. to release the load it waits for.
+    """
+
+    def __init__(self, max_entries: int = 64, max_bytes: int = 2 << 30, ttl: Optional[float] = 24 * 3600,
+                 on_evict: Optional[Callable[[Dict], None]] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.lock = threading.RLock()
+        self._entries = OrderedDict()  # type: OrderedDict[Key, Dict]
+        self._graphs = dict()  # type: Dict[Key, Dict[int, nx.Graph]]
+        self._references = dict()  # type: Dict[int, List[int]]  # entries using a graph and its size when added
+        self._used = dict()  # type: Dict[Key, float]
+        self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Key):
+        return key in self._entries
+
+    def get(self, session, path) -> Optional[Dict]:
+        with self.lock:
+            self._expire()
+            entry = self._entries.get((session, path))
+            if entry is not None:
+                self._entries.move_to_end((session, path))
+                self._used[session, path] = time.monotonic()
+            return entry
+
+    def put(self, session, path, entry: Dict):
+        with self.lock:
+            key = (session, path)
+            old = self._entries.get(key)
+            if old is not None and old is not entry:
+                self._drop(key, evict=False)
+            self._release(key)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._graphs[key] = get_graphs(entry)
+            for i, graph in self._graphs[key].items():
+                if i not in self._references:
+                    self._references[i] = [0, estimate_size(graph)]
+                    self.size += self._references[i][1]
+                self._references[i][0] += 1
+            self._used[key] = time.monotonic()
+            self._evict(keep=key)
+
+    def pop(self, session, path) -> Optional[Dict]:
+        with self.lock:
+            return self._drop((session, path))
+
+    def sizes(self) -> Dict[Key, int]:
+        # estimated memory of the graphs of every entry, a graph shared by several entries counts for each of them
+        with self.lock:
+            return {key: sum(self._references[i][1] for i in graphs) for key, graphs in self._graphs.items()}
+
+    def _drop(self, key: Key, evict: bool = True) -> Optional[Dict]:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self._release(key)
+        self._used.pop(key, None)
+        if evict and self.on_evict is not None:
+            self.on_evict(entry)
+        return entry
+
+    def _release(self, key: Key):
+        for i in self._graphs.pop(key, {}):
+            self._references[i][0] -= 1
+            if not self._references[i][0]:
+                self.size -= self._references.pop(i)[1]
+
+    def _expire(self):
+        if self.ttl is None:
+            return
+        now = time.monotonic()
+        for key in [k for k, used in self._used.items() if now - used > self.ttl]:
+            self._drop(key)
+
+    def _evict(self, keep: Key):
+        self._expire()
+        # the entry just stored stays, even if it alone is above the budget
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self.size > self.max_bytes):
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            self._drop(key)
+
+
+class GraphRef:
+    # stands for a graph in a pickled entry, the graph itself is stored once in the graphs table
+    def __init__(self, token: str):
+        self.token = token
+
+
+class SQLiteStore(MemoryStore):
+    """Entries shared by all worker processes through a SQLite file, each process keeps its recent ones in memory
+
+    Every `put` writes the small state of the entry (without its process local parts, see LOCAL_KEYS) and bumps its
+    stamp, its graphs are written separately and only when they are new or changed size, so a tap does not pickle the
+    whole graph again. A graph is stored under the digest of its pickle, the same graph put by several entries or
+    workers is kept once, and it is removed when no entry refers to it anymore. `get` returns the entry from memory
+    while its stamp did not change, otherwise it loads what another worker stored and passes it to `on_load` (e.g. to
+    reapply view state to the graph data). Entries and graphs not used for `ttl` seconds are removed from the file as
+    well.
+    """
+
+    def __init__(self, filename: str, on_load: Optional[Callable[[Dict], None]] = None, **kwargs):
+        super().__init__(**kwargs)
+        directory = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(directory, exist_ok=True)
+        self.filename = filename
+        self.on_load = on_load
+        self._local = threading.local()  # sqlite connections must not be shared between threads
+        self._stamps = dict()  # type: Dict[Key, int]
+        # token of every graph written or read by this process and its size then
+        self._tokens = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary[nx.Graph, Tuple[str, Tuple]]
+        connection = self._connection()
+        connection.execute('CREATE TABLE IF NOT EXISTS entries ('
+                           'session TEXT, path TEXT, stamp INTEGER, updated REAL, entry BLOB, '
+                           'PRIMARY KEY (session, path))')
+        connection.execute('CREATE TABLE IF NOT EXISTS graphs (token TEXT PRIMARY KEY, updated REAL, graph BLOB)')
+        connection.execute('CREATE TABLE IF NOT EXISTS entry_graphs ('
+                           'session TEXT, path TEXT, token TEXT, PRIMARY KEY (session, path, token))')
+        connection.execute('CREATE INDEX IF NOT EXISTS entry_graphs_token ON entry_graphs (token)')
+        connection.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.filename, timeout=60)
+            connection.execute('PRAGMA journal_mode=WAL')
+        return connection
+
+    def _write_graph(self, graph: nx.Graph, connection: sqlite3.Connection, now: float) -> str:
+        size = (graph.number_of_nodes(), graph.number_of_edges())
+        known = self._tokens.get(graph)
+        if known is not None and known[1] == size:
+            # unchanged since this process wrote or read it, unless no entry refers to it anymore
+            if connection.execute('UPDATE graphs SET updated = ? WHERE token = ?', (now, known[0])).rowcount:
+                return known[0]
+        data = pickle.dumps(graph, protocol=pickle.HIGHEST_PROTOCOL)
+        token = hashlib.sha1(data).hexdigest()
+        if not connection.execute('UPDATE graphs SET updated = ? WHERE token = ?', (now, token)).rowcount:
+            connection.execute('INSERT OR IGNORE INTO graphs (token, updated, graph) VALUES (?, ?, ?)',
+                               (token, now, zlib.compress(data, 1)))
+        self._tokens[graph] = (token, size)
+        return token
+
+    def _pack(self, entry: Dict, connection: sqlite3.Connection, now: float) -> Tuple[bytes, Set[str]]:
+        shared = dict()
+        tokens = set()
+        for k, v in entry.items():
+            if k in LOCAL_KEYS:
+                continue
+            if isinstance(v, GRAPH_TYPES):
+                v = GraphRef(self._write_graph(v, connection, now))
+                tokens.add(v.token)
+            shared[k] = v
+        return pickle.dumps(shared, protocol=pickle.HIGHEST_PROTOCOL), tokens
+
+    def _unpack(self, data: bytes, connection: sqlite3.Connection) -> Dict:
+        entry = pickle.loads(data)
+        graphs = dict()
+        for k, v in entry.items():
+            if isinstance(v, GraphRef):
+                if v.token not in graphs:
+                    row = connection.execute('SELECT graph FROM graphs WHERE token = ?', (v.token,)).fetchone()
+                    graph = pickle.loads(zlib.decompress(row[0])) if row is not None else None
+                    if graph is not None:
+                        self._tokens[graph] = (v.token, (graph.number_of_nodes(), graph.number_of_edges()))
+                    graphs[v.token] = graph
+                entry[k] = graphs[v.token]
+        return entry
+
+    def get(self, session, path) -> Optional[Dict]:
+        with self.lock, METRICS.span('store', operation='get'):
+            connection = self._connection()
+            row = connection.execute('SELECT stamp FROM entries WHERE session = ? AND path = ?',
+                                     (str(session), str(path))).fetchone()
+            if row is None:
+                self.pop(session, path)
+                return None
+            entry = super().get(session, path)
+            if entry is not None and self._stamps.get((session, path)) == row[0]:
+                return entry
+            row = connection.execute('SELECT stamp, entry FROM entries WHERE session = ? AND path = ?',
+                                     (str(session), str(path))).fetchone()
+            if row is None:
+                return None
+            entry = self._unpack(row[1], connection)
+            if self.on_load is not None:
+                self.on_load(entry)
+            super().put(session, path, entry)
+            self._stamps[session, path] = row[0]
+            return entry
+
+    def put(self, session, path, entry: Dict):
+        with self.lock, METRICS.span('store', operation='put'):
+            connection = self._connection()
+            now = time.time()
+            data, tokens = self._pack(entry, connection, now)
+            connection.execute('INSERT INTO entries (session, path, stamp, updated, entry) VALUES (?, ?, 1, ?, ?) '
+                               'ON CONFLICT (session, path) DO UPDATE SET '
+                               'stamp = stamp + 1, updated = excluded.updated, entry = excluded.entry',
+                               (str(session), str(path), now, data))
+            self._refer(connection, str(session), str(path), tokens)
+            if self.ttl is not None:
+                connection.execute('DELETE FROM entries WHERE updated < ?', (now - self.ttl,))
+                connection.execute('DELETE FROM entry_graphs WHERE (session, path) NOT IN '
+                                   '(SELECT session, path FROM entries)')
+                connection.execute('DELETE FROM graphs WHERE updated < ?', (now - self.ttl,))
+            connection.commit()
+            self._stamps[session, path] = connection.execute(
+                'SELECT stamp FROM entries WHERE session = ? AND path = ?', (str(session), str(path))).fetchone()[0]
+            super().put(session, path, entry)
+
+    @staticmethod
+    def _refer(connection: sqlite3.Connection, session: str, path: str, tokens: Set[str]):
+        # the graphs an entry no longer refers to are deleted once no other entry refers to them either
+        old = {token for token, in connection.execute('SELECT token FROM entry_graphs WHERE session = ? AND path = ?',
+                                                      (session, path))}
+        connection.executemany('DELETE FROM entry_graphs WHERE session = ? AND path = ? AND token = ?',
+                               [(session, path, token) for token in old - tokens])
+        connection.executemany('INSERT INTO entry_graphs (session, path, token) VALUES (?, ?, ?)',
+                               [(session, path, token) for token in tokens - old])
+        connection.executemany('DELETE FROM graphs WHERE token = ? AND token NOT IN '
+                               '(SELECT token FROM entry_graphs WHERE token = ?)',
+                               [(token, token) for token in old - tokens])
+
+    def _drop(self, key: Key, evict: bool = True) -> Optional[Dict]:
+        self._stamps.pop(key, None)
+        return super()._drop(key, evict)
+
+
+def get_store(url: Optional[str] = None, on_load: Optional[Callable[[Dict], None]] = None, **kwargs) -> MemoryStore:
+    """`memory` (the default) keeps entries in this process, `sqlite:<filename>` shares them between processes"""
+    if not url or url == 'memory':
+        return MemoryStore(**kwargs)
+    if url.startswith('sqlite:'):
+        return SQLiteStore(url[len('sqlite:'):], on_load=on_load, **kwargs)
+    raise ValueError(f'unknown store {url}, use memory or sqlite:<filename>')